@@ -0,0 +1,313 @@
+"""
+The "backbone" of the autoregressive model is the network that summarises all of the preceding timesteps into a
+single vector h for each timestep, which the output heads in model_autoregressive then use to predict the next
+timestep. Three backbones are available (selected by model_autoregressive.BACKBONE):
+
+- LSTMBackbone: the original LSTM, which has to step through a sequence one timestep at a time.
+- DilatedConvBackbone: a stack of dilated causal convolutions, as in WaveNet.
+- CausalTransformerBackbone: a stack of causally-masked self-attention layers.
+
+The convolutional and transformer backbones compute every timestep of a training sequence in parallel. All three
+share the same interface, which is used both for training and for sampling one timestep at a time:
+
+    backbone(inputs, lengths) -> h                   for inputs of shape [batch_size, num_timesteps, input_size]
+    backbone.initial_state(batch_size) -> state
+    backbone.step(inputs, prev_state) -> h, state    for inputs of shape [batch_size, input_size]
+    backbone.prime(inputs, lengths) -> state         the state after each sequence, computed in one parallel pass
+
+where the inputs are the embedded timesteps (see model_autoregressive.InputEmbedding). For the parallel backbones,
+the sampling state is a cache of whatever each layer needs from previous timesteps, so each new timestep only costs
+one layer's worth of computation for one position.
+"""
+
+import numpy as np
+import tensorflow as tf
+import sonnet as snt
+
+
+class GateInputLSTM(snt.RNNCore):
+    """
+    An LSTM whose inputs have already been projected into the space of its gate pre-activations (by InputEmbedding),
+    so only the recurrent part of the projection is computed at each step. Otherwise, it is the same as snt.LSTM
+    (including the forget gate bias of 1), so the weights of a snt.LSTM can be converted to this module exactly.
+    """
+    def __init__(self, hidden_size, initializer_stddev, forget_bias=1.0, name='lstm'):
+        super(GateInputLSTM, self).__init__(name=name)
+        self._hidden_size = hidden_size
+        self._initializer = tf.truncated_normal_initializer(stddev=initializer_stddev)
+        self._forget_bias = forget_bias
+
+    def _build(self, input_gates, prev_state):
+        prev_hidden, prev_cell = prev_state
+        w_h = tf.get_variable('w_h_gates', [self._hidden_size, 4 * self._hidden_size], initializer=self._initializer)
+        b = tf.get_variable('b_gates', [4 * self._hidden_size], initializer=tf.zeros_initializer())
+
+        gates = input_gates + tf.matmul(prev_hidden, w_h) + b
+        i, j, f, o = tf.split(gates, 4, axis=1)  # Input gate, new input, forget gate, output gate.
+        next_cell = tf.sigmoid(f + self._forget_bias) * prev_cell + tf.sigmoid(i) * tf.tanh(j)
+        next_hidden = tf.tanh(next_cell) * tf.sigmoid(o)
+        return next_hidden, snt.LSTMState(next_hidden, next_cell)
+
+    @property
+    def state_size(self):
+        return snt.LSTMState(tf.TensorShape([self._hidden_size]), tf.TensorShape([self._hidden_size]))
+
+    @property
+    def output_size(self):
+        return tf.TensorShape([self._hidden_size])
+
+
+class LSTMBackbone(object):
+    # Not a sonnet module itself, so that the LSTM's variables keep the names they had before backbones existed.
+    def __init__(self, num_units):
+        self.cell = GateInputLSTM(num_units, initializer_stddev=1.0 / np.sqrt(100 + num_units))
+        self.input_size = 4 * num_units  # The embedded inputs are the input parts of the LSTM's gate activations.
+        self.output_size = num_units
+
+    def _run(self, inputs, lengths):
+        return tf.nn.dynamic_rnn(
+            cell=self.cell,
+            inputs=inputs,
+            initial_state=self.cell.initial_state(tf.shape(inputs)[0]),  # Any batch size can be used.
+            sequence_length=lengths
+        )
+
+    def __call__(self, inputs, lengths):
+        h, _ = self._run(inputs, lengths)
+        return h
+
+    def prime(self, inputs, lengths):
+        _, final_state = self._run(inputs, lengths)  # dynamic_rnn keeps the state of each sequence at its end.
+        return final_state
+
+    def initial_state(self, batch_size):
+        return self.cell.initial_state(batch_size)
+
+    def step(self, inputs, prev_state):
+        return self.cell(inputs, prev_state)
+
+
+def gather_timesteps(x, positions):
+    # Gathers x[i, positions[i, j]] for x of shape [batch_size, num_timesteps, size], giving [batch_size, n, size].
+    batch = tf.tile(tf.expand_dims(tf.range(tf.shape(x)[0]), 1), [1, tf.shape(positions)[1]])
+    return tf.gather_nd(x, tf.stack([batch, positions], axis=-1))
+
+
+class DilatedConvBackbone(snt.AbstractModule):
+    """
+    Each layer applies a gated activation (tanh(filter) * sigmoid(gate)) to a causal convolution of its input, with
+    the dilation doubling from layer to layer (and starting again from 1 after every 10 layers), and adds the result
+    back onto its input. At sampling time, each layer's state is its last (kernel_size - 1) * dilation inputs.
+    """
+    def __init__(self, num_layers, num_channels, kernel_size, name='conv_backbone'):
+        super(DilatedConvBackbone, self).__init__(name=name)
+        self.input_size = num_channels
+        self.output_size = num_channels
+        self._kernel_size = kernel_size
+        self._dilations = [2 ** (i % 10) for i in range(num_layers)]
+
+        with self._enter_variable_scope():
+            self._filter_convs = [
+                snt.Conv1D(num_channels, kernel_size, rate=d, padding=snt.VALID, name='filter_%d' % i)
+                for i, d in enumerate(self._dilations)
+            ]
+            self._gate_convs = [
+                snt.Conv1D(num_channels, kernel_size, rate=d, padding=snt.VALID, name='gate_%d' % i)
+                for i, d in enumerate(self._dilations)
+            ]
+            self._residual_convs = [
+                snt.Conv1D(num_channels, kernel_shape=1, name='residual_%d' % i)
+                for i in range(num_layers)
+            ]
+
+    def _context_length(self, layer):
+        # Number of preceding inputs that each output of the layer depends on.
+        return (self._kernel_size - 1) * self._dilations[layer]
+
+    def _layer(self, layer, window, x):
+        # window is x with the layer's preceding context prepended, so the (valid) convolutions output one
+        # activation per timestep of x.
+        z = tf.tanh(self._filter_convs[layer](window)) * tf.sigmoid(self._gate_convs[layer](window))
+        return x + self._residual_convs[layer](z)
+
+    def _build(self, inputs, lengths):
+        # Padding at the end of a sequence doesn't need masking, as it can only affect later timesteps.
+        x = inputs
+        for layer in range(len(self._dilations)):
+            window = tf.pad(x, [[0, 0], [self._context_length(layer), 0], [0, 0]])  # Pad at the start only.
+            x = self._layer(layer, window, x)
+        return x
+
+    def initial_state(self, batch_size):
+        # The zeros match the padding at the start of a sequence in _build.
+        return tuple(
+            tf.zeros([batch_size, self._context_length(layer), self.input_size], dtype=tf.float32)
+            for layer in range(len(self._dilations))
+        )
+
+    def prime(self, inputs, lengths):
+        # Each layer's state is its inputs at the last context_length timesteps of each sequence.
+        x = inputs
+        state = []
+        for layer in range(len(self._dilations)):
+            context_length = self._context_length(layer)
+            window = tf.pad(x, [[0, 0], [context_length, 0], [0, 0]])
+            positions = tf.expand_dims(lengths, 1) + tf.range(context_length)  # Timestep t of x is t + context_length.
+            state.append(gather_timesteps(window, positions))
+            x = self._layer(layer, window, x)
+        return tuple(state)
+
+    def step(self, inputs, prev_state):
+        x = tf.expand_dims(inputs, 1)  # Add time axis.
+        next_state = []
+        for layer, context in enumerate(prev_state):
+            window = tf.concat([context, x], axis=1)
+            next_state.append(window[:, 1:])  # Drop the oldest input, which is no longer needed.
+            x = self._layer(layer, window, x)
+        return tf.squeeze(x, axis=1), tuple(next_state)
+
+
+def positional_encoding(positions, size):
+    # Sinusoidal encoding of (integer) positions of any shape, as in "Attention Is All You Need".
+    timescales = np.power(10000.0, -np.arange(0, size, 2, dtype=np.float32) / size)
+    angles = tf.expand_dims(tf.cast(positions, tf.float32), -1) * timescales
+    return tf.concat([tf.sin(angles), tf.cos(angles)], axis=-1)
+
+
+def batch_apply(module, x):
+    # Applies a module that expects [batch_size, size] inputs to inputs with or without a time axis.
+    return snt.BatchApply(module)(x) if x.shape.ndims == 3 else module(x)
+
+
+class CausalTransformerBackbone(snt.AbstractModule):
+    """
+    A stack of pre-norm transformer layers (self-attention followed by a feedforward layer, each with a residual
+    connection), where each timestep attends to itself and to at most max_context - 1 preceding timesteps.
+
+    At sampling time, each layer caches the keys and values of the last max_context timesteps in a ring buffer, so
+    that sampling can carry on for any number of steps while computing exactly what _build would for the same
+    sequence. Positions are encoded absolutely, and are added to the inputs before the first layer.
+    """
+    def __init__(self, num_layers, size, num_heads, max_context, name='transformer_backbone'):
+        super(CausalTransformerBackbone, self).__init__(name=name)
+        assert size % num_heads == 0
+        self.input_size = size
+        self.output_size = size
+        self._num_heads = num_heads
+        self._max_context = max_context
+
+        with self._enter_variable_scope():
+            self._layers = []
+            for i in range(num_layers):
+                self._layers.append({
+                    'attention_norm': snt.LayerNorm(name='attention_norm_%d' % i),
+                    'query': snt.Linear(size, name='query_%d' % i),
+                    'key': snt.Linear(size, name='key_%d' % i),
+                    'value': snt.Linear(size, name='value_%d' % i),
+                    'attention_out': snt.Linear(size, name='attention_out_%d' % i),
+                    'feedforward_norm': snt.LayerNorm(name='feedforward_norm_%d' % i),
+                    'feedforward_hidden': snt.Linear(4 * size, name='feedforward_hidden_%d' % i),
+                    'feedforward_out': snt.Linear(size, name='feedforward_out_%d' % i),
+                })
+            self._final_norm = snt.LayerNorm(name='final_norm')
+
+    def _split_heads(self, x):
+        # [batch_size, num_timesteps, size] -> [batch_size, num_heads, num_timesteps, size / num_heads]
+        shape = tf.shape(x)
+        x = tf.reshape(x, [shape[0], shape[1], self._num_heads, self.input_size // self._num_heads])
+        return tf.transpose(x, [0, 2, 1, 3])
+
+    def _attention(self, queries, keys, values, mask):
+        # mask is 1 where a query may attend to a key, and broadcasts to [batch_size, num_heads, num_q, num_k].
+        q, k, v = self._split_heads(queries), self._split_heads(keys), self._split_heads(values)
+        logits = tf.matmul(q, k, transpose_b=True) / np.sqrt(self.input_size // self._num_heads)
+        logits += (1.0 - mask) * -1e9
+        out = tf.matmul(tf.nn.softmax(logits), v)
+        out = tf.transpose(out, [0, 2, 1, 3])
+        shape = tf.shape(queries)
+        return tf.reshape(out, [shape[0], shape[1], self.input_size])
+
+    def _feedforward(self, layer, x):
+        h = tf.nn.relu(batch_apply(layer['feedforward_hidden'], batch_apply(layer['feedforward_norm'], x)))
+        return x + batch_apply(layer['feedforward_out'], h)
+
+    def _run(self, inputs):
+        # Returns the output, and the keys and values of every layer.
+        num_timesteps = tf.shape(inputs)[1]
+        positions = tf.range(num_timesteps)
+        x = inputs + positional_encoding(positions, self.input_size)
+
+        offsets = tf.expand_dims(positions, 1) - tf.expand_dims(positions, 0)  # Query position - key position.
+        mask = tf.cast(tf.logical_and(offsets >= 0, offsets < self._max_context), tf.float32)
+
+        all_keys = []
+        all_values = []
+        for layer in self._layers:
+            h = batch_apply(layer['attention_norm'], x)
+            queries = batch_apply(layer['query'], h)
+            keys = batch_apply(layer['key'], h)
+            values = batch_apply(layer['value'], h)
+            all_keys.append(keys)
+            all_values.append(values)
+            x += batch_apply(layer['attention_out'], self._attention(queries, keys, values, mask))
+            x = self._feedforward(layer, x)
+        return batch_apply(self._final_norm, x), all_keys, all_values
+
+    def _build(self, inputs, lengths):
+        # Padding at the end of a sequence doesn't need masking, as it can only affect later timesteps.
+        output, _, _ = self._run(inputs)
+        return output
+
+    def prime(self, inputs, lengths):
+        _, all_keys, all_values = self._run(inputs)
+
+        # Slot s of the ring buffers holds the latest position p < length with p % max_context == s (if any).
+        last = tf.expand_dims(lengths, 1) - 1
+        slot_positions = last - tf.floormod(last - tf.range(self._max_context), self._max_context)
+        slot_positions = tf.maximum(slot_positions, -1)
+        occupied = tf.cast(slot_positions >= 0, tf.float32)[:, :, None]
+        positions = tf.maximum(slot_positions, 0)
+        return (
+            lengths,
+            slot_positions,
+            tuple(gather_timesteps(keys, positions) * occupied for keys in all_keys),
+            tuple(gather_timesteps(values, positions) * occupied for values in all_values),
+        )
+
+    def initial_state(self, batch_size):
+        # The state is (position, slot_positions, keys, values): the position of the next timestep in each
+        # sequence, the position cached in each slot of the ring buffers (-1 if empty), and each layer's cache.
+        cache_shape = [batch_size, self._max_context, self.input_size]
+        return (
+            tf.zeros([batch_size], dtype=tf.int32),
+            tf.fill([batch_size, self._max_context], -1),
+            tuple(tf.zeros(cache_shape, dtype=tf.float32) for _ in self._layers),
+            tuple(tf.zeros(cache_shape, dtype=tf.float32) for _ in self._layers),
+        )
+
+    def step(self, inputs, prev_state):
+        position, slot_positions, prev_keys, prev_values = prev_state
+        x = inputs + positional_encoding(position, self.input_size)
+
+        # Write this timestep into the slot of the ring buffer that holds the oldest cached timestep.
+        slot = tf.one_hot(position % self._max_context, self._max_context, dtype=tf.float32)  # [batch_size, slots]
+        slot_positions = tf.where(slot > 0, tf.tile(tf.expand_dims(position, 1), [1, self._max_context]),
+                                  slot_positions)
+        mask = tf.cast(slot_positions >= 0, tf.float32)[:, None, None, :]  # Every cached timestep is visible.
+        write = tf.expand_dims(slot, -1)
+
+        next_keys = []
+        next_values = []
+        for layer, keys, values in zip(self._layers, prev_keys, prev_values):
+            h = layer['attention_norm'](x)
+            keys = keys * (1.0 - write) + write * tf.expand_dims(layer['key'](h), 1)
+            values = values * (1.0 - write) + write * tf.expand_dims(layer['value'](h), 1)
+            next_keys.append(keys)
+            next_values.append(values)
+
+            queries = tf.expand_dims(layer['query'](h), 1)  # Add time axis.
+            x += layer['attention_out'](tf.squeeze(self._attention(queries, keys, values, mask), axis=1))
+            x = self._feedforward(layer, x)
+
+        next_state = (position + 1, slot_positions, tuple(next_keys), tuple(next_values))
+        return self._final_norm(x), next_state
@@ -0,0 +1,126 @@
+"""
+Conversion of model_autoregressive checkpoints saved with an older variable layout into the current layout, so that
+a model doesn't need to be retrained whenever the way its computation is organised changes. The conversions are
+exact: the converted model computes the same function as the original.
+
+Optimizer slot variables (e.g. Adam's 'lstm/w_gates/Adam') are converted along with the variables they belong to,
+so that training can be resumed from a converted checkpoint.
+
+    python main.py convert-checkpoint checkpoints/model-10000 converted/model-10000
+"""
+
+import numpy as np
+
+from corpus import FIELD_SIZES
+from Model.layout import HEAD_NAMES, NUM_CONDITIONING_INPUTS, NUM_HIDDEN, OUTPUT_OFFSETS, hidden_slice, output_slice
+
+NUM_INPUTS = sum(FIELD_SIZES)
+
+
+def _split_dense_input_weights(w, suffix):
+    # w is the [100 + num_lstm_units, 4 * num_lstm_units] weight matrix of a snt.LSTM fed with timestep vectors.
+    pitch, root, bass, chord, duration = np.split(w[:NUM_INPUTS], np.cumsum(FIELD_SIZES)[:-1])
+    start_row = np.zeros([1, w.shape[1]], dtype=w.dtype)  # The empty first timestep contributed nothing.
+    return {
+        'input_embedding/pitch' + suffix: np.concatenate([pitch, start_row]),
+        'input_embedding/root' + suffix: np.concatenate([root, start_row]),
+        'input_embedding/bass' + suffix: np.concatenate([bass, start_row]),
+        'input_embedding/chord' + suffix: chord,
+        'input_embedding/duration' + suffix: np.concatenate([duration, start_row]),
+        'lstm/w_h_gates' + suffix: w[NUM_INPUTS:],
+    }
+
+
+def dense_input_to_embedding(variables):
+    """
+    Converts the input weights of a snt.LSTM that took 100-dim timestep vectors (the first 100 rows of 'lstm/w_gates')
+    into the tables of an InputEmbedding, leaving the recurrent weights in 'lstm/w_h_gates' of a GateInputLSTM.
+    variables maps each variable name to its value.
+    """
+    converted = {}
+    for name, value in variables.items():
+        if name == 'lstm/w_gates' or name.startswith('lstm/w_gates/'):
+            converted.update(_split_dense_input_weights(value, name[len('lstm/w_gates'):]))
+        else:
+            converted[name] = value
+    return converted
+
+
+def _fuse_head_weights(variables, suffix):
+    # Lays the weights of the separate heads side by side. Entries that fall outside the masks are left as zeros.
+    w_h = None
+    w_cond = np.zeros([NUM_CONDITIONING_INPUTS, NUM_HIDDEN], dtype=np.float32)
+    b_hidden = np.zeros([NUM_HIDDEN], dtype=np.float32)
+    w_out = np.zeros([NUM_HIDDEN, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+    b_out = np.zeros([OUTPUT_OFFSETS[-1]], dtype=np.float32)
+
+    for k, head in enumerate(HEAD_NAMES):
+        scope = head + '_module/'
+        w_hidden = variables[scope + 'conv_1d/w' + suffix][0]  # Remove the (size 1) kernel axis.
+        num_cond = OUTPUT_OFFSETS[k]  # The inputs are h followed by all the fields before this one.
+        num_h = w_hidden.shape[0] - num_cond
+        if w_h is None:
+            w_h = np.zeros([num_h, NUM_HIDDEN], dtype=np.float32)
+        w_h[:, hidden_slice(head)] = w_hidden[:num_h]
+        w_cond[:num_cond, hidden_slice(head)] = w_hidden[num_h:]
+        b_hidden[hidden_slice(head)] = variables[scope + 'conv_1d/b' + suffix]
+
+        output_layer = 'conv_1d_1'
+        if head == 'c':
+            # The chord head's masked input layer has its own bias, which is folded into the hidden bias.
+            w_cond[output_slice('c'), hidden_slice('c')] = variables[scope + 'conv_1d_1/w' + suffix][0]
+            b_hidden[hidden_slice('c')] += variables[scope + 'conv_1d_1/b' + suffix]
+            output_layer = 'conv_1d_2'
+        w_out[hidden_slice(head), output_slice(head)] = variables[scope + output_layer + '/w' + suffix][0]
+        b_out[output_slice(head)] = variables[scope + output_layer + '/b' + suffix]
+
+    return {
+        'output_heads/w_h' + suffix: w_h,
+        'output_heads/w_cond' + suffix: w_cond,
+        'output_heads/b_hidden' + suffix: b_hidden,
+        'output_heads/w_out' + suffix: w_out,
+        'output_heads/b_out' + suffix: b_out,
+    }
+
+
+def separate_heads_to_fused(variables):
+    """
+    Converts the weights of the separate output heads (p_module, r_module, etc., each with a single hidden layer) into
+    the layout of FusedOutputHeads. The optimizer slots of the chord head's two hidden biases are simply added
+    together, so resuming training from a converted checkpoint is only approximately the same as carrying on.
+    """
+    suffixes = [name[len('p_module/conv_1d/w'):] for name in variables if name.startswith('p_module/conv_1d/w')]
+    converted = {name: value for name, value in variables.items()
+                 if not any(name.startswith(head + '_module/') for head in HEAD_NAMES)}
+    for suffix in suffixes:
+        converted.update(_fuse_head_weights(variables, suffix))
+    return converted
+
+
+def convert_variables(variables, fused_heads=True):
+    # Applies whichever conversions are needed to bring variables up to date.
+    if 'lstm/w_gates' in variables:
+        variables = dense_input_to_embedding(variables)
+    if fused_heads and 'p_module/conv_1d/w' in variables:
+        variables = separate_heads_to_fused(variables)
+    return variables
+
+
+def read_checkpoint(path):
+    import tensorflow as tf
+    reader = tf.train.load_checkpoint(path)
+    return {name: reader.get_tensor(name) for name in reader.get_variable_to_shape_map()}
+
+
+def write_checkpoint(variables, path):
+    import tensorflow as tf
+    with tf.Graph().as_default():
+        var_list = {name: tf.Variable(value, name=name.replace('/', '_')) for name, value in variables.items()}
+        saver = tf.train.Saver(var_list, save_relative_paths=True)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            return saver.save(sess, path)
+
+
+def convert_checkpoint(input_path, output_path):
+    return write_checkpoint(convert_variables(read_checkpoint(input_path)), output_path)
@@ -0,0 +1,101 @@
+"""
+The layout of the autoregressive model's output heads, which is shared by the TensorFlow model, checkpoint conversion
+and the NumPy inference engine (so that working out which weights go where never needs TensorFlow).
+
+There is one output head per timestep field: pitch (p), root (r), bass (b), chord notes (c) and duration (d). Each
+head has a single hidden layer, which sees the backbone output h plus all of the fields before its own, and the chord
+head also sees its own notes through a MADE-style mask. In the fused layout, the hidden layers of all the heads are
+laid side by side, so that they can be computed together:
+
+    hidden = relu(h . w_h + [p, r, b, c] . (w_cond * cond_mask) + b_hidden)    [..., 896]
+    logits = hidden . (w_out * out_mask) + b_out                                [..., 100]
+"""
+
+import numpy as np
+
+from corpus import FIELD_SIZES
+
+# Index-encoded timesteps (see corpus.py) have 5 fields: pitch, root, bass, chord note mask, and duration.
+# START_INDICES encodes the empty timestep that is fed in before the first one: each one-hot field gets its own
+# extra "start" index, and the chord has no notes.
+START_INDICES = [38, 13, 13, 0, 24]
+
+HEAD_NAMES = ['p', 'r', 'b', 'c', 'd']
+HEAD_HIDDEN_SIZES = [128, 128, 128, 384, 128]
+NUM_CONDITIONING_INPUTS = sum(FIELD_SIZES[:4])  # The duration isn't an input to any head.
+HIDDEN_OFFSETS = np.concatenate([[0], np.cumsum(HEAD_HIDDEN_SIZES)])
+OUTPUT_OFFSETS = np.concatenate([[0], np.cumsum(FIELD_SIZES)])
+NUM_HIDDEN = HIDDEN_OFFSETS[-1]
+CHORD_HEAD = HEAD_NAMES.index('c')
+
+
+def hidden_slice(head):
+    k = HEAD_NAMES.index(head)
+    return slice(HIDDEN_OFFSETS[k], HIDDEN_OFFSETS[k + 1])
+
+
+def output_slice(head):
+    k = HEAD_NAMES.index(head)
+    return slice(OUTPUT_OFFSETS[k], OUTPUT_OFFSETS[k + 1])
+
+
+# Compute mask for autoregressive masking like in PixelCNN.
+def create_mask(num_inputs, num_outputs, num_channels, mask_self=False):
+    assert num_inputs % num_channels == 0
+    assert num_outputs % num_channels == 0
+
+    num_inputs_per_channel = num_inputs // num_channels
+    num_outputs_per_channel = num_outputs // num_channels
+    mask = np.zeros([num_inputs, num_outputs], dtype=np.float32)
+
+    for i in range(num_channels):
+        # Connect the outputs for channel i to all preceding inputs.
+        num_visible_input_channels = i if mask_self else i + 1
+        # Connect all visible input units to the output units in the current channel.
+        mask[0:num_visible_input_channels * num_inputs_per_channel,
+             i * num_outputs_per_channel:(i + 1) * num_outputs_per_channel] = 1.0
+
+    return mask.reshape(1, num_inputs, num_outputs)  # Add batch axis.
+
+
+def chord_masks():
+    # Masks of the chord head's masked input and output layers (without the batch axis).
+    num_notes = FIELD_SIZES[CHORD_HEAD]
+    num_hidden = HEAD_HIDDEN_SIZES[CHORD_HEAD]
+    mask_in = create_mask(num_notes, num_hidden, num_notes, mask_self=True)[0]
+    mask_out = create_mask(num_hidden, num_notes, num_notes)[0]
+    return mask_in, mask_out
+
+
+def fused_head_masks():
+    """
+    Returns (cond_mask, out_mask) for the fused layout, of shapes [76, 896] and [896, 100] respectively.
+    """
+    cond_mask = np.zeros([NUM_CONDITIONING_INPUTS, NUM_HIDDEN], dtype=np.float32)
+    out_mask = np.zeros([NUM_HIDDEN, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+    for k, head in enumerate(HEAD_NAMES):
+        cond_mask[:OUTPUT_OFFSETS[k], hidden_slice(head)] = 1.0  # All the fields before this one.
+        out_mask[hidden_slice(head), output_slice(head)] = 1.0
+
+    mask_in, mask_out = chord_masks()
+    cond_mask[output_slice('c'), hidden_slice('c')] = mask_in
+    out_mask[hidden_slice('c'), output_slice('c')] = mask_out
+    return cond_mask, out_mask
+
+
+def fused_head_init_stddevs(input_size):
+    """
+    The standard deviations to initialise the fused layout's w_h [896], w_cond [76, 896] and w_out [896, 1] with, so
+    that each head starts out as the separate heads do: Sonnet initialises each of their layers' weights with a
+    standard deviation of 1 / sqrt(fan-in). A head's hidden layer sees h (input_size) plus the fields before its own,
+    except that the chord head sees its own notes through a separate layer (fan-in 12), and its output layer sees its
+    hidden layer.
+    """
+    w_h = np.zeros([NUM_HIDDEN], dtype=np.float32)
+    w_out = np.zeros([NUM_HIDDEN, 1], dtype=np.float32)
+    for k, head in enumerate(HEAD_NAMES):
+        w_h[hidden_slice(head)] = 1.0 / np.sqrt(input_size + OUTPUT_OFFSETS[k])
+        w_out[hidden_slice(head)] = 1.0 / np.sqrt(HEAD_HIDDEN_SIZES[k])
+    w_cond = np.tile(w_h, [NUM_CONDITIONING_INPUTS, 1])
+    w_cond[output_slice('c'), hidden_slice('c')] = 1.0 / np.sqrt(FIELD_SIZES[CHORD_HEAD])
+    return w_h, w_cond, w_out
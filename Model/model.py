@@ -1,3 +1,4 @@
+import collections
 import tensorflow as tf
 import sonnet as snt  # Library for NN components.
 
@@ -14,31 +15,44 @@ def shift_by_one_timestep(v):
     return tf.pad(v[:, :-1, :], [[0, 0], [1, 0], [0, 0]])
 
 
-cell = snt.LSTM(NUM_HIDDEN_UNITS)
-initial_state = cell.initial_state(BATCH_SIZE)
-output_module = snt.Linear(100)
-batch_output_module = snt.BatchApply(output_module)
+Modules = collections.namedtuple('Modules', ['cell', 'output', 'batch_output'])
+_modules = None
+
+
+def get_modules():
+    # The modules are only created when the model is first built, so that importing this file stays cheap.
+    global _modules
+    if _modules is None:
+        output_module = snt.Linear(100)
+        _modules = Modules(
+            cell=snt.LSTM(NUM_HIDDEN_UNITS),
+            output=output_module,
+            batch_output=snt.BatchApply(output_module)
+        )
+    return _modules
 
 
 def build_model(v, lengths):  # v is a 3D tensor [batch_size, num_timesteps, 100].
+    m = get_modules()
     v_in = shift_by_one_timestep(v)
     h, final_state = tf.nn.dynamic_rnn(  # h is a 3D tensor containing hidden states of LSTM.
-        cell=cell,
+        cell=m.cell,
         inputs=v_in,
-        initial_state=initial_state,
+        initial_state=m.cell.initial_state(tf.shape(v)[0]),
         sequence_length=lengths  # Lets tf know not to train on padding.
         # Different numbers of updates for different data points due to different lengths.
     )
-    return batch_output_module(h)  # [batch_size, num_timesteps, 100]: logits of predictions.
+    return m.batch_output(h)  # [batch_size, num_timesteps, 100]: logits of predictions.
 
 
 def initial_state_for_sampling():
-    return initial_state
+    return get_modules().cell.initial_state(BATCH_SIZE)
 
 
 def build_model_for_sampling(v, prev_state):  # v is a matrix [batch_size, 100], representing a single timestep.
-    h, next_state = cell(v, prev_state)
-    y = output_module(h)
+    m = get_modules()
+    h, next_state = m.cell(v, prev_state)
+    y = m.output(h)
     s = sample(y)
     return s, next_state
 
@@ -1,10 +1,31 @@
+import collections
 import tensorflow as tf
 import sonnet as snt
 import numpy as np
 
+from corpus import DURATIONS
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table
+from definitions import BAR_DURATION
+
+from Model.backbones import LSTMBackbone, DilatedConvBackbone, CausalTransformerBackbone
+from Model.layout import HEAD_HIDDEN_SIZES, NUM_CONDITIONING_INPUTS, NUM_HIDDEN, create_mask, fused_head_init_stddevs
+from Model.layout import fused_head_masks
+from Model.layout import START_INDICES, hidden_slice, output_slice
+
 NUM_LSTM_UNITS = 256
 BATCH_SIZE = 32
 
+# Which network summarises the preceding timesteps (see Model/backbones.py): 'lstm', 'conv' or 'transformer'.
+BACKBONE = 'lstm'
+NUM_CONV_LAYERS = 10
+NUM_CONV_CHANNELS = 256
+CONV_KERNEL_SIZE = 2  # With 10 layers, each timestep sees the preceding 1023 timesteps.
+NUM_TRANSFORMER_LAYERS = 4
+TRANSFORMER_SIZE = 256
+NUM_ATTENTION_HEADS = 4
+MAX_ATTENTION_CONTEXT = 512  # Number of timesteps (including itself) that each timestep can attend to.
+FUSED_HEADS = True  # Whether to compute all the output heads together (see FusedOutputHeads).
+
 
 def split_vectors(v):
     return tf.split(v, [38, 13, 13, 12, 24], axis=-1)
@@ -15,8 +36,76 @@ def shift_by_one_timestep(v):
     return tf.pad(v[:, :-1, :], [[0, 0], [1, 0], [0, 0]])
 
 
-cell = snt.LSTM(NUM_LSTM_UNITS)
-initial_state = cell.initial_state(BATCH_SIZE)
+def shift_indices_by_one_timestep(indices):
+    # The index-encoded equivalent of shift_by_one_timestep.
+    start = tf.tile(tf.constant(START_INDICES, shape=[1, 1, 5]), [tf.shape(indices)[0], 1, 1])
+    return tf.concat([start, indices[:, :-1, :]], axis=1)
+
+
+def chord_bits_from_mask(mask):
+    # Converts chord note masks to multi-hot vectors of 12 floats (padding, with a negative mask, has no notes).
+    bits = tf.bitwise.bitwise_and(tf.expand_dims(tf.maximum(mask, 0), -1), 1 << tf.range(12))
+    return tf.cast(bits > 0, tf.float32)
+
+
+def vectors_from_indices(indices):
+    pitch, root, bass, chord, duration = tf.unstack(indices, axis=-1)
+    return tf.concat([
+        tf.one_hot(pitch, 38, dtype=tf.float32),  # Padding (index -1) gets an all-zero one-hot vector.
+        tf.one_hot(root, 13, dtype=tf.float32),
+        tf.one_hot(bass, 13, dtype=tf.float32),
+        chord_bits_from_mask(chord),
+        tf.one_hot(duration, 24, dtype=tf.float32)
+    ], axis=-1)
+
+
+def indices_from_vectors(v):
+    # Inverse of vectors_from_indices, where all-zero one-hot sections (e.g. in the empty first timestep used to
+    # start sampling) are mapped to the start indices.
+    p, r, b, c, d = split_vectors(v)
+
+    def one_hot_index(x, start_index):
+        index = tf.argmax(x, axis=-1, output_type=tf.int32)
+        return tf.where(tf.reduce_max(x, axis=-1) > 0, index, tf.fill(tf.shape(index), start_index))
+
+    chord = tf.reduce_sum(tf.cast(c > 0.5, tf.int32) * (1 << tf.range(12)), axis=-1)
+    return tf.stack([
+        one_hot_index(p, START_INDICES[0]),
+        one_hot_index(r, START_INDICES[1]),
+        one_hot_index(b, START_INDICES[2]),
+        chord,
+        one_hot_index(d, START_INDICES[4])
+    ], axis=-1)
+
+
+class InputEmbedding(snt.AbstractModule):
+    """
+    Embeds index-encoded timesteps by summing an embedding of each field, with the chord notes treated as a bag of
+    up to 12 note embeddings. This is equivalent to (and can be converted exactly from) a linear layer applied to the
+    100-dim one-hot timestep vector, but replaces the matmul with a few lookups.
+    """
+    def __init__(self, embedding_size, initializer_stddev, name='input_embedding'):
+        super(InputEmbedding, self).__init__(name=name)
+        self._embedding_size = embedding_size
+        self._initializer = tf.truncated_normal_initializer(stddev=initializer_stddev)
+
+    def _build(self, indices):
+        pitch, root, bass, chord, duration = tf.unstack(tf.maximum(indices, 0), axis=-1)  # Padding uses index 0.
+        embeddings = []
+        for name, idx, num_rows in [('pitch', pitch, 39), ('root', root, 14), ('bass', bass, 14),
+                                    ('duration', duration, 25)]:
+            table = tf.get_variable(name, [num_rows, self._embedding_size], initializer=self._initializer)
+            embeddings.append(tf.gather(table, idx))
+        chord_table = tf.get_variable('chord', [12, self._embedding_size], initializer=self._initializer)
+        embeddings.append(tf.tensordot(chord_bits_from_mask(chord), chord_table, axes=1))
+        return tf.add_n(embeddings)
+
+
+def scaled_initializer(stddev):
+    # A truncated normal initializer with its own standard deviation for each entry (broadcast to the shape).
+    def initializer(shape, dtype=tf.float32, partition_info=None):
+        return tf.truncated_normal(shape, dtype=dtype) * tf.constant(np.broadcast_to(stddev, shape), dtype=dtype)
+    return initializer
 
 
 def output_net(num_hidden_layers, num_hidden_units, num_outputs, inputs):
@@ -29,97 +118,259 @@ def output_net(num_hidden_layers, num_hidden_units, num_outputs, inputs):
     return snt.Conv1D(num_outputs, kernel_shape=1)(h)
 
 
-# Compute mask for autoregressive masking like in PixelCNN.
-def create_mask(num_inputs, num_outputs, num_channels, mask_self=False):
-    assert num_inputs % num_channels == 0
-    assert num_outputs % num_channels == 0
-
-    num_inputs_per_channel = num_inputs // num_channels
-    num_outputs_per_channel = num_outputs // num_channels
-    mask = np.zeros([num_inputs, num_outputs], dtype=np.float32)
-
-    for i in range(num_channels):
-        # Connect the outputs for channel i to all preceding inputs.
-        num_visible_input_channels = i if mask_self else i + 1
-        # Connect all visible input units to the output units in the current channel.
-        mask[0:num_visible_input_channels * num_inputs_per_channel,
-             i * num_outputs_per_channel:(i + 1) * num_outputs_per_channel] = 1.0
-
-    return mask.reshape(1, num_inputs, num_outputs)  # Add batch axis.
-
-
 # Constructs a masked output network (used for chords notes).
-def masked_output_net(num_hidden_layers, num_hidden_units, num_outputs, masked_input, other_inputs):
-    assert num_hidden_layers >= 1
-    mask_in = create_mask(num_outputs, num_hidden_units, num_outputs, mask_self=True)
-    mask_hidden = create_mask(num_hidden_units, num_hidden_units, num_outputs)
-    mask_out = create_mask(num_hidden_units, num_outputs, num_outputs)
-
-    # First hidden layer.
-    h = tf.concat(other_inputs, axis=-1)  # Combine all other (unmasked) inputs into one.
-    h = snt.Conv1D(num_hidden_units, kernel_shape=1)(h)  # Apply unmasked linear layer.
-    # Apply masked linear layer to masked input and add to hidden layer activation.
-    h += snt.Conv1D(num_hidden_units, kernel_shape=1, mask=mask_in)(masked_input)
-    h = tf.nn.relu(h)  # Apply ReLU to combined activation.
-
-    # Other hidden layers.
-    for _ in range(num_hidden_layers - 1):
-        h = snt.Conv1D(num_hidden_units, kernel_shape=1, mask=mask_hidden)(h)
-        h = tf.nn.relu(h)
-
-    return snt.Conv1D(num_outputs, kernel_shape=1, mask=mask_out)(h)
+class MaskedOutputNet(snt.AbstractModule):
+    """
+    Output i of the network only depends on the masked inputs before i (and on all of the other inputs). The other
+    inputs only enter through a linear "context" term in the first hidden layer, which doesn't depend on the masked
+    input, so when the outputs are sampled one at a time the context can be computed once with context(), and then
+    reused with from_context() for each new masked input.
+    """
+    def __init__(self, num_hidden_layers, num_hidden_units, num_outputs, name='masked_output_net'):
+        super(MaskedOutputNet, self).__init__(name=name)
+        assert num_hidden_layers >= 1
+        mask_in = create_mask(num_outputs, num_hidden_units, num_outputs, mask_self=True)
+        mask_hidden = create_mask(num_hidden_units, num_hidden_units, num_outputs)
+        mask_out = create_mask(num_hidden_units, num_outputs, num_outputs)
+
+        # The layers are created in the order they are applied, so that their variable names (conv_1d, conv_1d_1, ...)
+        # are the same as when the network was built layer by layer in a snt.Module.
+        with self._enter_variable_scope():
+            self._context_layer = snt.Conv1D(num_hidden_units, kernel_shape=1)  # Unmasked linear layer.
+            self._masked_input_layer = snt.Conv1D(num_hidden_units, kernel_shape=1, mask=mask_in)
+            self._hidden_layers = [
+                snt.Conv1D(num_hidden_units, kernel_shape=1, mask=mask_hidden) for _ in range(num_hidden_layers - 1)
+            ]
+            self._output_layer = snt.Conv1D(num_outputs, kernel_shape=1, mask=mask_out)
+
+    def context(self, other_inputs):
+        h = tf.concat(other_inputs, axis=-1)  # Combine all other (unmasked) inputs into one.
+        return self._context_layer(h)
+
+    def from_context(self, context, masked_input):
+        # Apply masked linear layer to masked input and add to hidden layer activation.
+        h = tf.nn.relu(context + self._masked_input_layer(masked_input))
+
+        # Other hidden layers.
+        for layer in self._hidden_layers:
+            h = tf.nn.relu(layer(h))
+
+        return self._output_layer(h)
+
+    def _build(self, masked_input, other_inputs):
+        return self.from_context(self.context(other_inputs), masked_input)
+
+
+class OutputHeads(object):
+    """
+    The separate autoregressive output networks, one per timestep field. This and FusedOutputHeads share the
+    following interface, which lets the heads be run all at once for training, or one by one for sampling:
+
+        heads(h, v) -> logits of every field, given the backbone output h and the (teacher-forced) timesteps v
+        heads.context(h) -> the part of every head's computation that only depends on h
+        heads.logits(head, context, inputs) -> logits of 'p', 'r', 'b' or 'd', given the fields before it
+        heads.chord_context(context, inputs) -> the part of the chord head that doesn't depend on the chord notes
+        heads.chord_logits(chord_context, c) -> logits of the chord notes, given the notes before each one
+    """
+    def __init__(self):
+        self._modules = {
+            'p': snt.Module(lambda inputs: output_net(1, HEAD_HIDDEN_SIZES[0], 38, inputs), name='p_module'),
+            'r': snt.Module(lambda inputs: output_net(1, HEAD_HIDDEN_SIZES[1], 13, inputs), name='r_module'),
+            'b': snt.Module(lambda inputs: output_net(1, HEAD_HIDDEN_SIZES[2], 13, inputs), name='b_module'),
+            'c': MaskedOutputNet(1, HEAD_HIDDEN_SIZES[3], 12, name='c_module'),
+            'd': snt.Module(lambda inputs: output_net(1, HEAD_HIDDEN_SIZES[4], 24, inputs), name='d_module'),
+        }
+
+    def __call__(self, h, v):
+        p, r, b, c, d = split_vectors(v)
+
+        p_out = self._modules['p']([h])
+        r_out = self._modules['r']([h, p])
+        b_out = self._modules['b']([h, p, r])
+        c_out = self._modules['c'](c, [h, p, r, b])  # Also gets itself as input!
+        d_out = self._modules['d']([h, p, r, b, c])
+
+        # Join all the outputs and return.
+        return tf.concat([p_out, r_out, b_out, c_out, d_out], axis=-1)
+
+    def context(self, h):
+        return h
+
+    def logits(self, head, context, inputs):
+        return self._modules[head]([context] + inputs)
+
+    def chord_context(self, context, inputs):
+        return self._modules['c'].context([context] + inputs)
+
+    def chord_logits(self, chord_context, c):
+        return self._modules['c'].from_context(chord_context, c)
+
+
+class FusedOutputHeads(snt.AbstractModule):
+    """
+    The same function as OutputHeads, but with the hidden layers of all the heads laid side by side (see
+    Model/layout.py), so that the projection of h for every head is one matmul, and the inputs from earlier fields
+    are added as one masked matmul, instead of each head concatenating its inputs and running its own layers.
+    Checkpoints with separate heads can be converted to this layout with Model/convert_checkpoint.py.
+    """
+    def __init__(self, input_size, name='output_heads'):
+        super(FusedOutputHeads, self).__init__(name=name)
+        self._input_size = input_size
+        self._cond_mask, self._out_mask = fused_head_masks()
+
+    @snt.reuse_variables
+    def _variables(self):
+        # Initialised in the same way as the separate heads, with each head's own fan-ins.
+        w_h_stddev, w_cond_stddev, w_out_stddev = fused_head_init_stddevs(self._input_size)
+        w_h = tf.get_variable('w_h', [self._input_size, NUM_HIDDEN], initializer=scaled_initializer(w_h_stddev))
+        w_cond = tf.get_variable('w_cond', [NUM_CONDITIONING_INPUTS, NUM_HIDDEN],
+                                 initializer=scaled_initializer(w_cond_stddev))
+        b_hidden = tf.get_variable('b_hidden', [NUM_HIDDEN], initializer=tf.zeros_initializer())
+        w_out = tf.get_variable('w_out', [NUM_HIDDEN, 100], initializer=scaled_initializer(w_out_stddev))
+        b_out = tf.get_variable('b_out', [100], initializer=tf.zeros_initializer())
+        return w_h, w_cond * self._cond_mask, b_hidden, w_out * self._out_mask, b_out
+
+    def _build(self, h, v):
+        w_h, w_cond, b_hidden, w_out, b_out = self._variables()
+        hidden = tf.tensordot(h, w_h, axes=1) + b_hidden  # The h projection of every head at once.
+        hidden += tf.tensordot(v[..., :NUM_CONDITIONING_INPUTS], w_cond, axes=1)  # Inputs from earlier fields.
+        return tf.tensordot(tf.nn.relu(hidden), w_out, axes=1) + b_out
+
+    def context(self, h):
+        w_h, _, b_hidden, _, _ = self._variables()
+        return tf.tensordot(h, w_h, axes=1) + b_hidden
+
+    def _head_output(self, head, hidden):
+        _, _, _, w_out, b_out = self._variables()
+        logits = tf.tensordot(tf.nn.relu(hidden), w_out[hidden_slice(head), output_slice(head)], axes=1)
+        return logits + b_out[output_slice(head)]
+
+    def logits(self, head, context, inputs):
+        _, w_cond, _, _, _ = self._variables()
+        hidden = context[..., hidden_slice(head)]
+        if inputs:
+            x = tf.concat(inputs, axis=-1)
+            hidden += tf.tensordot(x, w_cond[:x.shape.as_list()[-1], hidden_slice(head)], axes=1)
+        return self._head_output(head, hidden)
+
+    def chord_context(self, context, inputs):
+        _, w_cond, _, _, _ = self._variables()
+        x = tf.concat(inputs, axis=-1)
+        w = w_cond[:x.shape.as_list()[-1], hidden_slice('c')]
+        return context[..., hidden_slice('c')] + tf.tensordot(x, w, axes=1)
+
+    def chord_logits(self, chord_context, c):
+        _, w_cond, _, _, _ = self._variables()
+        hidden = chord_context + tf.tensordot(c, w_cond[output_slice('c'), hidden_slice('c')], axes=1)
+        return self._head_output('c', hidden)
+
+
+Modules = collections.namedtuple('Modules', ['embedding', 'backbone', 'heads'])
+_modules = None
+
+
+def build_backbone():
+    if BACKBONE == 'lstm':
+        return LSTMBackbone(NUM_LSTM_UNITS)
+    elif BACKBONE == 'conv':
+        return DilatedConvBackbone(NUM_CONV_LAYERS, NUM_CONV_CHANNELS, CONV_KERNEL_SIZE)
+    elif BACKBONE == 'transformer':
+        return CausalTransformerBackbone(
+            NUM_TRANSFORMER_LAYERS, TRANSFORMER_SIZE, NUM_ATTENTION_HEADS, MAX_ATTENTION_CONTEXT
+        )
+    raise ValueError("Unknown backbone: %s" % BACKBONE)
+
+
+def get_modules():
+    # The modules are only created when the model is first built, so that importing this file stays cheap.
+    global _modules
+    if _modules is None:
+        backbone = build_backbone()
+        if BACKBONE == 'lstm':
+            # Initialise the input weights in the same way as snt.LSTM does (based on its concatenated input size).
+            initializer_stddev = 1.0 / np.sqrt(100 + NUM_LSTM_UNITS)
+        else:
+            initializer_stddev = 1.0 / np.sqrt(100)
+        _modules = Modules(
+            embedding=InputEmbedding(backbone.input_size, initializer_stddev),
+            backbone=backbone,
+            # Set up autoregressive output modules.
+            heads=FusedOutputHeads(backbone.output_size) if FUSED_HEADS else OutputHeads()
+        )
+    return _modules
+
+
+def build_model(indices, lengths):  # indices is a 3D int tensor [batch_size, num_timesteps, 5].
+    m = get_modules()
+    v = vectors_from_indices(indices)
+    indices_in = shift_indices_by_one_timestep(indices)
+    h = m.backbone(m.embedding(indices_in), lengths)  # The embeddings of all the timesteps are computed in one go.
 
+    # Autoregressive output networks.
+    return m.heads(h, v)
 
-# Set up autoregressive output modules.
-p_module = snt.Module(lambda inputs: output_net(1, 128, 38, inputs), name='p_module')
-r_module = snt.Module(lambda inputs: output_net(1, 128, 13, inputs), name='r_module')
-b_module = snt.Module(lambda inputs: output_net(1, 128, 13, inputs), name='b_module')
-c_module = snt.Module(lambda m, other_inputs: masked_output_net(1, 384, 12, m, other_inputs), name='c_module')
-d_module = snt.Module(lambda inputs: output_net(1, 128, 24, inputs), name='d_module')
 
+def initial_state_for_sampling(batch_size=BATCH_SIZE):  # batch_size can be an int or a scalar int32 tensor.
+    return get_modules().backbone.initial_state(batch_size)
 
-def build_model(v, lengths):
-    v_in = shift_by_one_timestep(v)
-    h, final_state = tf.nn.dynamic_rnn(
-        cell=cell,
-        inputs=v_in,
-        initial_state=initial_state,
-        sequence_length=lengths
-    )
 
-    # Autoregressive output networks.
-    p, r, b, c, d = split_vectors(v)
+def build_primed_state(indices, lengths):
+    """
+    Primes the backbone with a batch of prompts (index-encoded, [batch_size, num_timesteps, 5], padded, along with
+    their lengths) in a single parallel pass, rather than one sampling step per timestep. Returns the state to sample
+    from and the timestep vector to feed in next (each prompt's last timestep), as build_model_for_sampling takes.
+    """
+    m = get_modules()
+    state = m.backbone.prime(m.embedding(shift_indices_by_one_timestep(indices)), lengths)
+    last = tf.gather_nd(indices, tf.stack([tf.range(tf.shape(indices)[0]), lengths - 1], axis=1))
+    return state, vectors_from_indices(last)
 
-    p_out = p_module([h])
-    r_out = r_module([h, p])
-    b_out = b_module([h, p, r])
-    c_out = c_module(c, [h, p, r, b])  # Also gets itself as input!
-    d_out = d_module([h, p, r, b, c])
 
-    # Join all the outputs and return.
-    return tf.concat([p_out, r_out, b_out, c_out, d_out], axis=-1)
+def feasible_durations(elapsed):
+    # The TensorFlow version of corpus.feasible_durations, for an int32 tensor elapsed [batch_size].
+    remaining = BAR_DURATION - tf.floormod(elapsed, BAR_DURATION)
+    return tf.less_equal(tf.constant(DURATIONS, dtype=tf.int32)[None], remaining[:, None])
 
 
-def initial_state_for_sampling():
-    return initial_state
+def durations_from_vectors(v):
+    # The durations of a batch of timestep vectors [batch_size, 100], as an int32 tensor [batch_size].
+    return tf.constant(DURATIONS, dtype=tf.int32)[tf.argmax(v[:, -len(DURATIONS):], axis=-1, output_type=tf.int32)]
 
 
-def build_model_for_sampling(v, prev_state):
-    h, next_state = cell(v, prev_state)
+def build_model_for_sampling(v, prev_state, elapsed=None):
+    # If elapsed (the duration of each sequence so far) is given, the sampled durations are kept within the current
+    # bar, so that no timestep crosses a barline.
+    m = get_modules()
+    h, next_state = m.backbone.step(m.embedding(indices_from_vectors(v)), prev_state)
     h = tf.expand_dims(h, 1)  # Add time axis, because the output nets operate on 3D tensors (containing sequences).
 
-    p = sample_categorical(p_module([h]))
-    r = sample_categorical(r_module([h, p]))
-    b = sample_categorical(b_module([h, p, r]))
-
-    # Sample c repeatedly and select the correct parts.
-    # TODO: tf.while_loop?
-    c = tf.zeros([BATCH_SIZE, 1, 12], dtype=tf.float32)
+    context = m.heads.context(h)
+    p = sample_categorical(m.heads.logits('p', context, []))
+    r = sample_categorical(m.heads.logits('r', context, [p]))
+    b = sample_categorical(m.heads.logits('b', context, [p, r]))
+
+    # Sample c one note at a time. The context part of the chord network's first layer doesn't depend on the chord
+    # notes, so it is computed once, and only the (cheap) masked part of the network is run for each note. Notes are
+    # forced in or out of the chord so that it stays completable to one with a chord symbol (and N.C. has no notes).
+    c_context = m.heads.chord_context(context, [p, r, b])
+    c = tf.zeros([tf.shape(v)[0], 1, 12], dtype=tf.float32)
+    chord = tf.zeros([tf.shape(v)[0], 1, 1], dtype=tf.int32)  # The chord notes sampled so far, as a mask.
+    no_chord = tf.equal(tf.argmax(r, axis=-1, output_type=tf.int32), NO_CHORD_ROOT_INDEX)[..., None]
+    prefix_table = tf.constant(chord_prefix_table())
     for i in range(12):
-        c_new = sample_bernoulli(c_module(c, [h, p, r, b]))
-        c = tf.concat([c[:, :, :i], c_new[:, :, i:]], axis=-1)  # keep the previously sampled steps
-
-    d = sample_categorical(d_module([h, p, r, b, c]))
+        c_logits = m.heads.chord_logits(c_context, c)[:, :, i:i + 1]  # Only note i's output is needed at this point.
+        can_omit = tf.logical_or(tf.gather(prefix_table[i + 1], chord), no_chord)
+        can_include = tf.logical_and(tf.gather(prefix_table[i + 1], chord + (1 << i)), tf.logical_not(no_chord))
+        c_logits = tf.where(can_include, tf.where(can_omit, c_logits, tf.fill(tf.shape(c_logits), np.inf)),
+                            tf.fill(tf.shape(c_logits), -np.inf))
+        c_new = sample_bernoulli(c_logits)
+        c = tf.concat([c[:, :, :i], c_new, c[:, :, i + 1:]], axis=-1)  # keep the previously sampled steps
+        chord += tf.cast(c_new, tf.int32) * (1 << i)
+
+    d_logits = m.heads.logits('d', context, [p, r, b, c])
+    if elapsed is not None:
+        d_logits = tf.where(feasible_durations(elapsed)[:, None], d_logits, tf.fill(tf.shape(d_logits), -np.inf))
+    d = sample_categorical(d_logits)
 
     s = tf.concat([p, r, b, c, d], axis=-1)  # Join the parts together in a single vector.
     s = tf.squeeze(s, axis=1)  # Remove time axis.
@@ -0,0 +1,456 @@
+"""
+A pure NumPy implementation of the autoregressive model's forward pass (LSTM backbone plus fused output heads), for
+sampling without TensorFlow. The weights are extracted from a checkpoint once, with export_weights, into a compact
+.npz file (converting older checkpoint layouts on the way), which NumpyModel.load can then read in a few milliseconds.
+
+Sampling is batched: each call to sample_step samples one timestep for every sequence in the batch, head by head
+(pitch, root, bass, the 12 chord notes one at a time, then duration), exactly as build_model_for_sampling does.
+The sampling loops keep track of how far each sequence is through its current bar, and only let it pick durations
+that fit in the rest of the bar, so that no timestep crosses a barline (continuations of prompts are assumed to start
+on a barline, as the ones from prompts.py do). Likewise, the chord notes are only sampled from the combinations that
+get a chord symbol (see decoder.chord_prefix_table), and chords with no root (N.C.) get no notes.
+
+    python main.py export-weights checkpoints/model-10000 model.npz
+    python main.py sample --weights model.npz
+    python main.py sample --weights model.npz --num-bars 32
+
+Each head can also be sampled with its own temperature, top-k and top-p (nucleus) truncation, given as a dict of
+SamplingSettings keyed by head name ('p', 'r', 'b', 'c' or 'd'; see settings_from_spec). Each setting is either a
+number or an array with one per sequence in the batch, so one batch can mix sequences with different settings.
+"""
+
+import collections
+import hashlib
+
+import numpy as np
+
+from corpus import DURATIONS, FIELD_SIZES, durations_from_indices, feasible_durations, vectors_from_indices
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table
+from definitions import BAR_DURATION
+from Model.layout import HEAD_NAMES, OUTPUT_OFFSETS, START_INDICES, fused_head_masks, hidden_slice, output_slice
+
+EMBEDDING_NAMES = ['pitch', 'root', 'bass', 'chord', 'duration']
+MAX_STEPS_PER_BAR = 24  # Limits the length of a piece sampled to a number of bars (see NumpyModel.sample_bars).
+TIED_PITCH_INDEX = 36  # The pitch index of a timestep that carries on the previous one's note.
+
+# A temperature of 0 always takes the most likely outcome, a top_k of 0 doesn't truncate, and neither does a top_p of 1.
+SamplingSettings = collections.namedtuple('SamplingSettings', ['temperature', 'top_k', 'top_p'])
+SamplingSettings.__new__.__defaults__ = (1.0, 0, 1.0)
+
+
+def export_weights(checkpoint_path, output_path):
+    from Model.convert_checkpoint import read_checkpoint, convert_variables
+    variables = convert_variables(read_checkpoint(checkpoint_path))
+    if 'lstm/w_h_gates' not in variables:
+        raise ValueError("The NumPy engine only supports the LSTM backbone")
+
+    cond_mask, out_mask = fused_head_masks()
+    weights = {'embed_' + name: variables['input_embedding/' + name] for name in EMBEDDING_NAMES}
+    weights.update({
+        'lstm_w_h': variables['lstm/w_h_gates'],
+        'lstm_b': variables['lstm/b_gates'],
+        'heads_w_h': variables['output_heads/w_h'],
+        'heads_w_cond': variables['output_heads/w_cond'] * cond_mask,  # Masks are applied once, here.
+        'heads_b_hidden': variables['output_heads/b_hidden'],
+        'heads_w_out': variables['output_heads/w_out'] * out_mask,
+        'heads_b_out': variables['output_heads/b_out'],
+    })
+    np.savez(output_path, **{name: value.astype(np.float32) for name, value in weights.items()})
+    return output_path
+
+
+def weights_fingerprint(weights):
+    # A hash of a dict of weights, to tell whether something saved along the way (e.g. primed states) came from them.
+    digest = hashlib.sha1()
+    for name in sorted(weights):
+        digest.update(name.encode('ascii') + np.ascontiguousarray(weights[name], dtype=np.float32).tobytes())
+    return digest.hexdigest()
+
+
+def sigmoid(x):
+    return 0.5 * (1.0 + np.tanh(0.5 * x))  # Doesn't overflow for large negative x.
+
+
+def softmax(logits):
+    e = np.exp(logits - logits.max(axis=-1, keepdims=True))
+    return e / e.sum(axis=-1, keepdims=True)
+
+
+def log_softmax(logits):
+    shifted = logits - logits.max(axis=-1, keepdims=True)
+    return shifted - np.log(np.exp(shifted).sum(axis=-1, keepdims=True))
+
+
+def log_sigmoid(x):
+    return -np.logaddexp(0.0, -x)
+
+
+def sample_categorical(logits, rng):
+    # Samples one index per row of a [batch_size, num_classes] array of logits.
+    cumulative = np.cumsum(softmax(logits), axis=-1)
+    u = rng.random_sample([logits.shape[0], 1]) * cumulative[:, -1:]
+    return np.minimum((cumulative < u).sum(axis=-1), logits.shape[-1] - 1)
+
+
+def sample_bernoulli(logits, rng):
+    return (rng.random_sample(logits.shape) < sigmoid(logits)).astype(np.float32)
+
+
+def truncate_logits(logits, settings):
+    """
+    Applies a head's SamplingSettings to a batch of logits [batch_size, num_classes]: they are divided by the
+    temperature, then all but the top_k most likely classes, and all but the smallest set of most likely classes
+    whose probabilities add up to at least top_p, are masked out. Classes tied with the least likely one kept are
+    kept too. A temperature of 0 keeps only the most likely class (and those tied with it).
+    """
+    batch_size, num_classes = logits.shape
+    temperature, top_k, top_p = (np.broadcast_to(setting, [batch_size]) for setting in settings)
+    greedy = temperature <= 0
+    logits = logits / np.where(greedy, 1.0, temperature)[:, None]
+    top_k = np.where(greedy, 1, top_k)
+
+    ranked = -np.sort(-logits, axis=-1)
+    num_kept = np.where(top_k > 0, np.minimum(top_k, num_classes), num_classes)
+    probs = softmax(ranked)
+    in_nucleus = (np.cumsum(probs, axis=-1) - probs < top_p[:, None]).sum(axis=-1)
+    num_kept = np.where(top_p < 1.0, np.minimum(num_kept, np.maximum(in_nucleus, 1)), num_kept)
+    threshold = ranked[np.arange(batch_size), num_kept - 1]
+    return np.where(logits >= threshold[:, None], logits, -np.inf)
+
+
+def truncate_bernoulli_logits(logits, settings):
+    # The same as truncate_logits for the logits [batch_size] of a chord note, which has two outcomes: with a top_k of
+    # 1, or if the more likely outcome's probability is at least top_p, that outcome is always taken.
+    temperature, top_k, top_p = (np.broadcast_to(setting, logits.shape) for setting in settings)
+    logits = logits / np.where(temperature <= 0, 1.0, temperature)
+    greedy = (temperature <= 0) | (top_k == 1) | ((top_p < 1.0) & (sigmoid(np.abs(logits)) >= top_p))
+    return np.where(greedy, np.where(logits >= 0, np.inf, -np.inf), logits)
+
+
+def settings_from_spec(spec):
+    """
+    Turns a JSON-style spec into per-head SamplingSettings (or None, if spec is empty). The spec's temperature, top_k
+    and top_p apply to every head, and can be overridden for a head by a dict under its field name, e.g.
+    {"temperature": 0.9, "pitch": {"top_p": 0.95}, "chord": {"temperature": 0}}. Raises a ValueError if it is invalid.
+    """
+    if not spec:
+        return None
+    if not isinstance(spec, dict):
+        raise ValueError("The sampling settings must be an object")
+    spec = dict(spec)
+    head_specs = {head: spec.pop(name, {}) for name, head in zip(EMBEDDING_NAMES, HEAD_NAMES)}
+    settings = {}
+    for head, head_spec in head_specs.items():
+        if not isinstance(head_spec, dict):
+            raise ValueError("The sampling settings of a head must be an object")
+        try:
+            head_settings = SamplingSettings(**dict(spec, **head_spec))
+        except TypeError:
+            raise ValueError("The sampling settings can only be: temperature, top_k, top_p, " +
+                             ", ".join(EMBEDDING_NAMES))
+        temperature, top_k, top_p = head_settings
+        if not all(isinstance(x, (int, float)) and not isinstance(x, bool) for x in head_settings) or \
+                temperature < 0 or top_k < 0 or top_k != int(top_k) or not 0 < top_p <= 1:
+            raise ValueError("temperature must be at least 0, top_k a whole number (0 for none), and top_p in (0, 1]")
+        settings[head] = head_settings
+    return settings
+
+
+def stack_settings(settings_list):
+    # Combines the per-head settings (or None) of each sequence into per-head settings for the batch.
+    if all(settings is None for settings in settings_list):
+        return None
+    settings_list = [settings or {} for settings in settings_list]
+    return {head: SamplingSettings(*(np.array(field) for field in
+                                     zip(*(settings.get(head, SamplingSettings()) for settings in settings_list))))
+            for head in HEAD_NAMES}
+
+
+def select_settings(settings, rows):
+    # The settings of some of the rows of a batch.
+    if settings is None:
+        return None
+    return {head: SamplingSettings(*(np.asarray(field)[rows] if np.ndim(field) else field for field in head_settings))
+            for head, head_settings in settings.items()}
+
+
+def apply_settings(logits, settings, head):
+    if settings is None or settings.get(head) is None:
+        return logits
+    if head == 'c':
+        return truncate_bernoulli_logits(logits, settings[head])
+    return truncate_logits(logits, settings[head])
+
+
+def dense(x, w):
+    # x . w for x [..., num_inputs], as one 2-D matrix product: neither np.dot nor np.matmul does that for more
+    # dimensions (np.dot doesn't use BLAS, and np.matmul multiplies each [num_timesteps, num_inputs] matrix separately).
+    return np.dot(x.reshape(-1, x.shape[-1]), w).reshape(x.shape[:-1] + w.shape[1:])
+
+
+def one_hot(indices, depth):
+    return (np.asarray(indices)[..., None] == np.arange(depth)).astype(np.float32)
+
+
+class NumpyModel:
+    def __init__(self, weights):
+        self.fingerprint = weights_fingerprint(weights)
+        self.embeddings = [weights['embed_' + name] for name in EMBEDDING_NAMES]
+        self.lstm_w_h = weights['lstm_w_h']
+        self.lstm_b = weights['lstm_b']
+        self.num_units = self.lstm_w_h.shape[0]
+
+        self.w_h = weights['heads_w_h']
+        self.b_hidden = weights['heads_b_hidden']
+        w_cond = weights['heads_w_cond']
+        w_out = weights['heads_w_out']
+        b_out = weights['heads_b_out']
+        # Per-head blocks of the fused weights, as used when the heads are run one at a time.
+        self.head_w_cond = {head: w_cond[:OUTPUT_OFFSETS[k], hidden_slice(head)] for k, head in enumerate(HEAD_NAMES)}
+        self.head_w_out = {head: w_out[hidden_slice(head), output_slice(head)] for head in HEAD_NAMES}
+        self.head_b_out = {head: b_out[output_slice(head)] for head in HEAD_NAMES}
+        self.chord_w_in = w_cond[output_slice('c'), hidden_slice('c')]  # The chord head's masked input weights.
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            return cls({name: f[name] for name in f.files})
+
+    def initial_state(self, batch_size):
+        # The (hidden, cell) state of the LSTM.
+        return (np.zeros([batch_size, self.num_units], dtype=np.float32),
+                np.zeros([batch_size, self.num_units], dtype=np.float32))
+
+    def embed(self, indices):
+        # indices is an int array [..., 5] of index-encoded timesteps. Returns the LSTM input gate activations.
+        indices = np.asarray(indices)
+        gates = self.embeddings[0][indices[..., 0]] + self.embeddings[1][indices[..., 1]] + \
+            self.embeddings[2][indices[..., 2]] + self.embeddings[4][indices[..., 4]]
+        chord_bits = ((indices[..., 3, None] >> np.arange(12)) & 1).astype(np.float32)
+        return gates + dense(chord_bits, self.embeddings[3])
+
+    def lstm_step(self, input_gates, state):
+        prev_hidden, prev_cell = state
+        gates = input_gates + dense(prev_hidden, self.lstm_w_h) + self.lstm_b
+        i, j, f, o = np.split(gates, 4, axis=-1)
+        next_cell = sigmoid(f + 1.0) * prev_cell + sigmoid(i) * np.tanh(j)  # Forget gate bias of 1, as in snt.LSTM.
+        next_hidden = np.tanh(next_cell) * sigmoid(o)
+        return next_hidden, (next_hidden, next_cell)
+
+    def step(self, indices, state):
+        # Feeds in the previous timestep (index-encoded, [batch_size, 5]) and returns the new h and state.
+        return self.lstm_step(self.embed(indices), state)
+
+    def context(self, h):
+        return dense(h, self.w_h) + self.b_hidden
+
+    def head_logits(self, head, context, inputs):
+        # inputs is the list of (one-hot/multi-hot) fields before head, which may be empty.
+        hidden = context[..., hidden_slice(head)]
+        if inputs:
+            hidden = hidden + dense(np.concatenate(inputs, axis=-1), self.head_w_cond[head])
+        return dense(np.maximum(hidden, 0), self.head_w_out[head]) + self.head_b_out[head]
+
+    def chord_context(self, context, inputs):
+        return context[..., hidden_slice('c')] + dense(np.concatenate(inputs, axis=-1), self.head_w_cond['c'])
+
+    def chord_logits(self, chord_context, c):
+        hidden = chord_context + dense(c, self.chord_w_in)
+        return dense(np.maximum(hidden, 0), self.head_w_out['c']) + self.head_b_out['c']
+
+    def logits(self, h, v):
+        # Teacher-forced logits of every field [..., 100], given h and the timestep vectors v.
+        context = self.context(h)
+        p, r, b, c, d = np.split(v, OUTPUT_OFFSETS[1:-1], axis=-1)
+        return np.concatenate([
+            self.head_logits('p', context, []),
+            self.head_logits('r', context, [p]),
+            self.head_logits('b', context, [p, r]),
+            self.chord_logits(self.chord_context(context, [p, r, b]), c),
+            self.head_logits('d', context, [p, r, b, c]),
+        ], axis=-1)
+
+    def sample_step(self, h, rng, elapsed=None, settings=None):
+        """
+        Samples one timestep for each row of h (the LSTM output, [batch_size, num_units]). Returns the sampled
+        timesteps both index-encoded ([batch_size, 5]) and as timestep vectors ([batch_size, 100]). If elapsed (the
+        duration of each sequence so far, [batch_size]) is given, the durations are kept within the current bar.
+        settings are the per-head SamplingSettings, if any.
+        """
+        context = self.context(h)
+        pitch = sample_categorical(apply_settings(self.head_logits('p', context, []), settings, 'p'), rng)
+        p = one_hot(pitch, FIELD_SIZES[0])
+        root = sample_categorical(apply_settings(self.head_logits('r', context, [p]), settings, 'r'), rng)
+        r = one_hot(root, FIELD_SIZES[1])
+        bass = sample_categorical(apply_settings(self.head_logits('b', context, [p, r]), settings, 'b'), rng)
+        b = one_hot(bass, FIELD_SIZES[2])
+
+        # Sample the chord notes one at a time, reusing the part of the chord head that doesn't depend on them. A note
+        # is forced in (or out) of the chord when leaving it out (or putting it in) couldn't lead to a valid chord.
+        chord_context = self.chord_context(context, [p, r, b])
+        c = np.zeros([h.shape[0], FIELD_SIZES[3]], dtype=np.float32)
+        chord = np.zeros([h.shape[0]], dtype=np.int64)
+        no_chord = root == NO_CHORD_ROOT_INDEX
+        prefix_table = chord_prefix_table()
+        for i in range(FIELD_SIZES[3]):
+            can_omit = prefix_table[i + 1, chord] | no_chord
+            can_include = prefix_table[i + 1, chord | 1 << i] & ~no_chord
+            logits = self.chord_logits(chord_context, c)[:, i]
+            logits = np.where(can_include, np.where(can_omit, logits, np.inf), -np.inf)
+            c[:, i] = sample_bernoulli(apply_settings(logits, settings, 'c'), rng)
+            chord |= c[:, i].astype(np.int64) << i
+
+        duration_logits = self.head_logits('d', context, [p, r, b, c])
+        if elapsed is not None:
+            duration_logits = np.where(feasible_durations(elapsed), duration_logits, -np.inf)
+        duration = sample_categorical(apply_settings(duration_logits, settings, 'd'), rng)
+        d = one_hot(duration, FIELD_SIZES[4])
+
+        indices = np.stack([pitch, root, bass, chord, duration], axis=-1)
+        return indices, np.concatenate([p, r, b, c, d], axis=-1)
+
+    def start_indices(self, batch_size):
+        return np.tile(np.array(START_INDICES), [batch_size, 1])
+
+    def prime(self, prompts):
+        """
+        Primes the model with a batch of prompts (a list of index-encoded sequences [num_timesteps, 5], which can
+        have different lengths), and returns what sampling needs to carry on from the end of each one: the LSTM
+        state, and the next input (the prompt's last timestep). Nothing is sampled, and the input projections of
+        every timestep are computed in one go, so only the LSTM's recurrence is stepped through.
+        """
+        lengths = np.array([len(prompt) for prompt in prompts])
+        inputs = np.tile(self.start_indices(1)[None], [len(prompts), lengths.max(), 1])
+        for i, prompt in enumerate(prompts):
+            inputs[i, 1:lengths[i]] = prompt[:-1]  # Shifted by one timestep, as in run.
+        input_gates = self.embed(inputs)
+
+        state = self.initial_state(len(prompts))
+        for t in range(lengths.max()):
+            _, next_state = self.lstm_step(input_gates[:, t], state)
+            active = (t < lengths)[:, None]  # Each state stops changing at the end of its prompt.
+            state = tuple(np.where(active, s, prev_s) for s, prev_s in zip(next_state, state))
+        return state, np.stack([prompt[-1] for prompt in prompts])
+
+    def sample(self, batch_size, num_steps, seed=None, primed=None, settings=None):
+        # Returns a batch of sampled sequences of timestep vectors, [batch_size, num_steps, 100]. If primed (the
+        # result of prime) is given, sampling continues from the end of the prompts. settings are as in sample_step.
+        rng = np.random.RandomState(seed)
+        state, indices = primed or (self.initial_state(batch_size), self.start_indices(batch_size))
+        samples = np.zeros([batch_size, num_steps, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+        elapsed = np.zeros([batch_size], dtype=np.int64)
+        for t in range(num_steps):
+            h, state = self.step(indices, state)
+            indices, samples[:, t] = self.sample_step(h, rng, elapsed, settings)
+            elapsed += durations_from_indices(indices)
+        return samples
+
+    def generate(self, batch_size=1, seed=None, primed=None, settings=None):
+        # Yields the sampled timesteps of a batch of sequences one step at a time, as (indices, vectors), for as long
+        # as the caller keeps asking for them.
+        rng = np.random.RandomState(seed)
+        state, indices = primed or (self.initial_state(batch_size), self.start_indices(batch_size))
+        elapsed = np.zeros([batch_size], dtype=np.int64)
+        while True:
+            h, state = self.step(indices, state)
+            indices, vectors = self.sample_step(h, rng, elapsed, settings)
+            elapsed += durations_from_indices(indices)
+            yield indices, vectors
+
+    def sample_bars(self, batch_size, num_bars, max_steps=None, seed=None, primed=None, settings=None):
+        """
+        Samples a batch of pieces that are num_bars bars long (an int, or one per sequence), assuming that they don't
+        start with a pickup. Each sequence stops being sampled once its timesteps add up to num_bars bars (or after
+        max_steps timesteps), and the finished sequences are dropped from the batch, so no time is spent sampling
+        past the end of a piece. If primed (the result of prime) is given, sampling continues from the end of the
+        prompts. Returns the zero-padded samples [batch_size, max_length, 100], and the length of each one. settings
+        are as in sample_step.
+        """
+        target_durations = np.broadcast_to(num_bars, [batch_size]) * BAR_DURATION
+        if max_steps is None:
+            max_steps = MAX_STEPS_PER_BAR * np.max(num_bars)
+        rng = np.random.RandomState(seed)
+        state, indices = primed or (self.initial_state(batch_size), self.start_indices(batch_size))
+        rows = np.arange(batch_size)  # The rows of the batch that are still being sampled.
+        elapsed = np.zeros([batch_size], dtype=np.int64)  # The accumulated duration of each sequence.
+        lengths = np.zeros([batch_size], dtype=np.int64)
+        samples = np.zeros([batch_size, max_steps, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+
+        for t in range(max_steps):
+            h, state = self.step(indices, state)
+            indices, samples[rows, t] = self.sample_step(h, rng, elapsed[rows], select_settings(settings, rows))
+            lengths[rows] += 1
+            elapsed[rows] += durations_from_indices(indices)
+
+            unfinished = elapsed[rows] < target_durations[rows]
+            if not unfinished.all():
+                rows, indices = rows[unfinished], indices[unfinished]
+                state = tuple(s[unfinished] for s in state)
+                if len(rows) == 0:
+                    break
+        return samples[:, :lengths.max()], lengths
+
+    def sample_melody(self, schedule, batch_size, max_steps=None, seed=None, primed=None, settings=None):
+        """
+        Samples a batch of melodies over a chord schedule (see progressions.py). The root, bass and chord of each
+        timestep are taken from the schedule rather than sampled, so only the pitch and duration heads are run. A
+        timestep can't last past the end of the schedule's timestep that it starts in, so none crosses a chord change
+        or barline: a note that carries on over a chord change is sampled as a tied note in the next timestep, in the
+        same way as in the corpus. If primed (the result of prime) is given, the melodies continue the prompts, and
+        the schedule starts at the end of them. Returns the zero-padded samples [batch_size, max_length, 100] and their
+        lengths. settings are as in sample_step (only those of the pitch and duration heads are used).
+        """
+        schedule = np.asarray(schedule)
+        boundaries = np.cumsum(durations_from_indices(schedule))  # When each timestep of the schedule ends.
+        forced = vectors_from_indices(schedule)[:, OUTPUT_OFFSETS[1]:OUTPUT_OFFSETS[4]]  # Its root, bass and chord.
+        if max_steps is None:
+            max_steps = MAX_STEPS_PER_BAR * -(-boundaries[-1] // BAR_DURATION)
+        rng = np.random.RandomState(seed)
+        state, indices = primed or (self.initial_state(batch_size), self.start_indices(batch_size))
+        rows = np.arange(batch_size)  # The rows of the batch that are still being sampled.
+        elapsed = np.zeros([batch_size], dtype=np.int64)  # Since the start of the schedule.
+        lengths = np.zeros([batch_size], dtype=np.int64)
+        samples = np.zeros([batch_size, max_steps, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+
+        for t in range(max_steps):
+            h, state = self.step(indices, state)
+            context = self.context(h)
+            pitch_logits = self.head_logits('p', context, [])
+            if t == 0 and primed is None:
+                pitch_logits[:, TIED_PITCH_INDEX] = -np.inf  # There's no note to carry on yet.
+            row_settings = select_settings(settings, rows)
+            pitch = sample_categorical(apply_settings(pitch_logits, row_settings, 'p'), rng)
+            p = one_hot(pitch, FIELD_SIZES[0])
+
+            segment = np.searchsorted(boundaries, elapsed[rows], side='right')
+            r, b, c = np.split(forced[segment], OUTPUT_OFFSETS[2:4] - OUTPUT_OFFSETS[1], axis=-1)
+            duration_logits = self.head_logits('d', context, [p, r, b, c])
+            fits = DURATIONS <= (boundaries[segment] - elapsed[rows])[:, None]
+            duration_logits = np.where(fits, duration_logits, -np.inf)
+            duration = sample_categorical(apply_settings(duration_logits, row_settings, 'd'), rng)
+
+            indices = np.concatenate([pitch[:, None], schedule[segment, 1:4], duration[:, None]], axis=-1)
+            samples[rows, t] = np.concatenate([p, r, b, c, one_hot(duration, FIELD_SIZES[4])], axis=-1)
+            lengths[rows] += 1
+            elapsed[rows] += DURATIONS[duration]
+
+            unfinished = elapsed[rows] < boundaries[-1]
+            if not unfinished.all():
+                rows, indices = rows[unfinished], indices[unfinished]
+                state = tuple(s[unfinished] for s in state)
+                if len(rows) == 0:
+                    break
+        return samples[:, :lengths.max()], lengths
+
+    def run(self, indices):
+        # Runs the LSTM over index-encoded sequences [batch_size, num_timesteps, 5] (teacher forcing), and returns
+        # the logits of every timestep, [batch_size, num_timesteps, 100].
+        indices = np.asarray(indices)
+        batch_size, num_timesteps = indices.shape[:2]
+        input_gates = self.embed(np.concatenate([self.start_indices(batch_size)[:, None], indices[:, :-1]], axis=1))
+        state = self.initial_state(batch_size)
+        hs = []
+        for t in range(num_timesteps):
+            h, state = self.lstm_step(input_gates[:, t], state)
+            hs.append(h)
+        return self.logits(np.stack(hs, axis=1), vectors_from_indices(indices))
@@ -0,0 +1,168 @@
+"""
+Continuous batching for the NumPy sampling engine. Rather than sampling a fixed batch of sequences in lockstep until
+the longest one is finished, ContinuousBatcher keeps a pool of batch slots, each with its own row of the LSTM state.
+When a sequence finishes, its slot is reset and handed to the next queued job straight away, so that the batch stays
+full under a stream of generation jobs of different lengths.
+
+    batcher = ContinuousBatcher(NumpyModel.load('model.npz'))
+    for num_bars in [8, 32, 16]:
+        batcher.submit(GenerationJob(num_bars=num_bars))
+    for job in batcher.run():
+        ...  # job.samples() is a [num_timesteps, 100] array of timestep vectors.
+"""
+
+import collections
+import time
+
+import numpy as np
+
+from corpus import durations_from_indices
+from definitions import BAR_DURATION
+from Model.numpy_engine import MAX_STEPS_PER_BAR, stack_settings
+
+BATCH_SIZE = 32
+CANDIDATE_BATCH_SIZES = [1, 4, 16, 32, 64, 128, 256, 512]
+AUTOTUNE_NUM_STEPS = 20  # The number of timesteps sampled to time each candidate batch size.
+
+
+class GenerationJob:
+    """
+    A request for one sampled piece, either num_bars bars long (assuming no pickup) or num_steps timesteps long.
+    With num_bars, num_steps is a limit on the number of timesteps. If primed, a (hidden, cell, next_input) tuple for
+    one prompt (see PrefixStateCache), is given, the piece continues the prompt. settings are the job's per-head
+    SamplingSettings, if any (jobs with different settings can share a batch).
+    """
+    def __init__(self, num_bars=None, num_steps=None, job_id=None, primed=None, settings=None):
+        if num_bars is None and num_steps is None:
+            raise ValueError("A generation job needs a number of bars or timesteps")
+        self.job_id = job_id
+        self.num_bars = num_bars
+        self.num_steps = num_steps if num_steps is not None else MAX_STEPS_PER_BAR * num_bars
+        self.primed = primed
+        self.settings = settings
+        self.timesteps = []  # The timestep vectors sampled so far.
+        self.elapsed = 0  # The total duration of the timesteps sampled so far.
+
+    def add_timestep(self, indices, vector):
+        self.timesteps.append(vector)
+        self.elapsed += int(durations_from_indices(indices))
+
+    @property
+    def finished(self):
+        if self.num_bars is not None and self.elapsed >= self.num_bars * BAR_DURATION:
+            return True
+        return len(self.timesteps) >= self.num_steps
+
+    def samples(self):
+        return np.stack(self.timesteps)
+
+
+class ContinuousBatcher:
+    def __init__(self, model, batch_size=BATCH_SIZE, seed=None, rng=None):
+        self.model = model
+        self.batch_size = batch_size
+        self.rng = rng if rng is not None else np.random.RandomState(seed)
+        self.queue = collections.deque()
+        self.slots = [None] * batch_size  # The job being sampled in each slot, if any.
+        self.state = model.initial_state(batch_size)
+        self.indices = model.start_indices(batch_size)
+
+        # Utilisation statistics: the number of steps taken, and the number of occupied slots summed over them.
+        self.num_steps = 0
+        self.num_slot_steps = 0
+
+    def submit(self, job):
+        self.queue.append(job)
+        return job
+
+    @property
+    def busy(self):
+        return bool(self.queue) or any(job is not None for job in self.slots)
+
+    @property
+    def utilisation(self):
+        # The fraction of batch slots that were occupied, averaged over the steps taken so far.
+        return self.num_slot_steps / max(self.num_steps * self.batch_size, 1)
+
+    def _fill_free_slots(self):
+        for slot, job in enumerate(self.slots):
+            if job is None and self.queue:
+                job = self.slots[slot] = self.queue.popleft()
+                if job.primed is not None:
+                    self.state[0][slot], self.state[1][slot], self.indices[slot] = job.primed
+                else:
+                    for s in self.state:
+                        s[slot] = 0.0  # The LSTM's initial state.
+                    self.indices[slot] = self.model.start_indices(1)[0]
+
+    def step(self):
+        """
+        Fills the free slots from the queue, then samples the next timestep of every job in the batch. Only the
+        occupied slots are stepped. Returns the jobs that finished on this step, whose slots are now free.
+        """
+        self._fill_free_slots()
+        rows = np.array([slot for slot, job in enumerate(self.slots) if job is not None], dtype=np.int64)
+        if len(rows) == 0:
+            return []
+
+        elapsed = np.array([self.slots[slot].elapsed for slot in rows])
+        settings = stack_settings([self.slots[slot].settings for slot in rows])
+        if len(rows) == self.batch_size:
+            h, self.state = self.model.step(self.indices, self.state)
+            self.indices, vectors = self.model.sample_step(h, self.rng, elapsed, settings)
+        else:
+            h, state = self.model.step(self.indices[rows], tuple(s[rows] for s in self.state))
+            indices, vectors = self.model.sample_step(h, self.rng, elapsed, settings)
+            for s, new_s in zip(self.state, state):
+                s[rows] = new_s
+            self.indices[rows] = indices
+
+        self.num_steps += 1
+        self.num_slot_steps += len(rows)
+
+        finished = []
+        for i, slot in enumerate(rows):
+            job = self.slots[slot]
+            job.add_timestep(self.indices[slot], vectors[i])
+            if job.finished:
+                finished.append(job)
+                self.slots[slot] = None
+        return finished
+
+    def run(self):
+        # Steps until every submitted job has finished, yielding the jobs as they finish. More jobs can be submitted
+        # in the meantime.
+        while self.busy:
+            for job in self.step():
+                yield job
+
+
+def fastest_batch_size(sample_steps, max_batch_size=None, candidates=CANDIDATE_BATCH_SIZES):
+    """
+    Picks the batch size with the highest sampling throughput (timesteps per second) on this machine, by timing each
+    candidate up to max_batch_size (itself a candidate when it is under the largest one). sample_steps(batch_size,
+    num_steps) should sample num_steps timesteps for a batch of batch_size sequences.
+    """
+    if max_batch_size is not None:
+        max_batch_size = min(max_batch_size, candidates[-1])
+        candidates = [size for size in candidates if size < max_batch_size] + [max_batch_size]
+    best_batch_size, best_throughput = None, 0.0
+    for batch_size in candidates:
+        sample_steps(batch_size, 1)  # Warm up, e.g. so that TensorFlow has allocated memory for this batch size.
+        start = time.perf_counter()
+        sample_steps(batch_size, AUTOTUNE_NUM_STEPS)
+        throughput = batch_size * AUTOTUNE_NUM_STEPS / (time.perf_counter() - start)
+        if throughput > best_throughput:
+            best_batch_size, best_throughput = batch_size, throughput
+    return best_batch_size
+
+
+def sample_in_batches(sample_batch, num_samples, batch_size):
+    """
+    Samples num_samples sequences in batches of (up to) batch_size. sample_batch(first, batch_size) should return
+    samples first to first + batch_size - 1, as a batch [batch_size, num_timesteps, 100] (zero-padded if they have
+    different lengths). The batches are padded to the same length and concatenated.
+    """
+    batches = [sample_batch(first, min(batch_size, num_samples - first)) for first in range(0, num_samples, batch_size)]
+    length = max(batch.shape[1] for batch in batches)
+    return np.concatenate([np.pad(batch, [(0, 0), (0, length - batch.shape[1]), (0, 0)]) for batch in batches])
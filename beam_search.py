@@ -0,0 +1,142 @@
+"""
+Beam search with the NumPy engine, for "best guess" continuations rather than samples. The search follows the
+model's factorisation of each timestep (pitch, root, bass, the 12 chord notes one at a time, then duration): each of
+those choices expands every hypothesis with all of its outcomes, and only the beam_width best partial timesteps of
+each search are kept, so a whole timestep never has to be enumerated.
+
+The hypotheses of every search in the batch are laid out along the batch axis (beam_width rows per search), and when
+a timestep is finished, each hypothesis copies the LSTM state row of the hypothesis that it expanded. Durations are
+kept within the current bar and chords to valid ones, as when sampling, so the scores are log-likelihoods under the
+same renormalised distributions that sampling draws from. With num_bars, hypotheses finish at different
+numbers of timesteps, so they are ranked by their log-likelihood divided by a length penalty (as in Wu et al., 2016):
+((5 + num_timesteps) / 6) ** alpha. An alpha of 0 ranks them by log-likelihood alone. Hypotheses that reach the
+limit of num_steps timesteps before num_bars bars are ranked after every one that reaches num_bars bars.
+
+    python main.py sample --weights model.npz --num-bars 8 --beam-width 8
+"""
+
+import numpy as np
+
+from corpus import FIELD_SIZES, durations_from_indices, feasible_durations, vectors_from_indices
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table
+from definitions import BAR_DURATION
+from Model.layout import OUTPUT_OFFSETS
+from Model.numpy_engine import MAX_STEPS_PER_BAR, TIED_PITCH_INDEX, log_softmax, one_hot
+
+BEAM_WIDTH = 8
+LENGTH_PENALTY = 0.6
+
+
+def length_penalty(num_timesteps, alpha=LENGTH_PENALTY):
+    return ((5.0 + num_timesteps) / 6.0) ** alpha
+
+
+def expand(scores, log_probs, beam_width):
+    """
+    Extends each hypothesis (with the log-likelihood scores [batch_size * beam_width]) with every outcome of a choice
+    (with the log-probabilities log_probs [batch_size * beam_width, num_outcomes]), and keeps the beam_width best of
+    each search. Returns their scores, the rows of the hypotheses that they extend, and the outcomes chosen.
+    """
+    num_outcomes = log_probs.shape[-1]
+    candidates = (scores[:, None] + log_probs).reshape(-1, beam_width * num_outcomes)
+    best = np.argsort(-candidates, axis=-1, kind='stable')[:, :beam_width]
+    rows = np.arange(len(candidates))[:, None] * beam_width + best // num_outcomes
+    return np.take_along_axis(candidates, best, axis=-1).ravel(), rows.ravel(), (best % num_outcomes).ravel()
+
+
+def beam_search(model, batch_size=1, beam_width=BEAM_WIDTH, num_bars=None, num_steps=None, alpha=LENGTH_PENALTY,
+                primed=None):
+    """
+    Searches for the most likely continuations of batch_size sequences: either num_bars bars long (assuming no
+    pickup, with num_steps as a limit on the number of timesteps) or num_steps timesteps long. If primed (the result
+    of model.prime) is given, the searches continue the prompts. Returns the beam_width best hypotheses of each
+    search, best first: their timestep vectors [batch_size, beam_width, max_length, 100] (zero-padded), lengths
+    [batch_size, beam_width], and scores (length-normalised log-likelihoods) [batch_size, beam_width].
+    """
+    if num_bars is None and num_steps is None:
+        raise ValueError("A beam search needs a number of bars or timesteps")
+    if num_steps is None:
+        num_steps = MAX_STEPS_PER_BAR * num_bars
+    num_rows = batch_size * beam_width
+    if primed is not None:
+        (hidden, cell), indices = primed
+        state = (np.repeat(hidden, beam_width, axis=0), np.repeat(cell, beam_width, axis=0))
+        indices = np.repeat(indices, beam_width, axis=0)
+    else:
+        state, indices = model.initial_state(num_rows), model.start_indices(num_rows)
+
+    # Each search starts with one hypothesis, so that its beam isn't filled with copies of it.
+    scores = np.tile(np.concatenate([[0.0], np.full([beam_width - 1], -np.inf)]), batch_size)
+    history = np.zeros([num_rows, 0, 5], dtype=np.int64)  # The index-encoded timesteps of each hypothesis.
+    elapsed = np.zeros([num_rows], dtype=np.int64)
+    finished = [[] for _ in range(batch_size)]  # (complete, score, indices) of each search's finished hypotheses.
+    prefix_table = chord_prefix_table()
+
+    for t in range(num_steps):
+        h, state = model.step(indices, state)
+        context = model.context(h)
+        parents = np.arange(num_rows)  # The hypothesis that each row's partial timestep extends.
+
+        fields = []  # The chosen outcomes of the pitch, root and bass so far, as one-hot vectors.
+        outcomes = []
+        for head, size in zip(['p', 'r', 'b'], FIELD_SIZES[:3]):
+            logits = model.head_logits(head, context, fields)
+            if head == 'p' and t == 0 and primed is None:
+                logits[:, TIED_PITCH_INDEX] = -np.inf  # There's no note to carry on yet.
+            log_probs = log_softmax(logits)
+            scores, rows, chosen = expand(scores, log_probs, beam_width)
+            parents, context = parents[rows], context[rows]
+            fields = [field[rows] for field in fields] + [one_hot(chosen, size)]
+            outcomes = [outcome[rows] for outcome in outcomes] + [chosen]
+
+        chord_context = model.chord_context(context, fields)
+        c = np.zeros([num_rows, FIELD_SIZES[3]], dtype=np.float32)
+        chord = np.zeros([num_rows], dtype=np.int64)
+        for i in range(FIELD_SIZES[3]):
+            no_chord = outcomes[1] == NO_CHORD_ROOT_INDEX
+            can_omit = prefix_table[i + 1, chord] | no_chord
+            can_include = prefix_table[i + 1, chord | 1 << i] & ~no_chord
+            logits = model.chord_logits(chord_context, c)[:, i]
+            # The two outcomes as a softmax over the logits (0, logits), which renormalises when one is ruled out.
+            log_probs = log_softmax(np.stack([np.where(can_omit, 0.0, -np.inf), np.where(can_include, logits, -np.inf)],
+                                             axis=-1))
+            scores, rows, chosen = expand(scores, log_probs, beam_width)
+            parents, context, chord_context, c = parents[rows], context[rows], chord_context[rows], c[rows]
+            fields = [field[rows] for field in fields]
+            outcomes = [outcome[rows] for outcome in outcomes]
+            c[:, i] = chosen
+            chord = chord[rows] | chosen << i
+
+        duration_logits = model.head_logits('d', context, fields + [c])
+        duration_logits = np.where(feasible_durations(elapsed[parents]), duration_logits, -np.inf)
+        scores, rows, duration = expand(scores, log_softmax(duration_logits), beam_width)
+        parents = parents[rows]
+        outcomes = [outcome[rows] for outcome in outcomes]
+
+        # Copy each hypothesis' state and history from the one that it extends.
+        indices = np.stack(outcomes + [chord[rows], duration], axis=-1)
+        state = tuple(s[parents] for s in state)
+        history = np.concatenate([history[parents], indices[:, None]], axis=1)
+        elapsed = elapsed[parents] + durations_from_indices(indices)
+
+        last = t + 1 == num_steps
+        complete = elapsed >= num_bars * BAR_DURATION if num_bars is not None else np.full([num_rows], last)
+        done = np.isfinite(scores) & (complete | last)  # Incomplete hypotheses are only kept if they run out of steps.
+        for row in np.flatnonzero(done):
+            score = scores[row] / length_penalty(t + 1, alpha)
+            finished[row // beam_width].append((complete[row], score, history[row]))
+        scores = np.where(done, -np.inf, scores)  # Finished hypotheses aren't extended any further.
+        if all(sum(hypothesis[0] for hypothesis in hypotheses) >= beam_width for hypotheses in finished):
+            break
+
+    # A search can finish with fewer than beam_width hypotheses if it has fewer possible ones. The rest are empty.
+    empty = (False, -np.inf, np.zeros([0, 5], dtype=np.int64))
+    best = [(sorted(hypotheses, key=lambda hypothesis: (not hypothesis[0], -hypothesis[1])) + [empty] * beam_width)
+            [:beam_width] for hypotheses in finished]
+    lengths = np.array([[len(hypothesis[2]) for hypothesis in hypotheses] for hypotheses in best])
+    samples = np.zeros([batch_size, beam_width, lengths.max(), OUTPUT_OFFSETS[-1]], dtype=np.float32)
+    search_scores = np.array([[hypothesis[1] for hypothesis in hypotheses] for hypotheses in best])
+    for i, hypotheses in enumerate(best):
+        for j, (_, _, hypothesis) in enumerate(hypotheses):
+            samples[i, j, :len(hypothesis)] = vectors_from_indices(hypothesis)
+    return samples, lengths, search_scores
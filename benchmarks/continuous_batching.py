@@ -0,0 +1,61 @@
+"""
+Throughput benchmark for continuous batching: samples a stream of jobs of mixed lengths (in bars) with the NumPy
+engine, first in lockstep batches (each batch runs until its longest piece is finished), then with ContinuousBatcher,
+and reports the timesteps sampled per second and the batch utilisation of each.
+
+    python benchmarks/continuous_batching.py --weights model.npz [--num-jobs 256]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import BATCH_SIZE, ContinuousBatcher, GenerationJob  # noqa: E402
+from Model.numpy_engine import NumpyModel  # noqa: E402
+
+JOB_NUM_BARS = [4, 8, 16, 32]
+
+
+def lockstep(model, job_num_bars):
+    # Returns (number of timesteps sampled, utilisation).
+    num_timesteps = 0
+    num_slot_steps = 0
+    for start in range(0, len(job_num_bars), BATCH_SIZE):
+        batch_num_bars = job_num_bars[start:start + BATCH_SIZE]
+        samples, lengths = model.sample_bars(len(batch_num_bars), batch_num_bars)
+        num_timesteps += lengths.sum()
+        num_slot_steps += BATCH_SIZE * lengths.max()
+    return num_timesteps, num_timesteps / num_slot_steps
+
+
+def continuous(model, job_num_bars):
+    batcher = ContinuousBatcher(model)
+    for num_bars in job_num_bars:
+        batcher.submit(GenerationJob(num_bars=num_bars))
+    num_timesteps = sum(len(job.timesteps) for job in batcher.run())
+    return num_timesteps, batcher.utilisation
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--num-jobs', type=int, default=256)
+    args = parser.parse_args()
+
+    model = NumpyModel.load(args.weights)
+    job_num_bars = list(np.random.RandomState(0).choice(JOB_NUM_BARS, size=args.num_jobs))
+    for name, run in [('Lockstep', lockstep), ('Continuous', continuous)]:
+        start = time.perf_counter()
+        num_timesteps, utilisation = run(model, job_num_bars)
+        elapsed = time.perf_counter() - start
+        print("%-10s %8.0f timesteps/s, %3.0f%% of batch slots used" % (
+            name, num_timesteps / elapsed, utilisation * 100))
+
+
+if __name__ == '__main__':
+    main()
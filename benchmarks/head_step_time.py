@@ -0,0 +1,73 @@
+"""
+Training step-time benchmark for the output heads: times teacher-forced training steps (forward and backward pass,
+plus the Adam update) with the separate heads and with FusedOutputHeads, on random index-encoded batches of the
+usual batch size.
+
+    python benchmarks/head_step_time.py [--num-timesteps 200] [--num-steps 50]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import FIELD_SIZES  # noqa: E402
+
+NUM_WARMUP_STEPS = 5
+
+
+def random_batch(batch_size, num_timesteps, seed=0):
+    rng = np.random.RandomState(seed)
+    indices = np.stack([
+        rng.randint(FIELD_SIZES[0], size=[batch_size, num_timesteps]),
+        rng.randint(FIELD_SIZES[1], size=[batch_size, num_timesteps]),
+        rng.randint(FIELD_SIZES[2], size=[batch_size, num_timesteps]),
+        rng.randint(1 << FIELD_SIZES[3], size=[batch_size, num_timesteps]),
+        rng.randint(FIELD_SIZES[4], size=[batch_size, num_timesteps]),
+    ], axis=-1).astype(np.int32)
+    lengths = np.full([batch_size], num_timesteps, dtype=np.int32)
+    return indices, lengths
+
+
+def time_training_steps(fused_heads, num_timesteps, num_steps):
+    # Returns the mean time (in seconds) of a training step.
+    import tensorflow as tf
+    from Model import model_autoregressive as model
+    import train
+
+    model.FUSED_HEADS = fused_heads
+    model._modules = None  # Build new modules in the new graph.
+    indices, lengths = random_batch(model.BATCH_SIZE, num_timesteps)
+
+    with tf.Graph().as_default():
+        inputs = {'data': tf.constant(indices), 'length': tf.constant(lengths)}
+        loss = train.get_loss(inputs)
+        train_op = tf.train.AdamOptimizer(learning_rate=2e-4).minimize(loss)
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            for _ in range(NUM_WARMUP_STEPS):
+                sess.run(train_op)
+            start = time.perf_counter()
+            for _ in range(num_steps):
+                sess.run(train_op)
+            return (time.perf_counter() - start) / num_steps
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num-timesteps', type=int, default=200)
+    parser.add_argument('--num-steps', type=int, default=50)
+    args = parser.parse_args()
+
+    separate = time_training_steps(False, args.num_timesteps, args.num_steps)
+    fused = time_training_steps(True, args.num_timesteps, args.num_steps)
+    print("Separate heads: %.1f ms/step" % (separate * 1000))
+    print("Fused heads:    %.1f ms/step (%.2fx)" % (fused * 1000, separate / fused))
+
+
+if __name__ == '__main__':
+    main()
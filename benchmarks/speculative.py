@@ -0,0 +1,69 @@
+"""
+Latency benchmark for speculative sampling: samples pieces with the NumPy engine, plainly (NumpyModel.sample_bars) and
+speculatively (SpeculativeSampler), at a few temperatures and batch sizes, and reports the time per timestep of each,
+along with how many timesteps each round of speculative sampling gives. The draft is built from the model's own
+samples at each temperature (or from the corpus, with --corpus-draft). Speculative sampling only wins when the
+draft is usually right, which needs a confident model: at a temperature of 0 it always should, and at a temperature
+of 1 with an untrained model it can't.
+
+    python benchmarks/speculative.py --weights model.npz [--draft-steps 4]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import indices_from_vectors  # noqa: E402
+from Model.layout import HEAD_NAMES  # noqa: E402
+from Model.numpy_engine import NumpyModel, SamplingSettings  # noqa: E402
+from speculative import DRAFT_STEPS, NgramDraft, SpeculativeSampler  # noqa: E402
+
+TEMPERATURES = [0.0, 0.5, 1.0]
+BATCH_SIZES = [1, 32]
+NUM_DRAFT_PIECES = 256
+NUM_RUNS = 3
+
+
+def time_per_timestep(sample):
+    # The fastest time per timestep (of the longest sequence) of NUM_RUNS runs of sample, which returns the lengths.
+    times = []
+    for seed in range(NUM_RUNS):
+        start = time.perf_counter()
+        lengths = sample(seed)
+        times.append((time.perf_counter() - start) / lengths.max())
+    return min(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--num-bars', type=int, default=16)
+    parser.add_argument('--draft-steps', type=int, default=DRAFT_STEPS)
+    parser.add_argument('--corpus-draft', action='store_true')
+    args = parser.parse_args()
+
+    model = NumpyModel.load(args.weights)
+    for temperature in TEMPERATURES:
+        settings = {head: SamplingSettings(temperature=temperature) for head in HEAD_NAMES}
+        if args.corpus_draft:
+            draft = NgramDraft.from_corpus()
+        else:
+            samples, lengths = model.sample_bars(NUM_DRAFT_PIECES, args.num_bars, seed=1234, settings=settings)
+            draft = NgramDraft([indices_from_vectors(sample[:length]) for sample, length in zip(samples, lengths)])
+        for batch_size in BATCH_SIZES:
+            plain = time_per_timestep(lambda seed: model.sample_bars(
+                batch_size, args.num_bars, seed=seed, settings=settings)[1])
+            sampler = SpeculativeSampler(model, draft, args.draft_steps)
+            speculative = time_per_timestep(lambda seed: sampler.sample_bars(
+                batch_size, args.num_bars, seed=seed, settings=settings)[1])
+            print("Temperature %.1f, batch size %2d: plain %5.2f ms/timestep, speculative %5.2f ms/timestep "
+                  "(%.1fx), %.2f timesteps per round, %d plain steps" % (
+                      temperature, batch_size, plain * 1000, speculative * 1000, plain / speculative,
+                      sampler.timesteps / float(max(sampler.rounds, 1)), sampler.plain_steps))
+
+
+if __name__ == '__main__':
+    main()
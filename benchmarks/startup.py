@@ -0,0 +1,65 @@
+"""
+Startup-time benchmark for the lightweight parts of the project. Each module is imported in a fresh interpreter
+(several times, keeping the fastest run), and the time taken over and above starting a bare interpreter is reported.
+The benchmark fails if any module takes longer than its budget, or if importing it pulls in TensorFlow, Sonnet or
+pretty_midi.
+
+    python benchmarks/startup.py
+"""
+
+import os
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+NUM_RUNS = 5
+HEAVY_MODULES = ['tensorflow', 'sonnet', 'pretty_midi']
+
+# Budget (in seconds) for importing each module, on top of the bare interpreter startup time.
+IMPORT_BUDGETS = {
+    'chord_parsing': 0.05,
+    'decoder': 0.25,
+    'corpus': 0.25,
+    'main': 0.05,
+    'Model.numpy_engine': 0.25,
+}
+
+CHECK_SCRIPT = '''
+import sys
+import %s
+loaded = [m for m in %r if m in sys.modules]
+if loaded:
+    sys.exit("heavy modules imported: " + ", ".join(loaded))
+'''
+
+
+def time_python(code):
+    # Returns the fastest wall time (in seconds) of running code in a fresh interpreter.
+    times = []
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        subprocess.check_call([sys.executable, '-c', code], cwd=REPO_DIR)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main():
+    baseline = time_python('pass')
+    print("Bare interpreter startup: %.1f ms" % (baseline * 1000))
+    failures = []
+    for module, budget in sorted(IMPORT_BUDGETS.items()):
+        try:
+            import_time = time_python(CHECK_SCRIPT % (module, HEAVY_MODULES)) - baseline
+        except subprocess.CalledProcessError:
+            failures.append("%s imports a heavy module" % module)
+            continue
+        print("import %-14s %7.1f ms (budget %.0f ms)" % (module, import_time * 1000, budget * 1000))
+        if import_time > budget:
+            failures.append("%s took %.1f ms to import" % (module, import_time * 1000))
+    if failures:
+        sys.exit("Startup benchmark failed: " + "; ".join(failures))
+
+
+if __name__ == '__main__':
+    main()
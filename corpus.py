@@ -0,0 +1,153 @@
+"""
+The functions here turn the raw piece data (test_data.json plus the pitch MIDI files) into the timestep vectors that
+the model is trained on, and split the resulting corpus into training and validation sets.
+
+Each timestep vector has 100 entries, made up of the following one-hot/multi-hot sections, in order:
+
+    pitch (38), root (13), bass (13), chord notes (12), duration (24)
+
+The corpus itself is stored in a more compact index format, with 5 integers per timestep: the index of the pitch,
+root, bass and duration within their one-hot sections, and the chord notes as a 12-bit mask (bit i set if note i is
+in the chord). The two formats can be converted between with indices_from_vectors and vectors_from_indices.
+
+The split is based on a hash of each piece's title rather than on a random draw, so that a piece always ends up on
+the same side of the split, regardless of the order in which pieces are loaded or of which other pieces are present.
+"""
+
+import json
+import os
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from definitions import BAR_DURATION, note_name_idx
+from note_parsing import Melody
+from chord_parsing import ChordProgression
+from bar_parsing import BarSequence
+from timesteps import Piece
+
+DATA_PATH = 'test_data.json'
+CORPUS_PATH = 'corpus.npz'  # Where the compiled corpus is cached.
+PITCH_MIDI_DIR = 'PitchMIDI'
+VALIDATION_FRACTION = 0.1  # Approximate fraction of the pieces that are held out for validation.
+FIELD_SIZES = [38, 13, 13, 12, 24]  # Sizes of the pitch, root, bass, chord and duration sections of a vector.
+PAD_INDEX = -1  # Index used to pad index-encoded pieces (it decodes to an all-zero vector).
+DURATIONS = 10 * (np.arange(FIELD_SIZES[4]) + 1)  # The duration that each duration index stands for.
+
+
+def timestep_vectors(piece):
+    pitch = np.eye(38, dtype=int)[
+        [36 if ts.same_note else ts.note_pitch - 48 if ts.note_pitch > 0 else 37 for ts in piece]
+    ]
+    root = np.eye(13, dtype=int)[[note_name_idx[ts.root] if ts.root else 12 for ts in piece]]
+    bass = np.eye(13, dtype=int)[[note_name_idx[ts.bass] if ts.bass else 12 for ts in piece]]
+    chord = np.array([[i in ts.full_chordset for i in range(12)] for ts in piece], dtype=int)
+    duration = np.eye(24, dtype=int)[[int(ts.duration / 10 - 1) for ts in piece]]
+    return np.concatenate([pitch, root, bass, chord, duration], axis=1)
+
+
+def indices_from_vectors(vectors):
+    pitch, root, bass, chord, duration = np.split(vectors, np.cumsum(FIELD_SIZES)[:-1], axis=-1)
+    chord_mask = np.dot((chord > 0.5).astype(np.int32), 1 << np.arange(12))
+    return np.stack(
+        [pitch.argmax(axis=-1), root.argmax(axis=-1), bass.argmax(axis=-1), chord_mask, duration.argmax(axis=-1)],
+        axis=-1
+    ).astype(np.int32)
+
+
+def vectors_from_indices(indices):
+    indices = np.asarray(indices)
+    sections = []
+    for field, size in enumerate(FIELD_SIZES):
+        if field == 3:
+            # Padding has no chord notes, rather than all 12.
+            mask = np.maximum(indices[..., field], 0)
+            sections.append((mask[..., None] >> np.arange(12)) & 1)
+        else:
+            sections.append(indices[..., field, None] == np.arange(size))
+    return np.concatenate(sections, axis=-1).astype(np.float32)
+
+
+def durations_from_indices(indices):
+    # The durations of index-encoded timesteps (duration index i means a duration of 10 * (i + 1)).
+    return 10 * (np.asarray(indices)[..., 4] + 1)
+
+
+def feasible_durations(elapsed, bar_duration=BAR_DURATION):
+    """
+    Which of the 24 duration indices fit in what is left of the current bar, after timesteps lasting elapsed in total
+    (an int or an array of them, assuming no pickup). Returns a bool array [..., 24]. Sampled timesteps are kept
+    from crossing a barline by masking out the durations that don't fit. This is a modelling constraint rather than
+    a property of the corpus: durations that aren't multiples of 10 are truncated when they are encoded, so corpus
+    pieces drift off the barlines (and few of them end on one).
+    """
+    remaining = bar_duration - np.asarray(elapsed) % bar_duration
+    return DURATIONS <= remaining[..., None]
+
+
+def load_piece_data(path=DATA_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+
+def piece_from_details(title, details):
+    midi_filename = PITCH_MIDI_DIR + '/' + title + '_pitches' + '.MID'
+    melody = Melody.from_duration_list_and_pitch_midi(details['notes'], midi_filename)
+    chords = ChordProgression(details['chords'])
+    bars = BarSequence(eval(details['bars']))
+    return Piece(title, details['composer'], details['pickup'], melody.melody, chords.chords, bars.bars)
+
+
+def compile_corpus(piece_data):
+    """
+    Returns an OrderedDict mapping the title of each usable piece in piece_data to its index-encoded timesteps, as an
+    integer array of shape [num_timesteps, 5]. Pieces without a chord progression are skipped.
+    """
+    corpus = OrderedDict()
+    for title, details in piece_data.items():
+        if not details["chords"]:
+            continue
+        piece = piece_from_details(title, details)
+        corpus[title] = indices_from_vectors(timestep_vectors(piece.timesteps)).astype(np.int16)
+    return corpus
+
+
+def save_corpus(corpus, path=CORPUS_PATH):
+    np.savez_compressed(path, **corpus)
+
+
+def load_corpus(path=CORPUS_PATH):
+    with np.load(path) as f:
+        return OrderedDict((title, f[title]) for title in f.files)
+
+
+def get_corpus(data_path=DATA_PATH, corpus_path=CORPUS_PATH):
+    """
+    Returns the compiled corpus, loading it from corpus_path if it has been compiled since data_path was last
+    changed, and compiling it from scratch (and saving it for next time) otherwise.
+    """
+    if os.path.exists(corpus_path) and os.path.getmtime(corpus_path) >= os.path.getmtime(data_path):
+        return load_corpus(corpus_path)
+    corpus = compile_corpus(load_piece_data(data_path))
+    save_corpus(corpus, corpus_path)
+    return corpus
+
+
+def is_validation_piece(title, validation_fraction=VALIDATION_FRACTION):
+    bucket = zlib.crc32(title.encode('utf-8')) % 1000
+    return bucket < validation_fraction * 1000
+
+
+def split_corpus(corpus, validation_fraction=VALIDATION_FRACTION):
+    """
+    Splits a compiled corpus (or any dict keyed by piece title) into (training, validation) OrderedDicts.
+    """
+    training = OrderedDict()
+    validation = OrderedDict()
+    for title, vectors in corpus.items():
+        if is_validation_piece(title, validation_fraction):
+            validation[title] = vectors
+        else:
+            training[title] = vectors
+    return training, validation
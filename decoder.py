@@ -8,21 +8,85 @@ from note_parsing import Note
 from chord_parsing import Chord
 from bar_parsing import Bar
 from timesteps import Timestep
-from definitions import chord_name, p1, f2, p2, s2, f3, p3, p4, s4, f5, p5, s5, f6, p6, f7, p7
+from definitions import chord_name, note_name_idx, note_idx_name, BAR_DURATION
+from definitions import p1, f2, p2, s2, f3, p3, p4, s4, f5, p5, s5, f6, p6, f7, p7
 
+CHORD_ROOT_PITCH = 48  # MIDI pitch of the C that chord voicings are built up from.
+BASS_ROOT_PITCH = 36  # MIDI pitch of the C that bass notes are played relative to.
+NO_CHORD_ROOT_INDEX = 12  # The root index of a timestep with no chord (N.C.), which has no chord notes either.
 
-def create_midi_from_output(melody, chords, bars):
-    pass  # TODO: convert output into MIDI format
+_chord_prefix_table = None
+
+
+def create_midi_from_output(melody, chords, bars, tempo=120):
+    """
+    Converts a decoded (melody, chords, bars) tuple into a PrettyMIDI object with two instruments: the melody, and
+    the chords (each voiced as the full chordset above the root, plus the bass note an octave lower). Durations are
+    relative, with a crotchet taking the value 60, so at the given tempo (in crotchets per minute) each unit of
+    duration lasts 1 / tempo seconds.
+    """
+    import pretty_midi as pm  # Only imported when needed, as it is slow to import.
+    seconds_per_unit = 1.0 / tempo
+    midi = pm.PrettyMIDI(initial_tempo=tempo)
+
+    melody_instrument = pm.Instrument(program=0, name='melody')
+    time = 0
+    for note in melody:
+        end = time + note.duration
+        if note.pitch > -1:
+            melody_instrument.notes.append(pm.Note(100, note.pitch, time * seconds_per_unit, end * seconds_per_unit))
+        time = end
+
+    chord_instrument = pm.Instrument(program=0, name='chords')
+    time = 0
+    for chord in chords:
+        end = time + chord.duration
+        if chord.root is not None:
+            root_pitch = CHORD_ROOT_PITCH + note_name_idx[chord.root]
+            pitches = [root_pitch + i for i in sorted(chord.full_chordset)]
+            if chord.bass is not None:
+                pitches.append(BASS_ROOT_PITCH + note_name_idx[chord.bass])
+            for pitch in pitches:
+                chord_instrument.notes.append(pm.Note(70, pitch, time * seconds_per_unit, end * seconds_per_unit))
+        time = end
+
+    midi.instruments.extend([melody_instrument, chord_instrument])
+    return midi
 
 
 def load_samples(path):
-    batch = np.load(path)
-    samples = []
-    for sample in batch:
-        sample_timesteps = [timestep_object_from_vector(tvec) for tvec in sample]
-        decoded_sample = decode_timesteps(sample_timesteps)
-        samples.append(decoded_sample)
-    return samples  # One decoded_sample is a (melody, chords, bars) tuple.
+    # One decoded sample is a (melody, chords, bars) tuple, or None if the sample was invalid.
+    return [decode_sample(sample) for sample in np.load(path)]
+
+
+def decode_sample(sample):
+    # Decodes a sample [num_timesteps, 100] of timestep vectors, returning None if it isn't a valid piece.
+    sample = sample[sample.any(axis=-1)]  # Remove the padding (all-zero timesteps) after shorter samples.
+    sample_timesteps = mark_barlines([timestep_object_from_vector(tvec) for tvec in sample])
+    try:
+        return decode_timesteps(sample_timesteps)
+    except RuntimeError:
+        return None  # The sample can't be decoded into a valid piece.
+
+
+def mark_barlines(timesteps, bar_duration=BAR_DURATION):
+    """
+    The timestep vectors don't encode where the barlines are, so they are inferred from the accumulated duration,
+    assuming that the piece doesn't start with a pickup. A timestep starts a new bar if it is the first to start at
+    or after the next barline (the corpus' timesteps are split at barlines, but sampled ones may run over them).
+    """
+    return list(iter_marked_barlines(timesteps, bar_duration))
+
+
+def iter_marked_barlines(timesteps, bar_duration=BAR_DURATION):
+    # A lazy version of mark_barlines, for timesteps that are still being sampled.
+    elapsed = 0
+    bar_number = -1
+    for ts in timesteps:
+        ts.is_barline = elapsed // bar_duration > bar_number
+        bar_number = ts.bar_number = elapsed // bar_duration
+        elapsed += ts.duration
+        yield ts
 
 
 def timestep_object_from_vector(timestep_vector):
@@ -37,10 +101,10 @@ def timestep_object_from_vector(timestep_vector):
     same_note = True if note_pitch is None else False
 
     root_idx = np.argmax(root_vec)
-    root = root_idx if root_idx < 12 else None
+    root = note_idx_name[root_idx] if root_idx < 12 else None
 
     bass_idx = np.argmax(bass_vec)
-    bass = bass_idx if bass_idx < 12 else None
+    bass = note_idx_name[bass_idx] if bass_idx < 12 else None
 
     full_chordset = set([i for i, n in enumerate(chord_vec) if n == 1])
 
@@ -56,39 +120,51 @@ def decode_timesteps(timesteps):
     sequences that comprise the piece. These can then be processed further to produce machine or human-readable
     music in the desired format.
     """
-    melody = []
-    chords = []
-    bars = []
-    curr_note = Note(-1, 0)
-    curr_chord = Chord(None, None, set(), 0)
-    bar_number = -1
-
-    first_timestep = timesteps[0]
+    decoder = TimestepDecoder()
+    for ts in timesteps:
+        decoder.add(ts)
+    return decoder.melody, decoder.chords, decoder.bars
 
-    if first_timestep.same_note:
-        raise RuntimeError("Invalid output: first note is back-tied")
 
-    if not first_timestep.is_barline:  # There's a pickup.
-        curr_bar = Bar(bar_number, 0)
+class TimestepDecoder:
+    """
+    Decodes timesteps one at a time, in the same way as decode_timesteps, so that a piece can be decoded while it is
+    still being sampled. After each call to add, melody, chords and bars hold the piece so far (the last note, chord
+    and bar may still be lengthened by the timesteps that follow).
+    """
+    def __init__(self):
+        self.melody = []
+        self.chords = []
+        self.bars = []
+        self.curr_note = Note(-1, 0)
+        self.curr_chord = Chord(None, None, set(), 0)
+        self.curr_bar = None
+        self.bar_number = -1
+
+    def add(self, ts):
+        if self.curr_bar is None:  # The first timestep.
+            if ts.same_note:
+                raise RuntimeError("Invalid output: first note is back-tied")
+            if not ts.is_barline:  # There's a pickup.
+                self.curr_bar = Bar(self.bar_number, 0)
 
-    for ts in timesteps:
         if ts.same_note is True:
-            curr_note.duration += ts.duration
+            self.curr_note.duration += ts.duration
         else:
-            curr_note = Note(ts.pitch, ts.duration)
-            melody.append(curr_note)
+            self.curr_note = Note(ts.note_pitch, ts.duration)
+            self.melody.append(self.curr_note)
+        curr_chord = self.curr_chord
         if (ts.root, ts.bass, ts.full_chordset) == (curr_chord.root, curr_chord.bass, curr_chord.full_chordset):
             curr_chord.duration += ts.duration
         else:
-            curr_chord = Chord(ts.root, ts.bass, ts.full_chordset, ts.duration)
-            chords.append(curr_chord)
+            self.curr_chord = Chord(ts.root, ts.bass, ts.full_chordset, ts.duration)
+            self.chords.append(self.curr_chord)
         if ts.is_barline:
-            bar_number += 1
-            curr_bar = Bar(bar_number, ts.duration)
-            bars.append(curr_bar)
+            self.bar_number += 1
+            self.curr_bar = Bar(self.bar_number, ts.duration)
+            self.bars.append(self.curr_bar)
         else:
-            curr_bar.duration += ts.duration
-    return melody, chords, bars
+            self.curr_bar.duration += ts.duration
 
 
 def get_chord_symbol(chord):
@@ -200,3 +276,34 @@ def get_chord_symbol(chord):
     chord_symbol = root + core_chord + ''.join(alts)
     chord_symbol += '/' + bass if bass != root else ''
     return chord_symbol
+
+
+def valid_chord_masks():
+    # Whether each of the 4096 12-bit chord note masks (bit i set if note i is in the chord) gets a chord symbol.
+    return np.array([get_chord_symbol(Chord('C', 'C', {i for i in range(12) if mask >> i & 1}, 0)) is not None
+                     for mask in range(1 << 12)])
+
+
+def chord_prefix_table():
+    """
+    The table that the samplers use to only ever sample chords that get a chord symbol, while sampling their notes
+    one at a time. Entry [n, mask] says whether the lowest n bits of mask (the notes sampled so far) can be completed
+    to a valid chord mask, so entry [12, mask] says whether mask is valid. Computed the first time it is needed.
+    """
+    global _chord_prefix_table
+    if _chord_prefix_table is None:
+        table = np.zeros([13, 1 << 12], dtype=bool)
+        table[12] = valid_chord_masks()
+        for n in reversed(range(12)):
+            prefixes = np.arange(1 << n)
+            table[n, prefixes] = table[n + 1, prefixes] | table[n + 1, prefixes | 1 << n]
+        _chord_prefix_table = table
+    return _chord_prefix_table
+
+
+def printable_chord_symbol(chord):
+    # get_chord_symbol alters the chordset it is given, so it gets a copy here. Invalid chords are shown as '?'.
+    if chord.root is None:
+        return 'N.C.'
+    chord = Chord(chord.root, chord.bass or chord.root, set(chord.full_chordset), chord.duration)
+    return get_chord_symbol(chord) or '?'
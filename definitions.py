@@ -119,6 +119,12 @@ note_name_idx = {
 }
 
 
+# note_idx_name maps each relative position in the 12-note chromatic scale back to a single note name, for use
+# when decoding model output (flats are used, as is usual in jazz lead sheets).
+
+note_idx_name = ['C', 'Db', 'D', 'Eb', 'E', 'F', 'Gb', 'G', 'Ab', 'A', 'Bb', 'B']
+
+
 # Each variable name describes a "flat", "perfect", or "sharp" note from the major scale.
 # Each value is the corresponding relative position in the 12-note chromatic scale.
 
@@ -156,4 +162,5 @@ chord_name = OrderedDict([
 
 
 QUAVER_DURATION = 30
+BAR_DURATION = 8 * QUAVER_DURATION  # Every piece in the corpus is in 4/4.
 MINIM_DURATION = 120
@@ -0,0 +1,110 @@
+"""
+Held-out evaluation, intended to be run as a separate process alongside train.py. It waits for the trainer to write
+new checkpoints to CHECKPOINT_DIR, restores each one in turn, and computes the loss of each output head (pitch, root,
+bass, chord, and duration) on the validation pieces. The results are written to a separate TensorBoard run, so that
+they appear next to the training loss.
+
+The evaluator only ever reads checkpoints, and it runs at a lower scheduling priority and with a small number of
+threads, so that it does not compete with the trainer for CPU time. The validation set is compiled and padded once up
+front, and each evaluation is done in a few large batches (sorted by length to keep the padding to a minimum).
+"""
+
+import os
+import numpy as np
+import tensorflow as tf
+
+from corpus import get_corpus, split_corpus, PAD_INDEX
+from train import get_losses, CHECKPOINT_DIR, SUMMARIES_DIR
+
+EVAL_BATCH_SIZE = 256
+EVAL_NUM_THREADS = 1  # Threads used by the evaluator's session (the rest are left to the trainer).
+EVAL_NICENESS = 10  # How much to lower the evaluator's scheduling priority by.
+EVAL_POLL_SECS = 30  # How often to check for a new checkpoint.
+EVAL_SUMMARIES_DIR = os.path.join(SUMMARIES_DIR, "validation")
+HEADS = ['pitch', 'root', 'bass', 'chord', 'duration']
+
+
+def padded_batches(pieces, batch_size):
+    # pieces is a list of [num_timesteps, 5] arrays. Returns a list of (data, lengths) numpy batches.
+    pieces = sorted(pieces, key=len)
+    batches = []
+    for i in range(0, len(pieces), batch_size):
+        batch = pieces[i:i + batch_size]
+        lengths = np.array([len(p) for p in batch], dtype=np.int32)
+        data = np.full([len(batch), lengths.max(), 5], PAD_INDEX, dtype=np.int32)
+        for j, p in enumerate(batch):
+            data[j, :len(p)] = p
+        batches.append((data, lengths))
+    return batches
+
+
+def build_validation_graph():
+    inputs = {
+        'data': tf.placeholder(tf.int32, [None, None, 5]),
+        'length': tf.placeholder(tf.int32, [None]),
+    }
+    losses = get_losses(inputs)
+    mask = tf.sequence_mask(inputs['length'], maxlen=tf.shape(inputs['data'])[1], dtype=tf.float32)
+    # Sum the losses over the real (unpadded) timesteps only, so that batches can be combined exactly.
+    loss_sums = {head: tf.reduce_sum(losses[head] * mask) for head in HEADS}
+    return inputs, loss_sums
+
+
+def evaluate(sess, inputs, loss_sums, batches):
+    # Returns the mean loss per timestep of each head over all the validation batches.
+    totals = dict.fromkeys(HEADS, 0.0)
+    num_timesteps = 0
+    for data, lengths in batches:
+        batch_sums = sess.run(loss_sums, {inputs['data']: data, inputs['length']: lengths})
+        for head in HEADS:
+            totals[head] += batch_sums[head]
+        num_timesteps += lengths.sum()
+    return {head: totals[head] / num_timesteps for head in HEADS}
+
+
+def run_evaluator(timeout=None):
+    os.nice(EVAL_NICENESS)
+
+    _, validation_pieces = split_corpus(get_corpus())
+    if not validation_pieces:
+        raise RuntimeError("No validation pieces found!")
+    print("Evaluating on %d validation pieces: %s" % (len(validation_pieces), ', '.join(validation_pieces)))
+    batches = padded_batches(list(validation_pieces.values()), EVAL_BATCH_SIZE)
+
+    inputs, loss_sums = build_validation_graph()
+    step = tf.train.get_or_create_global_step()
+    # Only the model weights and the step are needed (not e.g. the optimizer's slot variables).
+    saver = tf.train.Saver(tf.trainable_variables() + [step], save_relative_paths=True)
+
+    config = tf.ConfigProto(
+        intra_op_parallelism_threads=EVAL_NUM_THREADS,
+        inter_op_parallelism_threads=EVAL_NUM_THREADS
+    )
+    sess = tf.Session(config=config)
+    summary_writer = tf.summary.FileWriter(EVAL_SUMMARIES_DIR)
+
+    for ckpt_path in tf.train.checkpoints_iterator(CHECKPOINT_DIR, min_interval_secs=EVAL_POLL_SECS, timeout=timeout):
+        try:
+            saver.restore(sess, ckpt_path)
+        except tf.errors.NotFoundError:
+            # The trainer only keeps its latest few checkpoints, so this one may have been deleted already.
+            print("Checkpoint %s no longer exists, skipping" % ckpt_path)
+            continue
+
+        i = sess.run(step)
+        head_losses = evaluate(sess, inputs, loss_sums, batches)
+        total_loss = sum(head_losses.values())
+        print("Step %d: validation loss = %.4f (%s)" % (
+            i, total_loss, ', '.join('%s %.4f' % (head, head_losses[head]) for head in HEADS)
+        ))
+
+        summary = tf.Summary()
+        summary.value.add(tag="validation/loss", simple_value=total_loss)
+        for head in HEADS:
+            summary.value.add(tag="validation/loss_%s" % head, simple_value=head_losses[head])
+        summary_writer.add_summary(summary, i)
+        summary_writer.flush()
+
+
+if __name__ == '__main__':
+    run_evaluator()
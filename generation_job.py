@@ -0,0 +1,215 @@
+"""
+Large-scale offline generation, e.g. of evaluation sets of millions of pieces, with the NumPy engine. The pieces are
+split into shards of shard_size pieces, which are sampled by a pool of worker processes, each with its own copy of the
+model. Every shard has its own seed, and every batch within it a seed drawn from that, so a piece comes out the same
+however many workers there are, and however many times the job has been restarted.
+
+Each shard writes its pieces to chunk files of at most MAX_CHUNK_BYTES (roughly), in the compact index format: the
+index-encoded timesteps of all of a chunk's pieces one after the other ([num_timesteps, 5], uint16), and the offset of
+each piece in them ([num_pieces + 1], int64). Both are plain .npy files, so they can be memory-mapped rather than read
+into memory. After each chunk, a shard records its progress in its own JSON file, and manifest.json holds the job's
+settings, its shards and their seeds, and (once they are done) their chunks. Every file is written to a temporary
+path and then renamed, so a crash never leaves a partly written one behind.
+
+Running the same job again resumes it: finished shards are skipped, and unfinished ones carry on from their last
+chunk. Resuming with different settings or weights is refused.
+
+    python main.py generate eval_set --weights model.npz --num-pieces 1000000 --num-bars 16 --workers 8
+    for piece in read_pieces('eval_set'):
+        ...  # An index-encoded piece [num_timesteps, 5].
+"""
+
+import json
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+from batching import BATCH_SIZE
+from corpus import indices_from_vectors
+from Model.numpy_engine import NumpyModel, settings_from_spec
+
+SHARD_SIZE = 4096
+MAX_CHUNK_BYTES = 64 * 1024 * 1024
+MANIFEST_NAME = 'manifest.json'
+INDEX_DTYPE = np.uint16  # Every field fits, including the 12-bit chord note mask.
+
+
+def write_json(path, value):
+    with open(path + '.tmp', 'w') as f:
+        json.dump(value, f, indent=2, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def read_json(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_array(path, array):
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+
+def shard_progress_path(output_dir, shard):
+    return os.path.join(output_dir, 'shard_%05d.json' % shard)
+
+
+def chunk_paths(output_dir, shard, chunk):
+    name = os.path.join(output_dir, 'shard_%05d_chunk_%04d' % (shard, chunk))
+    return name + '_indices.npy', name + '_offsets.npy'
+
+
+def job_spec(weights_path, num_pieces, num_bars, shard_size=SHARD_SIZE, batch_size=BATCH_SIZE, seed=0,
+             sampling=None):
+    # Everything that decides which pieces a job generates, as recorded in its manifest.
+    num_shards = -(-num_pieces // shard_size)
+    return {
+        'weights': os.path.abspath(weights_path),
+        'weights_fingerprint': NumpyModel.load(weights_path).fingerprint,
+        'num_pieces': num_pieces,
+        'num_bars': num_bars,
+        'shard_size': shard_size,
+        'batch_size': batch_size,
+        'seed': seed,
+        'sampling': sampling or {},
+        'shard_seeds': [int(s) for s in np.random.RandomState(seed).randint(2 ** 31, size=num_shards)],
+    }
+
+
+def shard_pieces(spec, shard):
+    # The number of pieces in a shard (the last one can have fewer).
+    return min(spec['shard_size'], spec['num_pieces'] - shard * spec['shard_size'])
+
+
+def load_progress(output_dir, spec, shard):
+    path = shard_progress_path(output_dir, shard)
+    if os.path.exists(path):
+        return read_json(path)
+    return {'shard': shard, 'seed': spec['shard_seeds'][shard], 'num_pieces': shard_pieces(spec, shard),
+            'num_done': 0, 'chunks': [], 'seconds': 0.0, 'done': False}
+
+
+_worker_model = None  # The model of each worker process, loaded once.
+
+
+def _init_worker(weights_path):
+    global _worker_model
+    _worker_model = NumpyModel.load(weights_path)
+
+
+def generate_shard(output_dir, spec, shard, model=None):
+    """
+    Samples the pieces of a shard that haven't been written yet, a chunk at a time, and returns its progress once
+    it is done. Only one chunk of pieces is held in memory at once.
+    """
+    model = model or _worker_model
+    settings = settings_from_spec(spec['sampling'])
+    progress = load_progress(output_dir, spec, shard)
+    batch_size = spec['batch_size']
+    batch_seeds = np.random.RandomState(progress['seed']).randint(2 ** 31, size=-(-progress['num_pieces'] //
+                                                                                   batch_size))
+    pieces, num_bytes = [], 0
+    start = time.perf_counter()
+    while progress['num_done'] + len(pieces) < progress['num_pieces']:
+        first = progress['num_done'] + len(pieces)
+        size = min(batch_size, progress['num_pieces'] - first)
+        samples, lengths = model.sample_bars(size, spec['num_bars'], seed=batch_seeds[first // batch_size],
+                                             settings=settings)
+        batch = [indices_from_vectors(sample[:length]).astype(INDEX_DTYPE) for sample, length in zip(samples, lengths)]
+        batch_bytes = sum(piece.nbytes for piece in batch)
+        if pieces and num_bytes + batch_bytes > MAX_CHUNK_BYTES:
+            _write_chunk(output_dir, progress, pieces, time.perf_counter() - start)
+            pieces, num_bytes, start = [], 0, time.perf_counter()
+        pieces += batch
+        num_bytes += batch_bytes
+    if pieces:
+        _write_chunk(output_dir, progress, pieces, time.perf_counter() - start)
+    progress['done'] = True
+    write_json(shard_progress_path(output_dir, shard), progress)
+    return progress
+
+
+def _write_chunk(output_dir, progress, pieces, seconds):
+    # Writes a chunk of a shard's pieces, then records it in the shard's progress.
+    chunk = len(progress['chunks'])
+    indices_path, offsets_path = chunk_paths(output_dir, progress['shard'], chunk)
+    offsets = np.concatenate([[0], np.cumsum([len(piece) for piece in pieces])]).astype(np.int64)
+    save_array(indices_path, np.concatenate(pieces))
+    save_array(offsets_path, offsets)
+    progress['chunks'].append({'indices': os.path.basename(indices_path), 'offsets': os.path.basename(offsets_path),
+                               'num_pieces': len(pieces), 'num_timesteps': int(offsets[-1])})
+    progress['num_done'] += len(pieces)
+    progress['seconds'] += seconds
+    write_json(shard_progress_path(output_dir, progress['shard']), progress)
+
+
+def _generate_shard(args):
+    return generate_shard(*args)
+
+
+def run_job(output_dir, spec, num_workers=1, log=print):
+    """
+    Generates (or carries on generating) the pieces of a job (see job_spec) into output_dir with num_workers worker
+    processes, and returns the finished manifest. Raises a ValueError if output_dir holds a different job.
+    """
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        manifest = read_json(manifest_path)
+        if manifest['spec'] != spec:
+            changed = sorted(key for key in spec if spec[key] != manifest['spec'].get(key))
+            raise ValueError("%s holds a different job (%s differ)" % (output_dir, ', '.join(changed)))
+    else:
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+        manifest = {'spec': spec, 'shards': [], 'done': False}
+        write_json(manifest_path, manifest)
+
+    num_shards = len(spec['shard_seeds'])
+    progress = [load_progress(output_dir, spec, shard) for shard in range(num_shards)]
+    pending = [shard for shard in range(num_shards) if not progress[shard]['done']]
+    log("%d of %d shards already done, %d to go" % (num_shards - len(pending), num_shards, len(pending)))
+    if pending:
+        tasks = [(output_dir, spec, shard) for shard in pending]
+        if num_workers > 1:
+            pool = multiprocessing.Pool(num_workers, initializer=_init_worker, initargs=(spec['weights'],))
+            results = pool.imap_unordered(_generate_shard, tasks)
+        else:
+            _init_worker(spec['weights'])
+            pool, results = None, map(_generate_shard, tasks)
+        try:
+            for shard_progress in results:
+                progress[shard_progress['shard']] = shard_progress
+                num_done = sum(p['done'] for p in progress)
+                log("Shard %d done (%d pieces in %.1f s), %d of %d shards done" % (
+                    shard_progress['shard'], shard_progress['num_pieces'], shard_progress['seconds'], num_done,
+                    num_shards))
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    manifest['shards'] = progress
+    manifest['done'] = True
+    write_json(manifest_path, manifest)
+    return manifest
+
+
+def read_chunks(output_dir):
+    # Yields the (indices, offsets) of each chunk of a finished job, memory-mapped, in order.
+    manifest = read_json(os.path.join(output_dir, MANIFEST_NAME))
+    if not manifest['done']:
+        raise ValueError("The job in %s hasn't finished" % output_dir)
+    for shard in manifest['shards']:
+        for chunk in shard['chunks']:
+            yield (np.load(os.path.join(output_dir, chunk['indices']), mmap_mode='r'),
+                   np.load(os.path.join(output_dir, chunk['offsets'])))
+
+
+def read_pieces(output_dir):
+    # Yields the index-encoded pieces of a finished job, in order.
+    for indices, offsets in read_chunks(output_dir):
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield np.asarray(indices[start:end], dtype=np.int32)
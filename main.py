@@ -0,0 +1,396 @@
+"""
+Command-line interface for the whole project:
+
+    python main.py compile                    Compile the raw piece data into the timestep vector corpus.
+    python main.py train                      Train the model, checkpointing as it goes.
+    python main.py sample                     Sample a batch of timestep vector sequences from the latest checkpoint.
+    python main.py export-weights CKPT OUT    Export a checkpoint's weights for sampling with NumPy (sample --weights).
+    python main.py serve --weights model.npz  Serve samples over HTTP on localhost (see server.py).
+    python main.py stream --weights model.npz Print the bars of a piece as they are sampled (see streaming.py).
+    python main.py perform --weights model.npz Play a piece in real time as it is sampled (see realtime.py).
+    python main.py score samples.npy          Print the log-likelihood of each sample (or of each corpus piece).
+    python main.py rerank --weights model.npz Sample many candidates and keep the best few (see rerank.py).
+    python main.py generate OUTPUT_DIR        Generate many pieces in resumable shards (see generation_job.py).
+    python main.py decode samples.npy         Print the decoded chord symbols and melody of each sample.
+    python main.py render samples.npy         Write each sample out as a MIDI file.
+    python main.py convert-checkpoint IN OUT  Convert a checkpoint saved with an older version of the model.
+
+Every command imports what it needs when it runs, so that e.g. decoding doesn't pay for importing TensorFlow.
+"""
+
+import argparse
+import os
+
+
+def compile_command(args):
+    from corpus import compile_corpus, load_piece_data, save_corpus
+    corpus = compile_corpus(load_piece_data(args.data))
+    save_corpus(corpus, args.output)
+    print("Compiled %d pieces to: %s" % (len(corpus), args.output))
+
+
+def train_command(args):
+    from train import train
+    train()
+
+
+def sampling_spec(args):
+    # The per-head sampling settings spec from --sampling, with --temperature, --top-k and --top-p as the defaults.
+    import json
+    spec = json.loads(args.sampling) if args.sampling else {}
+    for key in ['temperature', 'top_k', 'top_p']:
+        if getattr(args, key) is not None:
+            spec.setdefault(key, getattr(args, key))
+    return spec
+
+
+def sampling_settings(args):
+    from Model.numpy_engine import settings_from_spec
+    return settings_from_spec(sampling_spec(args))
+
+
+def sample_command(args):
+    prompts = None
+    if args.prompt:
+        from prompts import load_prompts
+        prompts = load_prompts(args.prompt, args.prompt_bars)
+
+    if args.weights:
+        import numpy as np
+        from batching import BATCH_SIZE, fastest_batch_size, sample_in_batches
+        from Model.numpy_engine import NumpyModel
+        from prompts import join_continuations
+        from prefix_cache import PrefixStateCache
+        numpy_model = NumpyModel.load(args.weights)
+        settings = sampling_settings(args)
+        schedule = None
+        if args.chords:
+            from progressions import load_schedule
+            schedule = load_schedule(args.chords, args.bars)
+        speculative_sampler = None
+        if args.draft_steps:
+            from score import load_pieces
+            from speculative import NgramDraft, SpeculativeSampler
+            draft = NgramDraft(load_pieces(args.draft_source).values())
+            speculative_sampler = SpeculativeSampler(numpy_model, draft, args.draft_steps)
+        rng = np.random.RandomState(args.seed)
+        prefix_cache = None
+        if prompts is not None:
+            prompts = [prompts[i % len(prompts)] for i in range(args.num_samples)]
+            if args.prefix_cache:
+                prefix_cache = PrefixStateCache(path=args.prefix_cache, fingerprint=numpy_model.fingerprint)
+
+        def sample_batch(first, batch_size):
+            if speculative_sampler is not None:  # It primes the prompts itself, as drafting needs their timesteps.
+                batch_prompts = prompts[first:first + batch_size] if prompts is not None else None
+                return speculative_sampler.sample_bars(batch_size, args.num_bars, seed=rng.randint(2 ** 31),
+                                                       prompts=batch_prompts, settings=settings)[0]
+            primed = None
+            if prefix_cache is not None:
+                primed = prefix_cache.prime(numpy_model, prompts[first:first + batch_size])
+            elif prompts is not None:
+                primed = numpy_model.prime(prompts[first:first + batch_size])
+            if args.beam_width:
+                from beam_search import beam_search
+                num_steps = None if args.num_bars else args.num_steps
+                return beam_search(numpy_model, batch_size, args.beam_width, args.num_bars, num_steps,
+                                   args.length_penalty, primed)[0][:, 0]  # The best hypothesis of each search.
+            if schedule is not None:
+                return numpy_model.sample_melody(schedule, batch_size, seed=rng.randint(2 ** 31), primed=primed,
+                                                 settings=settings)[0]
+            if args.num_bars:
+                return numpy_model.sample_bars(batch_size, args.num_bars, seed=rng.randint(2 ** 31), primed=primed,
+                                               settings=settings)[0]
+            return numpy_model.sample(batch_size, args.num_steps, seed=rng.randint(2 ** 31), primed=primed,
+                                      settings=settings)
+
+        batch_size = args.batch_size
+        if batch_size is None and (args.beam_width or schedule is not None or speculative_sampler is not None):
+            batch_size = min(BATCH_SIZE, args.num_samples)  # The autotuning only times plain sampling.
+        elif batch_size is None:
+            batch_size = fastest_batch_size(numpy_model.sample, max_batch_size=args.num_samples)
+            print("Sampling with batch size: %d" % batch_size)
+        samples = sample_in_batches(sample_batch, args.num_samples, batch_size)
+        if prompts is not None:
+            samples = join_continuations(prompts, samples)
+        if prefix_cache is not None:
+            prefix_cache.save()
+            print("Prefix cache hit rate: %.0f%%" % (prefix_cache.hit_rate * 100))
+        np.save(args.output, samples)
+        print("Saved samples to: %s" % args.output)
+    else:
+        from sample import sample
+        sample(args.checkpoint_dir, args.output, args.num_steps, args.num_samples, args.batch_size, prompts)
+
+
+def check_sample_args(parser, args):
+    # Rejects flags that the chosen way of sampling would ignore (--beam-width, --chords and --draft-steps are already
+    # mutually exclusive).
+    if args.beam_width and any(getattr(args, key) is not None for key in ['temperature', 'top_k', 'top_p', 'sampling']):
+        parser.error("--beam-width doesn't sample, so --temperature, --top-k, --top-p and --sampling don't apply")
+    if args.draft_steps and not args.num_bars:
+        parser.error("--draft-steps needs --num-bars")
+    if args.draft_steps and args.prefix_cache:
+        parser.error("--draft-steps primes the prompts itself, so --prefix-cache doesn't apply")
+
+
+def export_weights_command(args):
+    from Model.numpy_engine import export_weights
+    print("Exported weights to: %s" % export_weights(args.checkpoint, args.output))
+
+
+def serve_command(args):
+    from server import serve
+    serve(args.weights, args.port, args.max_wait_ms, args.prefix_cache)
+
+
+def stream_command(args):
+    import time
+    from decoder import printable_chord_symbol
+    from Model.numpy_engine import NumpyModel
+    from streaming import stream_bars
+    prompt = None
+    if args.prompt:
+        from prompts import load_prompts
+        prompt = load_prompts(args.prompt, args.prompt_bars)[0]
+    start = time.perf_counter()
+    for bar in stream_bars(NumpyModel.load(args.weights), num_bars=args.num_bars, seed=args.seed, prompt=prompt):
+        print("Bar %d (%.1f ms): %s | %s" % (
+            bar.number, (time.perf_counter() - start) * 1000,
+            ' '.join(printable_chord_symbol(chord) for chord in bar.chords),
+            ' '.join('%s/%d' % (note.name or 'rest', note.duration) for note in bar.notes)))
+
+
+def perform_command(args):
+    from Model.numpy_engine import NumpyModel
+    from realtime import perform, sink_from_spec
+    prompt = None
+    if args.prompt:
+        from prompts import load_prompts
+        prompt = load_prompts(args.prompt, args.prompt_bars)[0]
+    report = perform(NumpyModel.load(args.weights), sink_from_spec(args.sink), tempo=args.tempo,
+                     num_bars=args.num_bars, lookahead_bars=args.lookahead_bars, seed=args.seed, prompt=prompt)
+    for bar in report.bars:
+        print("Bar %d: sampled in %.1f ms, %.1fx headroom" % (bar.number, bar.sample_seconds * 1000, bar.headroom))
+    print(report.summary())
+
+
+def score_command(args):
+    from score import HEADS, checkpoint_log_likelihoods, load_pieces, numpy_log_likelihoods, score_pieces
+    if args.weights:
+        from Model.numpy_engine import NumpyModel
+        log_likelihoods = numpy_log_likelihoods(NumpyModel.load(args.weights))
+    else:
+        log_likelihoods = checkpoint_log_likelihoods(args.checkpoint_dir)
+    pieces = load_pieces(args.source)
+    names, pieces = list(pieces.keys()), list(pieces.values())
+    print('\t'.join(['piece', 'timesteps', 'total', 'per_timestep'] + HEADS))
+    for i, scores in score_pieces(log_likelihoods, pieces, args.batch_size):
+        print('\t'.join([names[i], str(len(pieces[i])), '%.3f' % scores['total'],
+                         '%.4f' % (scores['total'] / len(pieces[i]))] + ['%.3f' % scores[head] for head in HEADS]))
+
+
+def rerank_command(args):
+    import numpy as np
+    from corpus import vectors_from_indices
+    from Model.numpy_engine import NumpyModel
+    from rerank import RerankRequest, generate_and_rerank
+    prompts = [None]
+    if args.prompt:
+        from prompts import load_prompts
+        prompts = load_prompts(args.prompt, args.prompt_bars)
+    requests = [RerankRequest(args.num_bars, prompt) for prompt in prompts]
+    best = []
+    for i, candidates in generate_and_rerank(NumpyModel.load(args.weights), requests, args.candidates, args.top_k,
+                                             args.batch_size, args.seed):
+        print("Request %d:" % i)
+        for candidate in candidates:
+            print("  score %.4f, log-likelihood %.3f over %d timesteps%s" % (
+                candidate.score, candidate.log_likelihood, len(candidate.indices),
+                ', failed: ' + ', '.join(candidate.failed_checks) if candidate.failed_checks else ''))
+        best += [candidate.indices for candidate in candidates]
+    samples = np.zeros([len(best), max(len(indices) for indices in best), 100], dtype=np.float32)
+    for i, indices in enumerate(best):
+        samples[i, :len(indices)] = vectors_from_indices(indices)
+    np.save(args.output, samples)
+    print("Saved the best candidates to: %s" % args.output)
+
+
+def generate_command(args):
+    from generation_job import job_spec, run_job
+    spec = job_spec(args.weights, args.num_pieces, args.num_bars, args.shard_size, args.batch_size, args.seed,
+                    sampling_spec(args))
+    manifest = run_job(args.output_dir, spec, args.workers)
+    print("Generated %d pieces in %d shards to: %s" % (
+        sum(shard['num_pieces'] for shard in manifest['shards']), len(manifest['shards']), args.output_dir))
+
+
+def decode_command(args):
+    from decoder import load_samples, printable_chord_symbol
+    for i, decoded in enumerate(load_samples(args.samples)):
+        if decoded is None:
+            print("Sample %d: invalid" % i)
+            continue
+        melody, chords, bars = decoded
+        print("Sample %d:" % i)
+        print("  Chords: " + ' '.join(printable_chord_symbol(chord) for chord in chords))
+        print("  Melody: " + ' '.join('%s/%d' % (note.name or 'rest', note.duration) for note in melody))
+
+
+def render_command(args):
+    from decoder import load_samples, create_midi_from_output
+    if not os.path.exists(args.output_dir):
+        os.makedirs(args.output_dir)
+    for i, decoded in enumerate(load_samples(args.samples)):
+        if decoded is None:
+            continue
+        path = os.path.join(args.output_dir, 'sample_%d.mid' % i)
+        create_midi_from_output(*decoded, tempo=args.tempo).write(path)
+        print("Rendered sample %d to: %s" % (i, path))
+
+
+def convert_checkpoint_command(args):
+    from Model.convert_checkpoint import convert_checkpoint
+    print("Converted checkpoint saved to: %s" % convert_checkpoint(args.input, args.output))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Jazz lead sheet generation.")
+    subparsers = parser.add_subparsers(dest='command')
+    subparsers.required = True
+
+    compile_parser = subparsers.add_parser('compile', help="compile the raw piece data into timestep vectors")
+    compile_parser.add_argument('--data', default='test_data.json')
+    compile_parser.add_argument('--output', default='corpus.npz')
+    compile_parser.set_defaults(run=compile_command)
+
+    train_parser = subparsers.add_parser('train', help="train the model")
+    train_parser.set_defaults(run=train_command)
+
+    sample_parser = subparsers.add_parser('sample', help="sample timestep vectors from the latest checkpoint")
+    sample_parser.add_argument('--checkpoint-dir', default='checkpoints')
+    sample_parser.add_argument('--output', default='samples.npy')
+    sample_parser.add_argument('--num-steps', type=int, default=100)
+    sample_parser.add_argument('--weights', help="sample with NumPy from weights exported with export-weights")
+    sample_parser.add_argument('--num-samples', type=int, default=32)
+    sample_parser.add_argument('--batch-size', type=int,
+                               help="by default, the batch size with the highest throughput on this machine (or 32 "
+                                    "with --beam-width, --chords or --draft-steps)")
+    sample_parser.add_argument('--seed', type=int, help="only used with --weights")
+    sample_parser.add_argument('--prompt', help="continue a piece: the title of one in the piece data, or a .npy file "
+                                                "of timestep vectors (e.g. earlier samples)")
+    sample_parser.add_argument('--prompt-bars', type=int, default=8, help="the number of bars of each prompt to use")
+    sample_parser.add_argument('--prefix-cache', help="where to keep primed prompt states between runs (only used "
+                                                      "with --weights)")
+    sample_parser.add_argument('--num-bars', type=int, help="sample pieces this many bars long instead of --num-steps "
+                                                              "timesteps (only used with --weights)")
+    modes = sample_parser.add_mutually_exclusive_group()
+    modes.add_argument('--chords', help="sample melodies over a chord progression: the title of a piece in the "
+                                        "piece data, or a chord string (only used with --weights)")
+    sample_parser.add_argument('--bars', help="the bars of --chords, e.g. \"[8] * 4\" (by default, 4/4 bars)")
+    modes.add_argument('--beam-width', type=int, help="beam search for the most likely pieces instead of "
+                                                      "sampling (only used with --weights)")
+    sample_parser.add_argument('--length-penalty', type=float, default=0.6, help="the beam search's alpha")
+    sample_parser.add_argument('--temperature', type=float, help="for every head (only used with --weights)")
+    sample_parser.add_argument('--top-k', type=int, help="for every head (only used with --weights)")
+    sample_parser.add_argument('--top-p', type=float, help="for every head (only used with --weights)")
+    sample_parser.add_argument('--sampling', help="per-head sampling settings as JSON, e.g. '{\"pitch\": {\"top_p\": "
+                                                  "0.9}}' (only used with --weights)")
+    modes.add_argument('--draft-steps', type=int, help="with --num-bars, sample speculatively, drafting this "
+                                                       "many timesteps at a time (see speculative.py)")
+    sample_parser.add_argument('--draft-source', default='corpus', help="the pieces to build the draft from: "
+                                                                        "'corpus', or a .npy file of samples")
+    sample_parser.set_defaults(run=sample_command, check=lambda args: check_sample_args(sample_parser, args))
+
+    export_parser = subparsers.add_parser('export-weights', help="export a checkpoint's weights for NumPy sampling")
+    export_parser.add_argument('checkpoint')
+    export_parser.add_argument('output')
+    export_parser.set_defaults(run=export_weights_command)
+
+    serve_parser = subparsers.add_parser('serve', help="serve samples over HTTP on localhost")
+    serve_parser.add_argument('--weights', required=True, help="weights exported with export-weights")
+    serve_parser.add_argument('--port', type=int, default=8765)
+    serve_parser.add_argument('--max-wait-ms', type=float, default=20,
+                              help="how long to wait for more requests to batch with the first one")
+    serve_parser.add_argument('--prefix-cache', help="where to save primed prompt states when the server stops")
+    serve_parser.set_defaults(run=serve_command)
+
+    stream_parser = subparsers.add_parser('stream', help="print the bars of a piece as they are sampled")
+    stream_parser.add_argument('--weights', required=True, help="weights exported with export-weights")
+    stream_parser.add_argument('--num-bars', type=int, default=32)
+    stream_parser.add_argument('--seed', type=int)
+    stream_parser.add_argument('--prompt', help="a piece to continue, as for sample")
+    stream_parser.add_argument('--prompt-bars', type=int, default=8)
+    stream_parser.set_defaults(run=stream_command)
+
+    perform_parser = subparsers.add_parser('perform', help="play a piece in real time as it is sampled")
+    perform_parser.add_argument('--weights', required=True, help="weights exported with export-weights")
+    perform_parser.add_argument('--tempo', type=int, default=120, help="in crotchets per minute")
+    perform_parser.add_argument('--num-bars', type=int, default=32)
+    perform_parser.add_argument('--lookahead-bars', type=int, default=2)
+    perform_parser.add_argument('--sink', default='memory', help="memory, file:PATH or udp:PORT")
+    perform_parser.add_argument('--seed', type=int)
+    perform_parser.add_argument('--prompt', help="a piece to continue, as for sample")
+    perform_parser.add_argument('--prompt-bars', type=int, default=8)
+    perform_parser.set_defaults(run=perform_command)
+
+    score_parser = subparsers.add_parser('score', help="print the log-likelihood of each piece under the model")
+    score_parser.add_argument('source', help="'corpus', or a .npy file of timestep vectors (e.g. samples)")
+    score_parser.add_argument('--checkpoint-dir', default='checkpoints')
+    score_parser.add_argument('--weights', help="score with NumPy using weights exported with export-weights")
+    score_parser.add_argument('--batch-size', type=int, default=256)
+    score_parser.set_defaults(run=score_command)
+
+    rerank_parser = subparsers.add_parser('rerank', help="sample many candidates and keep the most likely few")
+    rerank_parser.add_argument('--weights', required=True, help="weights exported with export-weights")
+    rerank_parser.add_argument('--num-bars', type=int, default=16)
+    rerank_parser.add_argument('--candidates', type=int, default=64, help="the number of candidates per piece")
+    rerank_parser.add_argument('--top-k', type=int, default=4, help="the number of candidates to keep per piece")
+    rerank_parser.add_argument('--batch-size', type=int, default=32)
+    rerank_parser.add_argument('--seed', type=int)
+    rerank_parser.add_argument('--prompt', help="pieces to continue (one request each), as for sample")
+    rerank_parser.add_argument('--prompt-bars', type=int, default=8)
+    rerank_parser.add_argument('--output', default='samples.npy')
+    rerank_parser.set_defaults(run=rerank_command)
+
+    generate_parser = subparsers.add_parser('generate', help="generate a large set of pieces in resumable shards")
+    generate_parser.add_argument('output_dir', help="where to write the pieces (run again to resume)")
+    generate_parser.add_argument('--weights', required=True, help="weights exported with export-weights")
+    generate_parser.add_argument('--num-pieces', type=int, required=True)
+    generate_parser.add_argument('--num-bars', type=int, default=16)
+    generate_parser.add_argument('--workers', type=int, default=1, help="the number of processes to sample with")
+    generate_parser.add_argument('--shard-size', type=int, default=4096, help="the number of pieces per shard")
+    generate_parser.add_argument('--batch-size', type=int, default=32)
+    generate_parser.add_argument('--seed', type=int, default=0)
+    generate_parser.add_argument('--temperature', type=float, help="for every head")
+    generate_parser.add_argument('--top-k', type=int, help="for every head")
+    generate_parser.add_argument('--top-p', type=float, help="for every head")
+    generate_parser.add_argument('--sampling', help="per-head sampling settings as JSON, as for sample")
+    generate_parser.set_defaults(run=generate_command)
+
+    decode_parser = subparsers.add_parser('decode', help="print the decoded samples")
+    decode_parser.add_argument('samples', nargs='?', default='samples.npy')
+    decode_parser.set_defaults(run=decode_command)
+
+    render_parser = subparsers.add_parser('render', help="write the decoded samples out as MIDI files")
+    render_parser.add_argument('samples', nargs='?', default='samples.npy')
+    render_parser.add_argument('--output-dir', default='rendered')
+    render_parser.add_argument('--tempo', type=float, default=120, help="tempo in crotchets per minute")
+    render_parser.set_defaults(run=render_command)
+
+    convert_parser = subparsers.add_parser('convert-checkpoint', help="convert an old checkpoint to the current model")
+    convert_parser.add_argument('input')
+    convert_parser.add_argument('output')
+    convert_parser.set_defaults(run=convert_checkpoint_command)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if hasattr(args, 'check'):
+        args.check(args)
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
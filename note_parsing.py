@@ -43,10 +43,16 @@ result of combining these two components is the same as that of reading in a per
 sheet (which is what method (2) does), and the process of creating the raw data takes surprisingly little time.
 """
 
-import pretty_midi as pm
-
 from definitions import QUAVER_DURATION
 
+# Same naming scheme as pretty_midi.note_number_to_name (sharps rather than flats), which is reimplemented here so
+# that creating notes doesn't require importing pretty_midi.
+SHARP_NOTE_NAMES = ['C', 'C#', 'D', 'D#', 'E', 'F', 'F#', 'G', 'G#', 'A', 'A#', 'B']
+
+
+def note_number_to_name(note_number):
+    return SHARP_NOTE_NAMES[note_number % 12] + str(note_number // 12 - 1)
+
 
 class Melody:
     def __init__(self, melody):
@@ -54,6 +60,7 @@ class Melody:
 
     @classmethod
     def from_duration_list_and_pitch_midi(cls, relative_durations, pitch_midi):
+        import pretty_midi as pm  # Only imported when needed, as it is slow to import.
         song = pm.PrettyMIDI(pitch_midi)
         inst = song.instruments[0].notes
         i = 0
@@ -69,6 +76,7 @@ class Melody:
 
     @classmethod
     def from_full_midi_melody(cls, melody_midi, piece_duration):
+        import pretty_midi as pm  # Only imported when needed, as it is slow to import.
         song = pm.PrettyMIDI(melody_midi)
         inst = song.instruments[0].notes
         melody = []
@@ -96,6 +104,6 @@ class Note:
         self.time_remaining = self.duration
 
     def _extract_note_name_and_octave(self):
-        name_octave = pm.note_number_to_name(self.pitch) if self.pitch > -1 else None
+        name_octave = note_number_to_name(self.pitch) if self.pitch > -1 else None
         self.name = name_octave.rstrip('0123456789') if name_octave else None
         self.octave = int(name_octave.lstrip(self.name)) if name_octave else None
@@ -0,0 +1,121 @@
+"""
+A cache of primed LSTM states for the NumPy engine, so that repeated continuations of the same prompt (e.g. the same
+intro or head) skip priming entirely. Entries are keyed by a hash of the prompt's index-encoded timesteps, and hold
+the (hidden, cell) state after the prompt along with its last timestep (the next input to the model).
+
+The least recently used entries are evicted once the entries take up more than max_bytes. The cache can also be
+saved to disk and loaded again, so that it survives restarts. The states only hold for the weights they were primed
+with, so the cache keeps their fingerprint (NumpyModel.fingerprint), and is emptied when it is used with, or loaded
+for, a model with different weights.
+
+    cache = PrefixStateCache(path='prefix_cache.npz', fingerprint=model.fingerprint)
+    primed = cache.prime(model, prompts)  # As NumpyModel.prime, but only primes the prompts it hasn't seen.
+    samples = model.sample(len(prompts), 100, primed=primed)
+    cache.save()
+"""
+
+import collections
+import hashlib
+import os
+
+import numpy as np
+
+MAX_BYTES = 64 * 1024 * 1024
+
+
+def prompt_key(prompt):
+    prompt = np.asarray(prompt, dtype=np.int32)
+    return hashlib.sha1(prompt.tobytes() + str(prompt.shape).encode('ascii')).hexdigest()
+
+
+class PrefixStateCache:
+    def __init__(self, max_bytes=MAX_BYTES, path=None, fingerprint=None):
+        self.max_bytes = max_bytes
+        self.path = path
+        self.fingerprint = fingerprint  # Of the weights the states were primed with.
+        self.entries = collections.OrderedDict()  # Maps a prompt key to (hidden, cell, next_input), oldest first.
+        self.num_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def hit_rate(self):
+        return self.hits / max(self.hits + self.misses, 1)
+
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.num_bytes, 'hits': self.hits, 'misses': self.misses,
+                'hit_rate': self.hit_rate}
+
+    def get(self, prompt):
+        key = prompt_key(prompt)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry
+
+    def put(self, prompt, hidden, cell, next_input):
+        self._insert(prompt_key(prompt), (np.array(hidden), np.array(cell), np.array(next_input)))
+
+    def _insert(self, key, entry):
+        if key in self.entries:
+            self.num_bytes -= sum(array.nbytes for array in self.entries.pop(key))
+        self.entries[key] = entry
+        self.num_bytes += sum(array.nbytes for array in entry)
+        while self.num_bytes > self.max_bytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.num_bytes -= sum(array.nbytes for array in evicted)
+
+    def clear(self, fingerprint=None):
+        self.entries.clear()
+        self.num_bytes = 0
+        self.fingerprint = fingerprint
+
+    def prime(self, model, prompts):
+        """
+        Returns the same (state, next inputs) as model.prime(prompts), taking the states of the prompts that are in
+        the cache from it, and priming the rest together in one batch (and adding them to the cache).
+        """
+        if self.fingerprint != model.fingerprint:
+            self.clear(model.fingerprint)
+        entries = [self.get(prompt) for prompt in prompts]
+        missing = collections.OrderedDict()  # Each missing prompt is only primed once, even if it is repeated.
+        for i, entry in enumerate(entries):
+            if entry is None:
+                missing.setdefault(prompt_key(prompts[i]), []).append(i)
+        if missing:
+            (hidden, cell), next_inputs = model.prime([prompts[rows[0]] for rows in missing.values()])
+            for j, rows in enumerate(missing.values()):
+                # The copies after the first reuse its priming, so they count as hits.
+                self.misses -= len(rows) - 1
+                self.hits += len(rows) - 1
+                self.put(prompts[rows[0]], hidden[j], cell[j], next_inputs[j])
+                for i in rows:
+                    entries[i] = (hidden[j], cell[j], next_inputs[j])
+        hidden, cell, next_inputs = (np.stack(arrays) for arrays in zip(*entries))
+        return (hidden, cell), next_inputs
+
+    def save(self, path=None):
+        path = path or self.path
+        arrays = {'fingerprint': np.array(self.fingerprint or '')}
+        for n, (key, (hidden, cell, next_input)) in enumerate(self.entries.items()):
+            # The entries are numbered so that they are loaded back in least to most recently used order.
+            arrays.update({'%d_%s_hidden' % (n, key): hidden, '%d_%s_cell' % (n, key): cell,
+                           '%d_%s_next' % (n, key): next_input})
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def load(self, path):
+        with np.load(path) as f:
+            fingerprint = str(f['fingerprint']) if 'fingerprint' in f.files else None
+            if self.fingerprint is not None and fingerprint != self.fingerprint:
+                return  # Primed with other weights (or unknown ones, for caches saved before fingerprints).
+            self.fingerprint = fingerprint
+            names = sorted(set(name.rsplit('_', 1)[0] for name in f.files if name != 'fingerprint'),
+                           key=lambda name: int(name.split('_')[0]))
+            for name in names:
+                self._insert(name.split('_', 1)[1], (f[name + '_hidden'], f[name + '_cell'], f[name + '_next']))
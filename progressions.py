@@ -0,0 +1,59 @@
+"""
+Given chord progressions, for sampling melodies over them (see NumpyModel.sample_melody). A progression is turned into
+a chord schedule: the index-encoded timesteps of the chords alone, split at every chord change and barline in the
+same way as a piece's timesteps are, so that their root, bass and chord fields can be forced while sampling, and only
+the pitch and duration are sampled.
+
+A progression is given either as the title of a piece in the raw piece data (whose chords and bars are used), or as a
+chord string in the same format as the raw piece data, along with its bars (by default, as many 4/4 bars as it fills).
+
+    python main.py sample --weights model.npz --chords afternoon_in_paris
+    python main.py sample --weights model.npz --chords "2Dm7 2G7 4CM7" --bars "[8] * 4"
+"""
+
+import numpy as np
+
+from bar_parsing import BarSequence
+from chord_parsing import ChordProgression
+from corpus import DATA_PATH, durations_from_indices, indices_from_vectors, load_piece_data, timestep_vectors
+from definitions import BAR_DURATION, QUAVER_DURATION
+from note_parsing import Note
+from timesteps import Piece
+
+
+def chord_schedule(chords, bars, pickup_duration=0):
+    """
+    Returns the chord schedule [num_timesteps, 5] of lists of Chords and Bars (as in ChordProgression and
+    BarSequence), with a pickup of pickup_duration quavers. The pitch fields are those of a rest held throughout.
+    """
+    if sum(chord.duration for chord in chords) != sum(bar.duration for bar in bars):
+        raise ValueError("The chords must fill the bars exactly")
+    total_duration = pickup_duration * QUAVER_DURATION + sum(bar.duration for bar in bars)
+    piece = Piece(None, None, pickup_duration, [Note(-1, total_duration)], chords, bars)
+    return indices_from_vectors(timestep_vectors(piece.timesteps))
+
+
+def progression_schedule(chord_string, bars_string=None, pickup_duration=0):
+    chords = ChordProgression(chord_string).chords
+    if bars_string is None:
+        num_bars = sum(chord.duration for chord in chords) // BAR_DURATION
+        bars_string = '[%d] * %d' % (BAR_DURATION // QUAVER_DURATION, num_bars)
+    return chord_schedule(chords, BarSequence(eval(bars_string)).bars, pickup_duration)
+
+
+def piece_schedule(title, data_path=DATA_PATH):
+    details = load_piece_data(data_path)[title]
+    return progression_schedule(details['chords'], details['bars'], int(details['pickup']))
+
+
+def load_schedule(source, bars_string=None, data_path=DATA_PATH):
+    # source is either the title of a piece in the raw piece data, or a chord string.
+    piece_data = load_piece_data(data_path)
+    if source in piece_data:
+        return piece_schedule(source, data_path)
+    return progression_schedule(source, bars_string)
+
+
+def schedule_boundaries(schedule):
+    # The time at which each timestep of a chord schedule ends.
+    return np.cumsum(durations_from_indices(schedule))
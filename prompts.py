@@ -0,0 +1,69 @@
+"""
+Prompts for continuing existing lead sheets: the first few bars of a piece, index-encoded in the same way as the
+corpus, which the model is primed with (in one pass, see NumpyModel.prime and model_autoregressive.build_primed_state)
+before sampling carries on from where they end.
+
+A prompt source is either the title of a piece in the raw piece data, or the path of a .npy file of timestep vectors
+(e.g. earlier samples), each of which is a prompt.
+
+    python main.py sample --weights model.npz --prompt afternoon_in_paris --prompt-bars 8 --num-bars 24
+"""
+
+import numpy as np
+
+from corpus import (DATA_PATH, FIELD_SIZES, PAD_INDEX, durations_from_indices, indices_from_vectors, load_piece_data,
+                    piece_from_details, timestep_vectors, vectors_from_indices)
+from definitions import BAR_DURATION
+
+
+def piece_prompt(title, num_bars, data_path=DATA_PATH):
+    # The first num_bars bars of a piece in the raw piece data (plus its pickup, if it has one).
+    piece = piece_from_details(title, load_piece_data(data_path)[title])
+    timesteps = [ts for ts in piece.timesteps if ts.bar_number < num_bars]
+    return indices_from_vectors(timestep_vectors(timesteps))
+
+
+def first_bars(indices, num_bars):
+    # The timesteps of an index-encoded sequence that start within its first num_bars bars (assuming no pickup).
+    starts = np.cumsum(durations_from_indices(indices)) - durations_from_indices(indices)
+    return indices[starts < num_bars * BAR_DURATION]
+
+
+def load_prompts(source, num_bars, data_path=DATA_PATH):
+    if source.endswith('.npy'):
+        samples = np.load(source)
+        return [first_bars(indices_from_vectors(sample[sample.any(axis=-1)]), num_bars) for sample in samples]
+    return [piece_prompt(source, num_bars, data_path)]
+
+
+def check_prompt(prompt):
+    # Returns prompt as an array of index-encoded timesteps, or raises a ValueError if it isn't one.
+    prompt = np.asarray(prompt)
+    if prompt.ndim != 2 or prompt.shape[0] == 0 or prompt.shape[1] != 5 or prompt.dtype.kind not in 'iu':
+        raise ValueError("A prompt must be a non-empty list of index-encoded timesteps (5 integers each)")
+    limits = FIELD_SIZES[:3] + [1 << FIELD_SIZES[3]] + FIELD_SIZES[4:]
+    if (prompt < 0).any() or (prompt >= limits).any():
+        raise ValueError("A prompt's indices must be in the range of their fields")
+    return prompt
+
+
+def pad_prompts(prompts):
+    # Returns a padded batch [batch_size, max_length, 5] of index-encoded prompts, and their lengths.
+    lengths = np.array([len(prompt) for prompt in prompts], dtype=np.int32)
+    indices = np.full([len(prompts), lengths.max(), 5], PAD_INDEX, dtype=np.int32)
+    for i, prompt in enumerate(prompts):
+        indices[i, :len(prompt)] = prompt
+    return indices, lengths
+
+
+def join_continuations(prompts, continuations):
+    """
+    Joins each prompt (index-encoded) onto the front of its (zero-padded) continuation of timestep vectors, and
+    returns the whole pieces, zero-padded to the same length.
+    """
+    pieces = [np.concatenate([vectors_from_indices(prompt), continuation[continuation.any(axis=-1)]])
+              for prompt, continuation in zip(prompts, continuations)]
+    joined = np.zeros([len(pieces), max(len(piece) for piece in pieces), continuations.shape[-1]], dtype=np.float32)
+    for i, piece in enumerate(pieces):
+        joined[i, :len(piece)] = piece
+    return joined
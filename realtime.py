@@ -0,0 +1,219 @@
+"""
+Real-time performance: plays a piece while it is being sampled, by turning the sampled timesteps into timed MIDI
+events at a given tempo. The sampler runs in a background thread, keeping a look-ahead buffer of up to
+LOOKAHEAD_BARS bars ahead of the playhead, and playback starts once the buffer is full. If the playhead catches up
+with the sampler, that's an underrun: playback stalls until the next bar is ready.
+
+Events go to a sink, which is anything with send(event, sent_time) and close() methods: MemorySink (an in-memory
+stand-in for a MIDI port), FileSink (JSON lines) or SocketSink (JSON datagrams to a local UDP port). After the
+performance, the report gives the underruns and the headroom of each bar (how much longer the bar lasts than it took
+to sample), which shows whether a given model can keep up live.
+
+    python main.py perform --weights model.npz --tempo 160 --sink udp:9000
+"""
+
+import collections
+import json
+import queue
+import socket
+import threading
+import time
+
+from decoder import BASS_ROOT_PITCH, CHORD_ROOT_PITCH
+from definitions import BAR_DURATION, note_name_idx
+from streaming import stream_bars
+
+LOOKAHEAD_BARS = 2
+MELODY_CHANNEL = 0
+CHORD_CHANNEL = 1
+MELODY_VELOCITY = 100
+CHORD_VELOCITY = 70
+
+MidiEvent = collections.namedtuple('MidiEvent', ['time', 'kind', 'channel', 'pitch', 'velocity'])  # time in seconds.
+BarStats = collections.namedtuple('BarStats', ['number', 'sample_seconds', 'bar_seconds', 'headroom'])
+
+
+class EventEncoder:
+    """
+    Turns timesteps into MIDI note_on/note_off events, one timestep at a time, voicing chords in the same way as
+    create_midi_from_output. A note (or chord) is only turned off when the next one starts, so tied notes are held.
+    """
+    def __init__(self, tempo):
+        self.seconds_per_unit = 1.0 / tempo  # tempo is in crotchets per minute, and a crotchet lasts 60 units.
+        self.elapsed = 0
+        self.melody_pitch = None
+        self.chord = None
+        self.chord_pitches = []
+
+    def add(self, ts):
+        time = self.elapsed * self.seconds_per_unit
+        events = []
+        if not ts.same_note:
+            events += self._melody_off(time)
+            if ts.note_pitch is not None and ts.note_pitch > -1:
+                self.melody_pitch = int(ts.note_pitch)
+                events.append(MidiEvent(time, 'note_on', MELODY_CHANNEL, self.melody_pitch, MELODY_VELOCITY))
+        chord = (ts.root, ts.bass, ts.full_chordset)
+        if chord != self.chord:
+            events += self._chord_off(time)
+            self.chord = chord
+            if ts.root is not None:
+                root_pitch = CHORD_ROOT_PITCH + note_name_idx[ts.root]
+                self.chord_pitches = [root_pitch + i for i in sorted(ts.full_chordset)]
+                if ts.bass is not None:
+                    self.chord_pitches.append(BASS_ROOT_PITCH + note_name_idx[ts.bass])
+                events += [MidiEvent(time, 'note_on', CHORD_CHANNEL, pitch, CHORD_VELOCITY)
+                           for pitch in self.chord_pitches]
+        self.elapsed += ts.duration
+        return events
+
+    def finish(self):
+        # Turns off whatever is still playing at the end of the piece.
+        time = self.elapsed * self.seconds_per_unit
+        return self._melody_off(time) + self._chord_off(time)
+
+    def _melody_off(self, time):
+        if self.melody_pitch is None:
+            return []
+        events = [MidiEvent(time, 'note_off', MELODY_CHANNEL, self.melody_pitch, 0)]
+        self.melody_pitch = None
+        return events
+
+    def _chord_off(self, time):
+        events = [MidiEvent(time, 'note_off', CHORD_CHANNEL, pitch, 0) for pitch in self.chord_pitches]
+        self.chord_pitches = []
+        return events
+
+
+class MemorySink:
+    # Records the events along with the (performance) time at which they were actually sent.
+    def __init__(self):
+        self.events = []
+
+    def send(self, event, sent_time):
+        self.events.append((event, sent_time))
+
+    def close(self):
+        pass
+
+
+class FileSink:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def send(self, event, sent_time):
+        self.file.write(json.dumps(event._asdict()) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class SocketSink:
+    def __init__(self, port, host='127.0.0.1'):
+        self.address = (host, port)
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def send(self, event, sent_time):
+        self.socket.sendto(json.dumps(event._asdict()).encode('utf-8'), self.address)
+
+    def close(self):
+        self.socket.close()
+
+
+def sink_from_spec(spec):
+    # 'memory', 'file:PATH' or 'udp:PORT'.
+    kind, _, argument = spec.partition(':')
+    if kind == 'memory':
+        return MemorySink()
+    if kind == 'file':
+        return FileSink(argument)
+    if kind == 'udp':
+        return SocketSink(int(argument))
+    raise ValueError("Unknown sink: %s" % spec)
+
+
+class PerformanceReport:
+    def __init__(self):
+        self.bars = []  # BarStats of each bar.
+        self.underruns = 0
+        self.stall_seconds = 0.0
+
+    def summary(self):
+        headrooms = [bar.headroom for bar in self.bars]
+        if not headrooms:
+            return "0 bars, %d underruns (%.2f s stalled)" % (self.underruns, self.stall_seconds)
+        return "%d bars, %d underruns (%.2f s stalled), headroom per bar: min %.1fx, mean %.1fx" % (
+            len(self.bars), self.underruns, self.stall_seconds, min(headrooms), sum(headrooms) / len(headrooms))
+
+
+def _sample_ahead(bars, buffer, stop):
+    # Runs in the sampler thread: puts (bar, seconds taken to sample it) into buffer, then None at the end (or the
+    # exception, if sampling fails).
+    try:
+        while not stop.is_set():
+            start = time.perf_counter()
+            bar = next(bars, None)
+            if bar is None:
+                break
+            buffer.put((bar, time.perf_counter() - start))
+        buffer.put(None)
+    except Exception as e:
+        buffer.put(e)
+
+
+def perform(model, sink, tempo=120, num_bars=32, lookahead_bars=LOOKAHEAD_BARS, seed=None, prompt=None):
+    """
+    Samples a piece of num_bars bars and plays it to sink in real time, returning a PerformanceReport. If sampling
+    fails, the exception is raised here, once the bars sampled before it have been played.
+    """
+    bar_seconds = BAR_DURATION / float(tempo)
+    buffer = queue.Queue(maxsize=lookahead_bars)
+    stop = threading.Event()
+    bars = stream_bars(model, num_bars=num_bars, seed=seed, prompt=prompt)
+    sampler = threading.Thread(target=_sample_ahead, args=(bars, buffer, stop))
+    sampler.daemon = True
+    sampler.start()
+
+    # Fill the look-ahead buffer before starting.
+    while not buffer.full() and sampler.is_alive():
+        time.sleep(0.001)
+
+    report = PerformanceReport()
+    encoder = EventEncoder(tempo)
+    origin = time.perf_counter()  # When the piece started, moved later by any stalls.
+
+    def send_at(event):
+        delay = origin + event.time - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        sink.send(event, time.perf_counter() - origin)
+
+    try:
+        while True:
+            # The next bar is needed by the time the playhead reaches the end of the last one.
+            bar_start = encoder.elapsed / float(tempo)
+            try:
+                item = buffer.get(timeout=max(origin + bar_start - time.perf_counter(), 0))
+            except queue.Empty:
+                report.underruns += 1
+                stall_start = time.perf_counter()
+                item = buffer.get()
+                report.stall_seconds += time.perf_counter() - stall_start
+                origin += time.perf_counter() - stall_start
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            bar, sample_seconds = item
+            headroom = bar_seconds / max(sample_seconds, 1e-9)
+            report.bars.append(BarStats(bar.number, sample_seconds, bar_seconds, headroom))
+            for ts in bar.timesteps:
+                for event in encoder.add(ts):
+                    send_at(event)
+        for event in encoder.finish():
+            send_at(event)
+    finally:
+        stop.set()
+        sink.close()
+    return report
@@ -0,0 +1,119 @@
+"""
+Generate-and-rerank: for each request, samples a number of candidate pieces with the NumPy engine, scores each one
+by its log-likelihood under the model (see score.py) plus a few cheap structural checks, and keeps the best few.
+
+Generation and scoring are overlapped: a producer thread samples the candidates batch by batch into a small queue,
+and the scoring (in the caller's thread) takes them off it, so that neither waits for the other to finish a whole
+request. A candidate's score is its mean log-likelihood per timestep, minus CHECK_PENALTY for each check it fails:
+
+    valid_chords  Every chord gets a chord symbol (and N.C. has no notes).
+    full_bars     No timestep crosses a barline, counting the bars back from the end of the piece (so that a
+                  piece with a pickup passes, as long as it ends on a barline).
+    pitch_range   The melody spans at most MAX_PITCH_SPAN semitones.
+    decodes       The piece can be decoded (e.g. it doesn't start with a tied note).
+
+Only decodes checks a prompted candidate's prompt: the others check the sampled continuation alone, since the prompt
+is the same for every candidate, and the corpus pieces themselves don't all pass them (e.g. their durations are
+truncated to multiples of 10, so few of them end on a barline, and antigua has a chord with no chord symbol).
+
+    python main.py rerank --weights model.npz --num-bars 16 --candidates 64 --top-k 4
+"""
+
+import collections
+import queue
+import threading
+
+import numpy as np
+
+from corpus import durations_from_indices, indices_from_vectors, vectors_from_indices
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table, decode_sample
+from definitions import BAR_DURATION
+from Model.numpy_engine import TIED_PITCH_INDEX
+from score import numpy_log_likelihoods, score_pieces
+
+NUM_CANDIDATES = 64
+TOP_K = 4
+BATCH_SIZE = 32
+PIPELINE_DEPTH = 2  # The number of sampled batches that can wait to be scored.
+CHECK_PENALTY = 10.0  # Per failed check, in nats per timestep, which puts a candidate behind any that pass.
+MAX_PITCH_SPAN = 25  # The widest corpus melody (antigua's). Most of them span under 20 semitones.
+
+# A request for the best top_k of num_candidates pieces, num_bars bars long, each continuing prompt if it's given.
+RerankRequest = collections.namedtuple('RerankRequest', ['num_bars', 'prompt'])
+RerankRequest.__new__.__defaults__ = (None,)
+Candidate = collections.namedtuple('Candidate', ['indices', 'score', 'log_likelihood', 'failed_checks'])
+
+
+def failed_checks(indices, prompt_length=0):
+    # The names of the structural checks that an index-encoded piece fails, or, for a piece that continues a prompt of
+    # prompt_length timesteps, that its continuation fails.
+    failed = []
+    whole, indices = indices, indices[prompt_length:]
+    roots, chords = indices[:, 1], indices[:, 3]
+    valid = np.where(roots == NO_CHORD_ROOT_INDEX, chords == 0, chord_prefix_table()[12][chords])
+    if not valid.all():
+        failed.append('valid_chords')
+    durations = durations_from_indices(indices)
+    ends = np.cumsum(durations) + (-durations.sum()) % BAR_DURATION  # As if the piece has a pickup, if it needs one.
+    if ((ends - durations) // BAR_DURATION != (ends - 1) // BAR_DURATION).any():
+        failed.append('full_bars')
+    pitches = indices[:, 0][indices[:, 0] < TIED_PITCH_INDEX]  # Not tied notes or rests.
+    if len(pitches) and pitches.max() - pitches.min() > MAX_PITCH_SPAN:
+        failed.append('pitch_range')
+    if decode_sample(vectors_from_indices(whole)) is None:
+        failed.append('decodes')
+    return failed
+
+
+def _sample_candidates(model, requests, num_candidates, batch_size, rng, batches):
+    # Runs in the producer thread: puts (request number, index-encoded candidates) into batches, then None at the end
+    # (or the exception, if sampling fails).
+    try:
+        for i, request in enumerate(requests):
+            if request.prompt is not None:
+                (hidden, cell), next_inputs = model.prime([request.prompt])  # Once, for every candidate.
+            primed = None
+            for first in range(0, num_candidates, batch_size):
+                size = min(batch_size, num_candidates - first)
+                if request.prompt is not None:
+                    primed = (hidden.repeat(size, 0), cell.repeat(size, 0)), next_inputs.repeat(size, 0)
+                samples, lengths = model.sample_bars(size, request.num_bars, seed=rng.randint(2 ** 31), primed=primed)
+                candidates = [indices_from_vectors(sample[:length]) for sample, length in zip(samples, lengths)]
+                if request.prompt is not None:
+                    candidates = [np.concatenate([request.prompt, candidate]) for candidate in candidates]
+                batches.put((i, candidates))
+        batches.put(None)
+    except Exception as e:
+        batches.put(e)
+
+
+def generate_and_rerank(model, requests, num_candidates=NUM_CANDIDATES, top_k=TOP_K, batch_size=BATCH_SIZE,
+                        seed=None):
+    """
+    Generates num_candidates candidates for each RerankRequest, and yields the number of each request, in order, along
+    with its top_k Candidates, best first, as soon as all of its candidates have been scored. Prompted candidates are
+    scored as whole pieces, prompt included (though only their continuations are checked).
+    """
+    batches = queue.Queue(maxsize=PIPELINE_DEPTH)
+    producer = threading.Thread(target=_sample_candidates, args=(
+        model, requests, num_candidates, batch_size, np.random.RandomState(seed), batches))
+    producer.daemon = True
+    producer.start()
+
+    log_likelihoods = numpy_log_likelihoods(model)
+    scored = collections.defaultdict(list)
+    while True:
+        item = batches.get()
+        if item is None:
+            break
+        if isinstance(item, Exception):
+            raise item
+        i, candidates = item
+        prompt_length = len(requests[i].prompt) if requests[i].prompt is not None else 0
+        for j, scores in score_pieces(log_likelihoods, candidates, batch_size):
+            failed = failed_checks(candidates[j], prompt_length)
+            log_likelihood = scores['total']
+            score = log_likelihood / len(candidates[j]) - CHECK_PENALTY * len(failed)
+            scored[i].append(Candidate(candidates[j], score, log_likelihood, failed))
+        if len(scored[i]) == num_candidates:
+            yield i, sorted(scored.pop(i), key=lambda candidate: -candidate.score)[:top_k]
@@ -1,6 +1,9 @@
 import numpy as np
 import tensorflow as tf
 
+from batching import fastest_batch_size, sample_in_batches
+from prompts import join_continuations, pad_prompts
+
 # from Model import model
 from Model import model_autoregressive as model
 
@@ -9,31 +12,93 @@ CHECKPOINT_DIR = "checkpoints"  # Needs to load up checkpoint from a trained mod
 NUM_SAMPLE_STEPS = 100
 
 
-step = tf.train.get_or_create_global_step()  # TODO: get rid of this -- not needed?
+def build_sampling_graph(num_steps=None, batch_size=None, prompts=None):
+    """
+    Builds a graph that samples a batch of sequences of num_steps timesteps, in a tf.while_loop, so the size of the
+    graph doesn't depend on the number of steps. num_steps (at least 1) and batch_size can be ints or scalar int32
+    tensors; by default they are placeholders (defaulting to NUM_SAMPLE_STEPS and model.BATCH_SIZE), so that they can
+    be chosen each time the graph is run. If prompts, an (indices, lengths) pair of tensors as taken by
+    model.build_primed_state, is given, the samples continue the prompts instead (and batch_size isn't used). The
+    sampled timesteps never cross a barline (continuations are assumed to start on one).
+    """
+    step = tf.train.get_or_create_global_step()  # TODO: get rid of this -- not needed?
+
+    if num_steps is None:
+        num_steps = tf.placeholder_with_default(NUM_SAMPLE_STEPS, [], name='num_steps')
+    if batch_size is None:
+        batch_size = tf.placeholder_with_default(model.BATCH_SIZE, [], name='batch_size')
+
+    if prompts is not None:
+        state, sample = model.build_primed_state(*prompts)
+    else:
+        state = model.initial_state_for_sampling(batch_size)
+        sample = tf.zeros([batch_size, 100], dtype=tf.float32)  # Empty timestep vector.
+
+    # The first timestep is sampled outside the loop, which also creates the model's variables outside of it.
+    elapsed = tf.zeros([tf.shape(sample)[0]], dtype=tf.int32)  # The duration of each sequence so far.
+    sample, state = model.build_model_for_sampling(sample, state, elapsed)
+    elapsed += model.durations_from_vectors(sample)
+    samples = tf.TensorArray(tf.float32, size=num_steps, element_shape=sample.shape).write(0, sample)
+
+    def body(i, sample, state, elapsed, samples):
+        sample, state = model.build_model_for_sampling(sample, state, elapsed)
+        return i + 1, sample, state, elapsed + model.durations_from_vectors(sample), samples.write(i, sample)
+
+    loop_vars = [tf.constant(1), sample, state, elapsed, samples]
+    samples = tf.while_loop(lambda i, *_: i < num_steps, body, loop_vars, back_prop=False)[-1]
+
+    # Stack into single tensor of shape [batch_size, num_timesteps, 100].
+    return tf.transpose(samples.stack(), [1, 0, 2])
+
+
+def restore_session(checkpoint_dir=CHECKPOINT_DIR):
+    saver = tf.train.Saver(tf.global_variables(), save_relative_paths=True)
+
+    sess = tf.Session()
+
+    ckpt_path = tf.train.latest_checkpoint(checkpoint_dir)
 
-state = model.initial_state_for_sampling()
-sample = tf.constant(np.zeros([model.BATCH_SIZE, 100]), dtype=tf.float32)  # Empty timestep vector.
-samples = []
+    if ckpt_path is None:
+        raise RuntimeError("No valid checkpoint found!")
 
-for i in range(NUM_SAMPLE_STEPS):
-    # TODO: tf.while_loop?
-    sample, state = model.build_model_for_sampling(sample, state)
-    samples.append(sample)
+    print("Restoring variables from checkpoint: %s" % ckpt_path)
+    saver.restore(sess, ckpt_path)
+    return sess
 
-samples = tf.stack(samples, axis=1)  # Stack into single tensor of shape [batch_size, num_timesteps, 100].
 
-saver = tf.train.Saver(tf.global_variables(), save_relative_paths=True)
+def sample(checkpoint_dir=CHECKPOINT_DIR, output_path=OUTPUT_PATH, num_steps=NUM_SAMPLE_STEPS,
+           num_samples=model.BATCH_SIZE, batch_size=None, prompts=None):
+    """
+    Samples num_samples sequences in batches of batch_size (by default, the batch size with the highest throughput
+    on this machine). If prompts (a list of index-encoded sequences) are given, each sample continues one of them
+    (taking them in turn), and the output is the prompts followed by their continuations.
+    """
+    num_steps_tensor = tf.placeholder(tf.int32, [], name='num_steps')
+    batch_size_tensor = tf.placeholder(tf.int32, [], name='batch_size')
+    prompt_tensors = None
+    if prompts is not None:
+        prompts = [prompts[i % len(prompts)] for i in range(num_samples)]
+        prompt_tensors = (tf.placeholder(tf.int32, [None, None, 5]), tf.placeholder(tf.int32, [None]))
+    samples = build_sampling_graph(num_steps_tensor, batch_size_tensor, prompt_tensors)
+    sess = restore_session(checkpoint_dir)
 
-sess = tf.Session()
+    def sample_steps(batch_size, num_steps, first=0):
+        feed_dict = {batch_size_tensor: batch_size, num_steps_tensor: num_steps}
+        if prompts is not None:
+            feed_dict.update(zip(prompt_tensors, pad_prompts(prompts[first:first + batch_size])))
+        return sess.run(samples, feed_dict)
 
-ckpt_path = tf.train.latest_checkpoint(CHECKPOINT_DIR)
+    if batch_size is None:
+        batch_size = fastest_batch_size(sample_steps, max_batch_size=num_samples)
+        print("Sampling with batch size: %d" % batch_size)
 
-if ckpt_path is None:
-    raise RuntimeError("No valid checkpoint found!")
+    out = sample_in_batches(lambda first, size: sample_steps(size, num_steps, first), num_samples, batch_size)
+    if prompts is not None:
+        out = join_continuations(prompts, out)
+    np.save(output_path, out)
+    print("Saved samples to: %s" % output_path)
+    return out
 
-print("Restoring variables from checkpoint: %s" % ckpt_path)
-saver.restore(sess, ckpt_path)
 
-out = sess.run(samples)
-np.save(OUTPUT_PATH, out)
-print("Saved samples to: %s" % OUTPUT_PATH)
+if __name__ == '__main__':
+    sample()
@@ -0,0 +1,95 @@
+"""
+Scores pieces by their log-likelihood under a trained model, e.g. to rerank thousands of candidate lead sheets. The
+pieces (index-encoded, from the corpus or from earlier samples) are run through the model teacher-forced, in large
+batches, and each piece gets the summed log-likelihood of each head (pitch, root, bass, chord and duration) over its
+timesteps. The pieces are sorted by length so that each batch has as little padding as possible, and the scores are
+yielded as each batch is done, so that a large candidate set doesn't have to be scored in full before using them.
+
+Scoring uses either a checkpoint, through the same loss terms as training (train.get_losses), or weights exported
+for the NumPy engine:
+
+    python main.py score corpus --weights model.npz
+    python main.py score samples.npy
+"""
+
+import collections
+
+import numpy as np
+
+from corpus import get_corpus, indices_from_vectors, vectors_from_indices
+from Model.layout import OUTPUT_OFFSETS
+from Model.numpy_engine import log_sigmoid, log_softmax
+from prompts import pad_prompts
+
+SCORE_BATCH_SIZE = 256
+HEADS = ['pitch', 'root', 'bass', 'chord', 'duration']
+
+
+def load_pieces(source):
+    # Returns an OrderedDict of index-encoded pieces: the corpus' (by title), or the samples in a .npy file.
+    if source == 'corpus':
+        return get_corpus()
+    return collections.OrderedDict(('sample_%d' % i, indices_from_vectors(sample[sample.any(axis=-1)]))
+                                   for i, sample in enumerate(np.load(source)))
+
+
+def length_sorted_batches(pieces, batch_size=SCORE_BATCH_SIZE):
+    # Yields the positions of the pieces in each batch, and the batch (padded, with the lengths), shortest first.
+    order = sorted(range(len(pieces)), key=lambda i: len(pieces[i]))
+    for first in range(0, len(order), batch_size):
+        positions = order[first:first + batch_size]
+        yield positions, pad_prompts([pieces[i] for i in positions])
+
+
+def numpy_log_likelihoods(model):
+    """
+    Returns a function that takes a padded batch of index-encoded pieces [batch_size, num_timesteps, 5] and their
+    lengths, and returns the log-likelihood of each head for each piece (a dict of [batch_size] arrays), under a
+    NumpyModel.
+    """
+    def log_likelihoods(indices, lengths):
+        logits = np.split(model.run(indices), OUTPUT_OFFSETS[1:-1], axis=-1)
+        targets = np.split(vectors_from_indices(indices), OUTPUT_OFFSETS[1:-1], axis=-1)
+        mask = np.arange(indices.shape[1]) < lengths[:, None]
+        scores = {}
+        for head, head_logits, head_targets in zip(HEADS, logits, targets):
+            if head == 'chord':
+                timestep_scores = (head_targets * log_sigmoid(head_logits) +
+                                   (1 - head_targets) * log_sigmoid(-head_logits)).sum(axis=-1)
+            else:
+                timestep_scores = (head_targets * log_softmax(head_logits)).sum(axis=-1)
+            scores[head] = (timestep_scores * mask).sum(axis=-1)
+        return scores
+    return log_likelihoods
+
+
+def checkpoint_log_likelihoods(checkpoint_dir):
+    # The same as numpy_log_likelihoods, for the latest checkpoint in checkpoint_dir. TensorFlow is only imported here,
+    # so that scoring with the NumPy engine doesn't need it.
+    import tensorflow as tf
+    from sample import restore_session
+    from train import get_losses
+
+    inputs = {'data': tf.placeholder(tf.int32, [None, None, 5]), 'length': tf.placeholder(tf.int32, [None])}
+    losses = get_losses(inputs)
+    mask = tf.sequence_mask(inputs['length'], maxlen=tf.shape(inputs['data'])[1], dtype=tf.float32)
+    scores = {head: -tf.reduce_sum(losses[head] * mask, axis=1) for head in HEADS}
+    sess = restore_session(checkpoint_dir)
+
+    def log_likelihoods(indices, lengths):
+        return sess.run(scores, {inputs['data']: indices, inputs['length']: lengths})
+    return log_likelihoods
+
+
+def score_pieces(log_likelihoods, pieces, batch_size=SCORE_BATCH_SIZE):
+    """
+    Scores a list of index-encoded pieces with log_likelihoods (see numpy_log_likelihoods), yielding the position of
+    each piece in the list along with its scores (a dict of the log-likelihood of each head, plus the 'total'), batch
+    by batch in order of length.
+    """
+    for positions, (indices, lengths) in length_sorted_batches(pieces, batch_size):
+        batch_scores = log_likelihoods(indices, lengths)
+        for j, i in enumerate(positions):
+            scores = {head: float(batch_scores[head][j]) for head in HEADS}
+            scores['total'] = sum(scores.values())
+            yield i, scores
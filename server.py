@@ -0,0 +1,223 @@
+"""
+A long-running local generation server, which keeps the NumPy model loaded so that other programs can request
+samples without paying for starting up a sampler each time. Concurrent requests are gathered into micro-batches (of
+up to BATCH_SIZE requests, waiting at most MAX_WAIT_MS after the first one arrives), which are sampled together.
+
+The server only listens on localhost, and speaks just enough HTTP/1.1 for simple JSON clients:
+
+    POST /generate  {"num_bars": 32}          A piece 32 bars long (assuming no pickup), or
+                    {"num_steps": 100}        one of 100 timesteps.
+                    "format" can also be set to "indices" (the default: index-encoded timesteps, see corpus.py),
+                    "vectors" (timestep vectors), or "decoded" (chord symbols, melody and bars).
+                    With "prompt" (a list of index-encoded timesteps), the piece continues the prompt (which isn't
+                    included in the response). Primed states are cached, so repeated prompts aren't primed again.
+                    "sampling" sets the temperature, top_k and top_p of every head, or of one head under its field
+                    name, e.g. {"temperature": 0.9, "pitch": {"top_p": 0.95}} (see settings_from_spec).
+    GET /metrics    Request latency percentiles (p50/p99, in milliseconds), how full the micro-batches were, and the
+                    prefix cache's hit rate.
+
+    python main.py serve --weights model.npz
+"""
+
+import asyncio
+import collections
+import json
+import time
+
+import numpy as np
+
+from batching import BATCH_SIZE, ContinuousBatcher, GenerationJob
+from corpus import indices_from_vectors
+from Model.numpy_engine import MAX_STEPS_PER_BAR, NumpyModel, settings_from_spec
+from prefix_cache import PrefixStateCache
+from prompts import check_prompt
+
+HOST = '127.0.0.1'
+PORT = 8765
+MAX_WAIT_MS = 20
+MAX_NUM_BARS = 256
+MAX_NUM_STEPS = MAX_NUM_BARS * MAX_STEPS_PER_BAR
+NUM_LATENCIES_KEPT = 10000  # The latency percentiles are of this many most recent requests.
+FORMATS = ['indices', 'vectors', 'decoded']
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+class BadRequest(Exception):
+    pass
+
+
+def job_from_request(request):
+    if request.get('format', 'indices') not in FORMATS:
+        raise BadRequest("format must be one of: " + ", ".join(FORMATS))
+    for key, limit in [('num_bars', MAX_NUM_BARS), ('num_steps', MAX_NUM_STEPS)]:
+        value = request.get(key)
+        if value is not None and not (isinstance(value, int) and not isinstance(value, bool) and 0 < value <= limit):
+            raise BadRequest("%s must be an integer from 1 to %d" % (key, limit))
+    if request.get('num_bars') is None and request.get('num_steps') is None:
+        raise BadRequest("num_bars or num_steps must be given")
+    job = GenerationJob(num_bars=request.get('num_bars'), num_steps=request.get('num_steps'),
+                        settings=settings_from_spec(request.get('sampling')))
+    job.prompt = check_prompt(request['prompt']) if request.get('prompt') is not None else None
+    return job
+
+
+def decoded_json(samples):
+    from decoder import decode_sample, printable_chord_symbol
+    decoded = decode_sample(samples)
+    if decoded is None:
+        return None
+    melody, chords, bars = decoded
+    return {
+        'chords': [{'symbol': printable_chord_symbol(chord), 'duration': int(chord.duration)} for chord in chords],
+        'melody': [{'pitch': int(note.pitch), 'name': note.name, 'duration': int(note.duration)} for note in melody],
+        'bars': [int(bar.duration) for bar in bars],
+    }
+
+
+def response_json(job, output_format):
+    samples = job.samples()
+    if output_format == 'vectors':
+        return {'vectors': samples.astype(int).tolist()}
+    if output_format == 'decoded':
+        return {'piece': decoded_json(samples)}  # null if the sample isn't a valid piece.
+    return {'indices': indices_from_vectors(samples).tolist()}
+
+
+class GenerationServer:
+    def __init__(self, model, batch_size=BATCH_SIZE, max_wait_ms=MAX_WAIT_MS, seed=None, prefix_cache=None):
+        self.model = model
+        self.prefix_cache = prefix_cache if prefix_cache is not None else PrefixStateCache()
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.rng = np.random.RandomState(seed)
+        self.pending = None  # An asyncio.Queue of (job, future) pairs, created in the server's event loop.
+        self.latencies = collections.deque(maxlen=NUM_LATENCIES_KEPT)
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_batched_jobs = 0
+
+    def metrics(self):
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'requests': self.num_requests,
+            'batches': self.num_batches,
+            'mean_batch_fill': self.num_batched_jobs / max(self.num_batches * self.batch_size, 1),
+            'latency_ms': {
+                'p50': float(np.percentile(latencies, 50)) if len(latencies) else None,
+                'p99': float(np.percentile(latencies, 99)) if len(latencies) else None,
+            },
+            'prefix_cache': self.prefix_cache.stats(),
+        }
+
+    def sample_batch(self, jobs):
+        # Runs in a worker thread, so that the event loop can keep accepting requests in the meantime.
+        prompted = [job for job in jobs if job.prompt is not None]
+        if prompted:
+            (hidden, cell), next_inputs = self.prefix_cache.prime(self.model, [job.prompt for job in prompted])
+            for i, job in enumerate(prompted):
+                job.primed = (hidden[i], cell[i], next_inputs[i])
+        batcher = ContinuousBatcher(self.model, batch_size=len(jobs), rng=self.rng)
+        for job in jobs:
+            batcher.submit(job)
+        for _ in batcher.run():
+            pass
+
+    async def batch_requests(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), max(deadline - loop.time(), 0)))
+                except asyncio.TimeoutError:
+                    break
+
+            self.num_batches += 1
+            self.num_batched_jobs += len(batch)
+            jobs = [job for job, _ in batch]
+            try:
+                await loop.run_in_executor(None, self.sample_batch, jobs)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for job, future in batch:
+                    future.set_result(job)
+
+    async def generate(self, request):
+        start = time.perf_counter()
+        job = job_from_request(request)
+        future = asyncio.get_running_loop().create_future()
+        await self.pending.put((job, future))
+        response = response_json(await future, request.get('format', 'indices'))
+        self.num_requests += 1
+        self.latencies.append(time.perf_counter() - start)
+        return response
+
+    async def handle(self, method, path, body):
+        # Returns (HTTP status, JSON response).
+        if path == '/metrics' and method == 'GET':
+            return 200, self.metrics()
+        if path == '/generate' and method == 'POST':
+            try:
+                request = json.loads(body or b'{}')
+                if not isinstance(request, dict):
+                    raise BadRequest("the request must be a JSON object")
+                return 200, await self.generate(request)
+            except (ValueError, BadRequest) as e:
+                return 400, {'error': str(e)}
+        return 404, {'error': "not found"}
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            if len(request_line) < 2:
+                status, response = 400, {'error': "bad request"}
+            else:
+                try:
+                    status, response = await self.handle(request_line[0], request_line[1], body)
+                except Exception as e:
+                    status, response = 500, {'error': repr(e)}
+            content = json.dumps(response).encode('utf-8')
+            writer.write(('HTTP/1.1 %d %s\r\nContent-Type: application/json\r\nContent-Length: %d\r\n'
+                          'Connection: close\r\n\r\n' % (status, HTTP_REASONS[status], len(content))).encode('latin-1'))
+            writer.write(content)
+            await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host=HOST, port=PORT):
+        self.pending = asyncio.Queue()
+        batcher = asyncio.ensure_future(self.batch_requests())
+        server = await asyncio.start_server(self.handle_connection, host, port)
+        print("Serving on http://%s:%d" % (host, port))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+
+
+def serve(weights_path, port=PORT, max_wait_ms=MAX_WAIT_MS, prefix_cache_path=None):
+    model = NumpyModel.load(weights_path)
+    prefix_cache = PrefixStateCache(path=prefix_cache_path, fingerprint=model.fingerprint)
+    server = GenerationServer(model, max_wait_ms=max_wait_ms, prefix_cache=prefix_cache)
+    try:
+        asyncio.run(server.serve(HOST, port))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if prefix_cache_path is not None:
+            prefix_cache.save()
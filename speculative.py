@@ -0,0 +1,303 @@
+"""
+Speculative sampling with the NumPy engine: a cheap n-gram model (NgramDraft) drafts the next few timesteps of each
+sequence, and the LSTM checks all of them at once, keeping the longest prefix that rejection sampling accepts (as in
+Leviathan et al., 2023, and Chen et al., 2023), so that the samples have exactly the same distribution as
+NumpyModel.sample_bars.
+
+The model samples a timestep as 16 choices, one after the other: pitch, root, bass, the 12 chord notes, then duration.
+The draft is checked one choice at a time, in the same order, against the model's distribution for that choice given
+the drafted choices before it (including the chord and duration masks, and any sampling settings, as in sample_step).
+The draft always proposes the most common continuation of its context, so a drafted choice x is accepted with
+probability p(x), and the first rejected one is resampled from p with x left out (the leftover distribution
+max(0, p - q) of a draft q that puts all its weight on x). The rest of that timestep is then sampled from the model.
+If every drafted timestep is accepted, one more is sampled from the model.
+
+The LSTM's recurrence still has to be stepped through the drafted timesteps one at a time, but the output heads of all
+of them are run in one go (each head once, and the chord notes' masked layer once, teacher-forced), instead of one
+timestep and one chord note at a time. How much faster that is depends on how often the draft is right, which is
+highest when the model is confident, e.g. at low temperatures (see benchmarks/speculative.py). A draft built from the
+model's own samples usually agrees with it more than one built from the corpus. When the draft is rarely right, the
+sampler mostly takes plain steps instead, trying the draft again now and then.
+
+    python main.py sample --weights model.npz --num-bars 16 --draft-steps 4
+"""
+
+import collections
+
+import numpy as np
+
+from corpus import DURATIONS, FIELD_SIZES, durations_from_indices, feasible_durations, get_corpus, \
+    vectors_from_indices
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table
+from definitions import BAR_DURATION
+from Model.layout import OUTPUT_OFFSETS, START_INDICES
+from Model.numpy_engine import MAX_STEPS_PER_BAR, apply_settings, one_hot, select_settings, sigmoid, softmax
+
+DRAFT_ORDER = 3  # Each drafted timestep depends on the two before it.
+DRAFT_STEPS = 4
+# A round of drafting costs about as much as two or three plain steps, so while fewer than MIN_ACCEPTED drafted
+# timesteps are being accepted per round (on average, over recent rounds), the sampler takes plain steps instead. It
+# tries the draft again after PROBE_INTERVAL steps, in case it has started to agree with the model, and waits twice as
+# long after each try that fails (up to MAX_PROBE_INTERVAL steps).
+MIN_ACCEPTED = 1.0
+PROBE_INTERVAL = 16
+MAX_PROBE_INTERVAL = 512
+NUM_CHOICES = 16  # Pitch, root, bass, the 12 chord notes and duration.
+CHORD_CHOICES = slice(3, 3 + FIELD_SIZES[3])
+
+
+def choices_from_indices(indices):
+    # Index-encoded timesteps [..., 5] as their 16 choices [..., 16].
+    indices = np.asarray(indices)
+    chord_notes = (indices[..., 3, None] >> np.arange(FIELD_SIZES[3])) & 1
+    return np.concatenate([indices[..., :3], chord_notes, indices[..., 4:]], axis=-1)
+
+
+def indices_from_choices(choices):
+    chord = (choices[..., CHORD_CHOICES] << np.arange(FIELD_SIZES[3])).sum(axis=-1)
+    return np.concatenate([choices[..., :3], chord[..., None], choices[..., 15:]], axis=-1)
+
+
+class NgramDraft:
+    """
+    An n-gram model of index-encoded pieces (e.g. the corpus, or samples from the model): it predicts the timestep
+    that most often followed the same order - 1 timesteps (as Junk/sequence_generation.py counts note transitions),
+    out of those that fit in the rest of the bar, backing off to fewer timesteps when there are none.
+    """
+    def __init__(self, pieces, order=DRAFT_ORDER):
+        self.order = order
+        counts = collections.defaultdict(lambda: collections.defaultdict(int))
+        for piece in pieces:
+            history = [tuple(START_INDICES)] * (order - 1) + [tuple(int(x) for x in ts) for ts in piece]
+            for t in range(order - 1, len(history)):
+                for n in range(order):
+                    counts[tuple(history[t - n:t])][history[t]] += 1
+        # The continuations of each context, most common first.
+        self.continuations = {context: sorted(next_timesteps, key=lambda ts: -next_timesteps[ts])
+                              for context, next_timesteps in counts.items()}
+        self.predictions = {}  # Memoised by (context, time left in the bar).
+
+    @classmethod
+    def from_corpus(cls, order=DRAFT_ORDER):
+        return cls(get_corpus().values(), order)
+
+    def predict(self, history, elapsed):
+        # The most common continuation of the end of history (a list of timestep tuples) after timesteps lasting
+        # elapsed in total.
+        remaining = BAR_DURATION - elapsed % BAR_DURATION
+        for n in range(min(self.order - 1, len(history)), -1, -1):
+            key = (tuple(history[len(history) - n:]), remaining)
+            if key not in self.predictions:
+                fitting = [ts for ts in self.continuations.get(key[0], []) if DURATIONS[ts[4]] <= remaining]
+                self.predictions[key] = fitting[0] if fitting else None
+            if self.predictions[key] is not None:
+                return self.predictions[key]
+        return self.continuations[()][0]  # Nothing fits: the model will reject its duration.
+
+    def draft(self, history, elapsed, num_steps):
+        # Drafts num_steps timesteps after history, returning them as tuples.
+        history = list(history)
+        for _ in range(num_steps):
+            history.append(self.predict(history, elapsed))
+            elapsed += DURATIONS[history[-1][4]]
+        return history[len(history) - num_steps:]
+
+
+def chord_note_probs(logits, choices, first, settings):
+    # The probability that each of the chord notes first, first + 1, ... is in each timestep's chord, given their
+    # logits [batch_size, num_notes] and the choices before them, with the same masks and settings as in sample_step.
+    notes = np.arange(first, first + logits.shape[-1])
+    bits = choices[:, CHORD_CHOICES] << np.arange(FIELD_SIZES[3])
+    chord = (np.cumsum(bits, axis=-1) - bits)[:, notes]  # The notes of the chord before each one.
+    no_chord = (choices[:, 1] == NO_CHORD_ROOT_INDEX)[:, None]
+    can_omit = chord_prefix_table()[notes + 1, chord] | no_chord
+    can_include = chord_prefix_table()[notes + 1, chord | 1 << notes] & ~no_chord
+    logits = np.where(can_include, np.where(can_omit, logits, np.inf), -np.inf)
+    if settings is not None and settings.get('c') is not None:
+        logits = np.stack([apply_settings(logits[:, j], settings, 'c') for j in range(len(notes))], axis=-1)
+    return sigmoid(logits)
+
+
+def drafted_choice_probs(model, context, choices, elapsed, settings):
+    """
+    The model's probability of each of the choices of a batch of drafted timesteps [batch_size, 16], given the ones
+    before it, the context of its timestep and the elapsed time before it. Returns [batch_size, 16].
+    """
+    rows = np.arange(len(choices))
+    fields = [one_hot(choices[:, k], size) for k, size in enumerate(FIELD_SIZES[:3])]
+    probs = []
+    for k, head in enumerate('prb'):
+        head_probs = softmax(apply_settings(model.head_logits(head, context, fields[:k]), settings, head))
+        probs.append(head_probs[rows, choices[:, k]])
+    c = choices[:, CHORD_CHOICES].astype(np.float32)
+    chord_logits = model.chord_logits(model.chord_context(context, fields), c)  # The notes are masked (MADE).
+    included = chord_note_probs(chord_logits, choices, 0, settings)
+    probs.append(np.where(choices[:, CHORD_CHOICES] == 1, included, 1 - included))
+    logits = np.where(feasible_durations(elapsed), model.head_logits('d', context, fields + [c]), -np.inf)
+    probs.append(softmax(apply_settings(logits, settings, 'd'))[rows, choices[:, 15]])
+    return np.concatenate([np.stack(probs[:3], axis=-1), probs[3], probs[4][:, None]], axis=-1)
+
+
+def sample_probs(probs, rng):
+    # Samples one index per row of a [batch_size, num_classes] array of probabilities, as sample_categorical does.
+    cumulative = np.cumsum(probs, axis=-1)
+    u = rng.random_sample([probs.shape[0], 1]) * cumulative[:, -1:]
+    return np.minimum((cumulative < u).sum(axis=-1), probs.shape[-1] - 1)
+
+
+def complete_timesteps(model, context, choices, num_given, rejected, elapsed, settings, rng):
+    """
+    Samples the choices [batch_size, 16] of each timestep after its first num_given, in place, from the model, as
+    sample_step does. Choice num_given of a timestep is sampled without the rejected outcome, unless that is -1.
+    """
+    def resample(probs, k):
+        left_out = np.flatnonzero((num_given == k) & (rejected >= 0))
+        if len(left_out):
+            leftover = probs.copy()
+            leftover[left_out, rejected[left_out]] = 0.0
+            probs = np.where(leftover.sum(axis=-1, keepdims=True) > 0, leftover, probs)  # In case of rounding.
+        choices[:, k] = np.where(num_given <= k, sample_probs(probs, rng), choices[:, k])
+
+    fields = []
+    for k, head in enumerate('prb'):
+        resample(softmax(apply_settings(model.head_logits(head, context, fields), settings, head)), k)
+        fields.append(one_hot(choices[:, k], FIELD_SIZES[k]))
+    chord_context = model.chord_context(context, fields)
+    c = choices[:, CHORD_CHOICES].astype(np.float32)
+    for i in range(FIELD_SIZES[3]):
+        included = chord_note_probs(model.chord_logits(chord_context, c)[:, i:i + 1], choices, i, settings)
+        resample(np.concatenate([1 - included, included], axis=-1), 3 + i)
+        c[:, i] = choices[:, 3 + i]
+    logits = np.where(feasible_durations(elapsed), model.head_logits('d', context, fields + [c]), -np.inf)
+    resample(softmax(apply_settings(logits, settings, 'd')), 15)
+    return choices
+
+
+class SpeculativeSampler:
+    """
+    Samples with a NumpyModel, drafting num_draft timesteps at a time with an NgramDraft (by default, of the corpus).
+    Keeps count of the rounds of drafting (per sequence) and the timesteps that they sampled, so that timesteps /
+    rounds is the mean number sampled per round, and of the plain steps taken while the draft wasn't paying off.
+    """
+    def __init__(self, model, draft=None, num_draft=DRAFT_STEPS):
+        self.model = model
+        self.draft = draft or NgramDraft.from_corpus()
+        self.num_draft = num_draft
+        self.rounds = 0
+        self.timesteps = 0
+        self.plain_steps = 0
+        self.mean_accepted = float(num_draft)  # Drafted timesteps accepted per round, recently. Starts out hopeful.
+        self.probe_interval = PROBE_INTERVAL
+
+    def verify(self, state, indices, recent, elapsed, settings, rng):
+        """
+        Drafts num_draft timesteps for each sequence (with the LSTM state, last timestep, the draft's context (as a
+        list of timestep tuples) and elapsed time of each one) and checks them with the model. Returns the timesteps
+        [batch_size, num_draft + 1, 5] (the accepted drafted ones, then the one sampled by the model, then the rest of
+        the draft), the number sampled (the accepted ones plus one), and the LSTM states (hidden, cell) after feeding
+        in each of the last timestep and the drafted ones [batch_size, num_draft + 1, num_units].
+        """
+        model, num_draft = self.model, self.num_draft
+        batch_size = len(indices)
+        rows = np.arange(batch_size)
+        drafted_indices = np.array([self.draft.draft(history, row_elapsed, num_draft)
+                                    for history, row_elapsed in zip(recent, elapsed)]).reshape(-1, num_draft, 5)
+        drafted = choices_from_indices(drafted_indices)
+
+        # Step the LSTM through the last timestep and the drafted ones, keeping the state after each.
+        input_gates = model.embed(np.concatenate([indices[:, None], drafted_indices], axis=1))
+        hidden, cell = [], []
+        for t in range(num_draft + 1):
+            _, state = model.lstm_step(input_gates[:, t], state)
+            hidden.append(state[0])
+            cell.append(state[1])
+        states = (np.stack(hidden, axis=1), np.stack(cell, axis=1))
+        context = model.context(states[0])
+
+        # Accept each drafted choice with the model's probability of it, up to the first that is rejected.
+        durations = durations_from_indices(drafted_indices)
+        draft_elapsed = elapsed[:, None] + np.concatenate([np.zeros([batch_size, 1], dtype=np.int64),
+                                                           np.cumsum(durations, axis=1)], axis=1)
+        probs = drafted_choice_probs(model, context[:, :num_draft].reshape(batch_size * num_draft, -1),
+                                     drafted.reshape(-1, NUM_CHOICES), draft_elapsed[:, :num_draft].ravel(),
+                                     select_settings(settings, np.repeat(rows, num_draft)))
+        accepted = (rng.random_sample(probs.shape) < probs).reshape(batch_size, -1)
+        first_rejected = np.where(accepted.all(axis=1), accepted.shape[1], np.argmin(accepted, axis=1))
+        num_accepted, num_given = first_rejected // NUM_CHOICES, first_rejected % NUM_CHOICES
+
+        # The last timestep of each sequence: the first rejected one with the rejected choice and the ones after it
+        # resampled, or a new one if the whole draft was accepted.
+        whole = num_accepted == num_draft
+        last = np.where(whole[:, None], 0, drafted[rows, np.minimum(num_accepted, num_draft - 1)])
+        rejected = np.where(whole, -1, last[rows, np.where(whole, 0, num_given)])
+        complete_timesteps(model, context[rows, num_accepted], last, np.where(whole, 0, num_given), rejected,
+                           draft_elapsed[rows, num_accepted], settings, rng)
+
+        timesteps = np.concatenate([drafted_indices, np.zeros([batch_size, 1, 5], dtype=np.int64)], axis=1)
+        timesteps[rows, num_accepted] = indices_from_choices(last)
+        self.rounds += batch_size
+        self.timesteps += int(num_accepted.sum()) + batch_size
+        return timesteps, num_accepted + 1, states
+
+    def plain_step(self, state, indices, elapsed, settings, rng):
+        # The same as verify, but sampling one timestep from the model without a draft.
+        h, state = self.model.step(indices, state)
+        timesteps, _ = self.model.sample_step(h, rng, elapsed, settings)
+        self.plain_steps += 1
+        return timesteps[:, None], np.ones([len(indices)], dtype=np.int64), tuple(s[:, None] for s in state)
+
+    def sample_bars(self, batch_size, num_bars, max_steps=None, seed=None, prompts=None, settings=None):
+        """
+        The same as NumpyModel.sample_bars, but sampling speculatively. Continues the prompts (a list of index-encoded
+        sequences), if they are given, rather than taking the result of prime, as drafting needs their timesteps.
+        """
+        target_durations = np.broadcast_to(num_bars, [batch_size]) * BAR_DURATION
+        if max_steps is None:
+            max_steps = MAX_STEPS_PER_BAR * np.max(num_bars)
+        rng = np.random.RandomState(seed)
+        context_size = self.draft.order - 1
+        history = np.tile(np.array(START_INDICES), [batch_size, context_size, 1])  # Padded as the draft was built.
+        if prompts is not None:
+            state, indices = self.model.prime(prompts)
+            history = np.stack([np.concatenate([history[0], prompt])[len(prompt):] for prompt in prompts])
+        else:
+            state, indices = self.model.initial_state(batch_size), self.model.start_indices(batch_size)
+        rows = np.arange(batch_size)  # The rows of the batch that are still being sampled.
+        elapsed = np.zeros([batch_size], dtype=np.int64)
+        lengths = np.zeros([batch_size], dtype=np.int64)
+        samples = np.zeros([batch_size, max_steps, OUTPUT_OFFSETS[-1]], dtype=np.float32)
+
+        num_plain_steps = 0  # Since the last round of drafting.
+        while len(rows):
+            row_settings = select_settings(settings, rows)
+            if self.mean_accepted >= MIN_ACCEPTED or num_plain_steps >= self.probe_interval:
+                recent = [[tuple(timestep) for timestep in row_history.tolist()] for row_history in history[rows]]
+                timesteps, num_sampled, states = self.verify(state, indices, recent, elapsed[rows], row_settings, rng)
+                self.mean_accepted = 0.5 * self.mean_accepted + 0.5 * (num_sampled.mean() - 1)
+                if num_plain_steps:
+                    paid_off = self.mean_accepted >= MIN_ACCEPTED
+                    self.probe_interval = PROBE_INTERVAL if paid_off else min(2 * self.probe_interval,
+                                                                              MAX_PROBE_INTERVAL)
+                num_plain_steps = 0
+            else:
+                timesteps, num_sampled, states = self.plain_step(state, indices, elapsed[rows], row_settings, rng)
+                num_plain_steps += 1
+            # Anything sampled after the end of a piece is dropped.
+            ends = elapsed[rows, None] + np.cumsum(durations_from_indices(timesteps), axis=1)
+            steps = np.arange(1, timesteps.shape[1] + 1)
+            done = (ends >= target_durations[rows, None]) | (lengths[rows, None] + steps >= max_steps)
+            num_kept = np.where(done.any(axis=1), np.minimum(np.argmax(done, axis=1) + 1, num_sampled), num_sampled)
+            for t in range(timesteps.shape[1]):
+                kept = t < num_kept
+                samples[rows[kept], lengths[rows[kept]] + t] = vectors_from_indices(timesteps[kept, t])
+            # The last context_size timesteps of each sequence, for drafting.
+            window = np.concatenate([history[rows], timesteps], axis=1)
+            history[rows] = window[np.arange(len(rows))[:, None], num_kept[:, None] + np.arange(context_size)]
+            lengths[rows] += num_kept
+            elapsed[rows] = ends[np.arange(len(rows)), num_kept - 1]
+
+            unfinished = ~done[np.arange(len(rows)), num_kept - 1]
+            state = tuple(s[np.arange(len(rows)), num_sampled - 1][unfinished] for s in states)
+            indices = timesteps[np.arange(len(rows)), num_sampled - 1][unfinished]
+            rows = rows[unfinished]
+        return samples[:, :lengths.max()], lengths
@@ -0,0 +1,78 @@
+"""
+Streaming generation with the NumPy engine, for consumers (e.g. playback) that want to start on a piece before it has
+been sampled in full. Timesteps are sampled one at a time as the consumer asks for them, and are decoded as they
+arrive, so the first bar is ready after a bar's worth of sampling rather than a whole piece's.
+
+    for bar in stream_bars(model, num_bars=32):
+        ...  # bar.notes and bar.chords are the notes and chords that start in the bar.
+
+    async for bar in astream_bars(model, num_bars=32):
+        ...
+
+    python main.py stream --weights model.npz --num-bars 32
+"""
+
+import asyncio
+import collections
+
+from decoder import TimestepDecoder, iter_marked_barlines, timestep_object_from_vector
+from definitions import BAR_DURATION
+
+# The notes and chords that start in a bar. A note or chord that is tied over into the next bar is lengthened in
+# place once that bar has been sampled.
+StreamedBar = collections.namedtuple('StreamedBar', ['number', 'timesteps', 'notes', 'chords'])
+
+
+def stream_timesteps(model, num_steps=None, num_bars=None, seed=None, prompt=None):
+    """
+    Samples a piece (continuing prompt, an index-encoded sequence, if given), yielding each timestep as a Timestep
+    (with its barline and bar number inferred, see decoder.mark_barlines) as soon as it has been sampled. The piece
+    ends after num_steps timesteps or num_bars bars, whichever comes first, or when the caller stops asking.
+    """
+    primed = model.prime([prompt]) if prompt is not None else None
+    sampled = (timestep_object_from_vector(vectors[0]) for _, vectors in model.generate(1, seed=seed, primed=primed))
+    elapsed = 0
+    for n, ts in enumerate(iter_marked_barlines(sampled), 1):
+        yield ts
+        elapsed += ts.duration
+        if (num_steps is not None and n >= num_steps) or (num_bars is not None and elapsed >= num_bars * BAR_DURATION):
+            return
+
+
+def stream_bars(model, num_steps=None, num_bars=None, seed=None, prompt=None):
+    # Yields each bar of a piece sampled as in stream_timesteps as a StreamedBar, as soon as the bar is complete.
+    decoder = TimestepDecoder()
+    timesteps = []
+    elapsed = 0
+    for ts in stream_timesteps(model, num_steps, num_bars, seed, prompt):
+        if not timesteps:
+            num_notes, num_chords = len(decoder.melody), len(decoder.chords)
+        decoder.add(ts)
+        timesteps.append(ts)
+        elapsed += ts.duration
+        if elapsed >= (ts.bar_number + 1) * BAR_DURATION:
+            yield StreamedBar(ts.bar_number, timesteps, decoder.melody[num_notes:], decoder.chords[num_chords:])
+            timesteps = []
+    if timesteps:  # The piece ended part of the way through a bar.
+        yield StreamedBar(timesteps[0].bar_number, timesteps, decoder.melody[num_notes:], decoder.chords[num_chords:])
+
+
+async def _async_iterate(iterator):
+    # Runs each step of iterator in a worker thread, so that sampling doesn't block the event loop.
+    loop = asyncio.get_running_loop()
+    done = object()
+    while True:
+        item = await loop.run_in_executor(None, next, iterator, done)
+        if item is done:
+            return
+        yield item
+
+
+def astream_timesteps(model, num_steps=None, num_bars=None, seed=None, prompt=None):
+    # The async iterator version of stream_timesteps.
+    return _async_iterate(stream_timesteps(model, num_steps, num_bars, seed, prompt))
+
+
+def astream_bars(model, num_steps=None, num_bars=None, seed=None, prompt=None):
+    # The async iterator version of stream_bars.
+    return _async_iterate(stream_bars(model, num_steps, num_bars, seed, prompt))
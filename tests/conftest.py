@@ -0,0 +1,37 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from corpus import FIELD_SIZES  # noqa: E402
+from Model.layout import NUM_CONDITIONING_INPUTS, NUM_HIDDEN, OUTPUT_OFFSETS, fused_head_masks  # noqa: E402
+from Model.numpy_engine import EMBEDDING_NAMES, NumpyModel  # noqa: E402
+
+NUM_UNITS = 32
+
+
+def random_weights(seed=0, num_units=NUM_UNITS, scale=1.0):
+    # Random weights in the layout of export_weights, for a small model. A larger scale makes it more confident.
+    rng = np.random.RandomState(seed)
+    cond_mask, out_mask = fused_head_masks()
+    weights = {'embed_' + name: rng.normal(0, 0.3, [size + 1, 4 * num_units])
+               for name, size in zip(EMBEDDING_NAMES, FIELD_SIZES)}
+    weights['embed_chord'] = rng.normal(0, 0.3, [FIELD_SIZES[3], 4 * num_units])
+    weights.update({
+        'lstm_w_h': rng.normal(0, 1 / np.sqrt(num_units), [num_units, 4 * num_units]),
+        'lstm_b': np.zeros([4 * num_units]),
+        'heads_w_h': rng.normal(0, 1 / np.sqrt(num_units), [num_units, NUM_HIDDEN]),
+        'heads_w_cond': rng.normal(0, 0.3, [NUM_CONDITIONING_INPUTS, NUM_HIDDEN]) * cond_mask,
+        'heads_b_hidden': rng.normal(0, 0.1, [NUM_HIDDEN]),
+        'heads_w_out': rng.normal(0, 0.2 * scale, [NUM_HIDDEN, OUTPUT_OFFSETS[-1]]) * out_mask,
+        'heads_b_out': rng.normal(0, 0.5 * scale, [OUTPUT_OFFSETS[-1]]),
+    })
+    return {name: value.astype(np.float32) for name, value in weights.items()}
+
+
+@pytest.fixture(scope='session')
+def model():
+    return NumpyModel(random_weights())
@@ -0,0 +1,15 @@
+import pytest
+
+from batching import CANDIDATE_BATCH_SIZES, fastest_batch_size
+
+
+@pytest.mark.parametrize('max_batch_size, expected', [
+    (None, CANDIDATE_BATCH_SIZES),
+    (20, [1, 4, 16, 20]),
+    (64, [1, 4, 16, 32, 64]),
+    (100000, CANDIDATE_BATCH_SIZES),
+])
+def test_fastest_batch_size_only_tries_candidates_up_to_the_largest(max_batch_size, expected):
+    tried = []
+    fastest_batch_size(lambda batch_size, num_steps: tried.append(batch_size), max_batch_size)
+    assert tried[::2] == expected
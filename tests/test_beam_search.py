@@ -0,0 +1,35 @@
+import numpy as np
+
+from beam_search import beam_search
+from corpus import BAR_DURATION, durations_from_indices, indices_from_vectors
+from Model.layout import HEAD_NAMES
+from Model.numpy_engine import SamplingSettings
+from prompts import piece_prompt
+
+GREEDY = {head: SamplingSettings(temperature=0) for head in HEAD_NAMES}
+
+
+def test_beam_width_1_is_greedy_sampling(model):
+    samples, lengths = model.sample_bars(3, 2, seed=0, settings=GREEDY)
+    beams, beam_lengths, _ = beam_search(model, 3, beam_width=1, num_bars=2)
+    assert np.array_equal(beam_lengths[:, 0], lengths)
+    for sample, beam, length in zip(samples, beams[:, 0], lengths):
+        assert np.array_equal(beam[:length], sample[:length])
+
+    prompts = [piece_prompt('afternoon_in_paris', 2)] * 2
+    samples, lengths = model.sample_bars(2, 2, seed=0, primed=model.prime(prompts), settings=GREEDY)
+    beams, beam_lengths, _ = beam_search(model, 2, beam_width=1, num_bars=2, primed=model.prime(prompts))
+    assert np.array_equal(beam_lengths[:, 0], lengths)
+    assert np.array_equal(beams[:, 0, :lengths.max()], samples[:, :lengths.max()])
+
+
+def test_hypotheses_that_run_out_of_steps_are_ranked_last(model):
+    # Too few timesteps for every hypothesis to reach the end of the bar.
+    beams, lengths, scores = beam_search(model, 2, beam_width=4, num_bars=1, num_steps=2)
+    complete = np.array([[durations_from_indices(indices_from_vectors(beam[:length])).sum() >= BAR_DURATION
+                          for beam, length in zip(search, search_lengths)]
+                         for search, search_lengths in zip(beams, lengths)])
+    assert complete.any() and not complete.all()
+    for search_complete, search_scores in zip(complete, scores):
+        assert np.array_equal(search_complete, np.sort(search_complete)[::-1])  # Complete hypotheses first.
+        assert (np.diff(search_scores[search_complete]) <= 0).all()
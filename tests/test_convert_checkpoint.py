@@ -0,0 +1,110 @@
+import numpy as np
+import pytest
+
+from conftest import NUM_UNITS, random_weights
+from corpus import FIELD_SIZES
+from Model.convert_checkpoint import convert_variables, separate_heads_to_fused
+from Model.layout import HEAD_HIDDEN_SIZES, HEAD_NAMES, OUTPUT_OFFSETS, chord_masks, fused_head_init_stddevs
+from Model.layout import fused_head_masks
+from Model.numpy_engine import NumpyModel
+
+
+def random_separate_heads(seed=0, num_units=NUM_UNITS):
+    # Random variables of the separate heads, named and shaped as in their checkpoints.
+    rng = np.random.RandomState(seed)
+    variables = {}
+
+    def conv(name, num_inputs, num_outputs):
+        variables[name + '/w'] = rng.normal(0, 1 / np.sqrt(num_inputs), [1, num_inputs, num_outputs])
+        variables[name + '/b'] = rng.normal(0, 0.1, [num_outputs])
+
+    for k, head in enumerate(HEAD_NAMES):
+        conv(head + '_module/conv_1d', num_units + OUTPUT_OFFSETS[k], HEAD_HIDDEN_SIZES[k])
+        if head == 'c':
+            conv('c_module/conv_1d_1', FIELD_SIZES[k], HEAD_HIDDEN_SIZES[k])
+            conv('c_module/conv_1d_2', HEAD_HIDDEN_SIZES[k], FIELD_SIZES[k])
+        else:
+            conv(head + '_module/conv_1d_1', HEAD_HIDDEN_SIZES[k], FIELD_SIZES[k])
+    return {name: value.astype(np.float32) for name, value in variables.items()}
+
+
+def separate_heads_logits(variables, h, v):
+    # What OutputHeads computes: each head concatenates h with the fields before its own, as output_net and
+    # MaskedOutputNet do.
+    mask_in, mask_out = chord_masks()
+    fields = np.split(v, OUTPUT_OFFSETS[1:-1], axis=-1)
+
+    def conv(name, x, mask=1.0):
+        return np.dot(x, variables[name + '/w'][0] * mask) + variables[name + '/b']
+
+    logits = []
+    for k, head in enumerate(HEAD_NAMES):
+        hidden = conv(head + '_module/conv_1d', np.concatenate([h] + fields[:k], axis=-1))
+        if head == 'c':
+            hidden += conv('c_module/conv_1d_1', fields[k], mask_in)
+            logits.append(conv('c_module/conv_1d_2', np.maximum(hidden, 0), mask_out))
+        else:
+            logits.append(conv(head + '_module/conv_1d_1', np.maximum(hidden, 0)))
+    return np.concatenate(logits, axis=-1)
+
+
+def random_inputs(seed=0, num_units=NUM_UNITS):
+    # A backbone output h and teacher-forced timestep vectors v of shape [2, 3, ...].
+    rng = np.random.RandomState(seed)
+    h = rng.normal(0, 1, [2, 3, num_units]).astype(np.float32)
+    fields = [np.eye(size, dtype=np.float32)[rng.randint(size, size=[2, 3])] for size in FIELD_SIZES]
+    fields[3] = (rng.uniform(size=[2, 3, FIELD_SIZES[3]]) < 0.4).astype(np.float32)  # Chord notes are multi-hot.
+    return h, np.concatenate(fields, axis=-1)
+
+
+def test_fused_heads_match_separate_heads():
+    variables = random_separate_heads()
+    fused = separate_heads_to_fused(dict(variables, **{'lstm/w_h_gates': np.zeros([1])}))
+    assert 'lstm/w_h_gates' in fused and not any(name.startswith('p_module/') for name in fused)
+
+    # Masked and renamed as export_weights does.
+    cond_mask, out_mask = fused_head_masks()
+    weights = random_weights()
+    weights.update({
+        'heads_w_h': fused['output_heads/w_h'],
+        'heads_w_cond': fused['output_heads/w_cond'] * cond_mask,
+        'heads_b_hidden': fused['output_heads/b_hidden'],
+        'heads_w_out': fused['output_heads/w_out'] * out_mask,
+        'heads_b_out': fused['output_heads/b_out'],
+    })
+    h, v = random_inputs()
+    assert np.allclose(NumpyModel(weights).logits(h, v), separate_heads_logits(variables, h, v), atol=1e-5)
+
+
+def test_fused_heads_match_separate_heads_in_tensorflow():
+    tf = pytest.importorskip('tensorflow')
+    from Model.model_autoregressive import FusedOutputHeads, OutputHeads
+
+    h, v = random_inputs()
+    with tf.Graph().as_default():
+        logits = OutputHeads()(tf.constant(h), tf.constant(v))
+        with tf.Session() as sess:
+            sess.run(tf.global_variables_initializer())
+            expected = sess.run(logits)
+            variables = {var.op.name: sess.run(var) for var in tf.global_variables()}
+
+    fused = convert_variables(variables)
+    with tf.Graph().as_default():
+        logits = FusedOutputHeads(NUM_UNITS)(tf.constant(h), tf.constant(v))
+        with tf.Session() as sess:
+            for var in tf.global_variables():
+                var.load(fused[var.op.name], sess)
+            assert np.allclose(sess.run(logits), expected, atol=1e-5)
+
+
+def test_fused_heads_are_initialised_with_each_heads_fan_ins():
+    # Sonnet initialises each of the separate heads' weights with a stddev of 1 / sqrt(fan-in), so converting those
+    # stddevs (with zero biases) gives the stddevs FusedOutputHeads should use.
+    stddevs = {name: np.full_like(value, 1 / np.sqrt(value.shape[1]) if name.endswith('/w') else 0)
+               for name, value in random_separate_heads().items()}
+    fused = separate_heads_to_fused(stddevs)
+    cond_mask, out_mask = fused_head_masks()
+    w_h, w_cond, w_out = fused_head_init_stddevs(NUM_UNITS)
+    assert np.allclose(fused['output_heads/w_h'], w_h)
+    assert np.allclose(fused['output_heads/w_cond'] * cond_mask, w_cond * cond_mask)
+    assert np.allclose(fused['output_heads/w_out'] * out_mask, w_out * out_mask)
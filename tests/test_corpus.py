@@ -0,0 +1,23 @@
+import numpy as np
+
+from corpus import BAR_DURATION, DURATIONS, durations_from_indices, feasible_durations, indices_from_vectors
+
+
+def crosses_barline(durations):
+    ends = np.cumsum(durations)
+    return (ends - durations) // BAR_DURATION != (ends - 1) // BAR_DURATION
+
+
+def test_feasible_durations_fit_in_the_bar():
+    elapsed = np.array([0, 10, 230, 240, 475])
+    feasible = feasible_durations(elapsed)
+    assert feasible.shape == (5, 24)
+    assert feasible[0].all() and feasible[3].all()
+    assert DURATIONS[feasible[1]].max() == 230 and DURATIONS[feasible[2]].tolist() == [10]
+    assert not feasible[4].any()  # 5 left in the bar, which only a truncated corpus duration can leave.
+
+
+def test_sampled_timesteps_never_cross_a_barline(model):
+    samples, lengths = model.sample_bars(64, 4, seed=0)
+    for sample, length in zip(samples, lengths):
+        assert not crosses_barline(durations_from_indices(indices_from_vectors(sample[:length]))).any()
@@ -0,0 +1,22 @@
+import numpy as np
+
+from corpus import indices_from_vectors
+from decoder import NO_CHORD_ROOT_INDEX, chord_prefix_table, valid_chord_masks
+
+
+def test_chord_prefix_table_says_which_prefixes_complete_to_valid_chords():
+    table, valid = chord_prefix_table(), valid_chord_masks()
+    assert np.array_equal(table[12], valid)
+    for n in range(12):
+        # Mask m = prefix + (rest << n), so row `rest` of valid.reshape holds every completion of each prefix.
+        assert np.array_equal(table[n, :1 << n], valid.reshape(1 << (12 - n), 1 << n).any(axis=0))
+        assert not table[n, 1 << n:].any()  # Not a prefix of n notes.
+
+
+def test_sampled_chords_are_valid(model):
+    samples, lengths = model.sample_bars(32, 4, seed=0)
+    for sample, length in zip(samples, lengths):
+        indices = indices_from_vectors(sample[:length])
+        roots, chords = indices[:, 1], indices[:, 3]
+        assert (chords[roots == NO_CHORD_ROOT_INDEX] == 0).all()
+        assert chord_prefix_table()[12][chords[roots != NO_CHORD_ROOT_INDEX]].all()
@@ -0,0 +1,63 @@
+import os
+
+import numpy as np
+import pytest
+
+import generation_job
+from conftest import random_weights
+from generation_job import job_spec, read_json, read_pieces, run_job, shard_progress_path
+
+
+@pytest.fixture
+def weights_path(tmp_path):
+    path = str(tmp_path / 'weights.npz')
+    np.savez(path, **random_weights())
+    return path
+
+
+def generate(output_dir, spec, num_workers=1):
+    run_job(output_dir, spec, num_workers, log=lambda message: None)
+    return list(read_pieces(output_dir))
+
+
+def test_resuming_only_generates_unfinished_shards(tmp_path, weights_path, monkeypatch):
+    monkeypatch.setattr(generation_job, 'MAX_CHUNK_BYTES', 1)  # A chunk per batch.
+    spec = job_spec(weights_path, num_pieces=20, num_bars=2, shard_size=8, batch_size=4, seed=1)
+    expected = generate(str(tmp_path / 'whole'), spec)
+    assert len(expected) == 20
+    assert all(len(read_json(shard_progress_path(str(tmp_path / 'whole'), shard))['chunks']) > 1 for shard in [0, 1])
+
+    # Crash partway through shard 1: it has written its first chunk, and shard 2 hasn't started.
+    output_dir = str(tmp_path / 'resumed')
+    generate(output_dir, spec)
+    progress = read_json(shard_progress_path(output_dir, 1))
+    for chunk in progress['chunks'][1:]:
+        os.remove(os.path.join(output_dir, chunk['indices']))
+    progress['num_done'] = progress['chunks'][0]['num_pieces']
+    progress['chunks'], progress['done'] = progress['chunks'][:1], False
+    generation_job.write_json(shard_progress_path(output_dir, 1), progress)
+    os.remove(shard_progress_path(output_dir, 2))
+
+    generated = []
+    generate_shard = generation_job.generate_shard
+    monkeypatch.setattr(generation_job, 'generate_shard', lambda *args: generated.append(args[2]) or
+                        generate_shard(*args))
+    pieces = generate(output_dir, spec)
+    assert generated == [1, 2]
+    assert len(pieces) == len(expected)
+    assert all(np.array_equal(piece, expected_piece) for piece, expected_piece in zip(pieces, expected))
+
+
+def test_pieces_do_not_depend_on_the_number_of_workers(tmp_path, weights_path):
+    spec = job_spec(weights_path, num_pieces=12, num_bars=1, shard_size=4, batch_size=4, seed=2)
+    one = generate(str(tmp_path / 'one'), spec)
+    two = generate(str(tmp_path / 'two'), spec, num_workers=2)
+    assert all(np.array_equal(a, b) for a, b in zip(one, two)) and len(one) == len(two) == 12
+
+
+def test_resuming_a_different_job_is_refused(tmp_path, weights_path):
+    output_dir = str(tmp_path / 'job')
+    generate(output_dir, job_spec(weights_path, num_pieces=4, num_bars=1, shard_size=4, batch_size=4))
+    np.savez(weights_path, **random_weights(seed=1))
+    with pytest.raises(ValueError, match='weights_fingerprint'):
+        generate(output_dir, job_spec(weights_path, num_pieces=4, num_bars=1, shard_size=4, batch_size=4))
@@ -0,0 +1,18 @@
+import pytest
+
+from main import main
+
+
+@pytest.mark.parametrize('flags', [
+    '--beam-width 2 --chords afternoon_in_paris',
+    '--beam-width 2 --draft-steps 4 --num-bars 2',
+    '--draft-steps 4 --num-bars 2 --chords afternoon_in_paris',
+    '--beam-width 2 --temperature 0.5',
+    '--beam-width 2 --sampling {}',
+    '--draft-steps 4',
+    '--draft-steps 4 --num-bars 2 --prefix-cache prefix_cache.npz',
+])
+def test_conflicting_sample_flags_are_rejected(flags, capsys):
+    with pytest.raises(SystemExit):
+        main(['sample', '--weights', 'model.npz'] + flags.split())
+    assert 'error' in capsys.readouterr().err
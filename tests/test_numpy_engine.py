@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from corpus import BAR_DURATION, durations_from_indices, indices_from_vectors
+from Model.numpy_engine import SamplingSettings, settings_from_spec, truncate_bernoulli_logits, truncate_logits
+from prompts import piece_prompt
+
+LOGITS = np.log([[0.1, 0.4, 0.2, 0.3]])
+TIED_LOGITS = np.log([[0.3, 0.4, 0.3]])  # The second and third most likely classes are tied.
+
+
+def total_durations(samples, lengths):
+    return np.array([durations_from_indices(indices_from_vectors(sample[:length])).sum()
+                     for sample, length in zip(samples, lengths)])
+
+
+def test_sample_bars_samples_exactly_num_bars_bars(model):
+    num_bars = np.array([1, 2, 3, 4, 1, 2])
+    for primed in [None, model.prime([piece_prompt('afternoon_in_paris', 2)] * 6)]:
+        for settings in [None, settings_from_spec({'temperature': 1.5, 'duration': {'top_k': 3}})]:
+            samples, lengths = model.sample_bars(6, num_bars, seed=0, primed=primed, settings=settings)
+            assert np.array_equal(total_durations(samples, lengths), num_bars * BAR_DURATION)
+            assert samples.shape[1] == lengths.max()
+            assert all(not sample[length:].any() for sample, length in zip(samples, lengths))  # Zero-padded.
+
+
+def test_sample_bars_stops_at_max_steps(model):
+    samples, lengths = model.sample_bars(4, 8, max_steps=5, seed=0)
+    assert (lengths <= 5).all()
+    assert ((total_durations(samples, lengths) == 8 * BAR_DURATION) | (lengths == 5)).all()
+
+
+@pytest.mark.parametrize('logits, settings, kept', [
+    (LOGITS, SamplingSettings(), [1, 1, 1, 1]),
+    (LOGITS, SamplingSettings(top_k=1), [0, 1, 0, 0]),
+    (LOGITS, SamplingSettings(top_k=3), [0, 1, 1, 1]),
+    (LOGITS, SamplingSettings(top_k=10), [1, 1, 1, 1]),
+    (LOGITS, SamplingSettings(top_p=0.3), [0, 1, 0, 0]),
+    (LOGITS, SamplingSettings(top_p=0.6), [0, 1, 0, 1]),
+    (LOGITS, SamplingSettings(top_p=0.8), [0, 1, 1, 1]),
+    (LOGITS, SamplingSettings(top_k=2, top_p=0.8), [0, 1, 0, 1]),  # The smaller of the two sets.
+    (LOGITS, SamplingSettings(temperature=0), [0, 1, 0, 0]),
+    (LOGITS, SamplingSettings(temperature=0, top_k=3, top_p=0.9), [0, 1, 0, 0]),
+    (TIED_LOGITS, SamplingSettings(top_p=0.5), [1, 1, 1]),  # Classes tied with the last one kept are kept too.
+    (TIED_LOGITS, SamplingSettings(top_k=2), [1, 1, 1]),
+    (TIED_LOGITS, SamplingSettings(top_p=0.3), [0, 1, 0]),
+])
+def test_truncate_logits(logits, settings, kept):
+    truncated = truncate_logits(logits, settings)
+    assert np.isfinite(truncated[0]).astype(int).tolist() == kept
+    assert np.allclose(truncated[np.isfinite(truncated)], logits[np.isfinite(truncated)])  # A temperature of 1 (or 0).
+
+
+def test_truncate_logits_with_per_row_settings():
+    logits = np.repeat(LOGITS, 4, axis=0)
+    settings = SamplingSettings(temperature=np.array([0.5, 0, 2, 1]), top_k=np.array([0, 0, 3, 0]),
+                                top_p=np.array([1, 1, 1, 0.6]))
+    truncated = truncate_logits(logits, settings)
+    assert np.isfinite(truncated).astype(int).tolist() == [[1, 1, 1, 1], [0, 1, 0, 0], [0, 1, 1, 1], [0, 1, 0, 1]]
+    assert np.allclose(truncated[0], LOGITS[0] * 2) and np.allclose(truncated[2, 1:], LOGITS[0, 1:] / 2)
+
+
+def test_truncate_bernoulli_logits():
+    logits = np.array([2.0, -2.0, 0.5, -0.5, 0.0, 2.0, 0.5])
+    settings = SamplingSettings(temperature=np.array([0, 0, 1, 1, 0, 2, 1]), top_k=np.array([0, 0, 1, 1, 0, 0, 0]),
+                                top_p=np.array([1, 1, 1, 1, 1, 0.8, 0.8]))
+    truncated = truncate_bernoulli_logits(logits, settings)
+    # sigmoid(2 / 2) = 0.73 is under 0.8, and so is sigmoid(0.5) = 0.62, so neither is made certain.
+    assert truncated.tolist() == [np.inf, -np.inf, np.inf, -np.inf, np.inf, 1.0, 0.5]
+    assert truncate_bernoulli_logits(logits[:1], SamplingSettings(top_p=0.8)).tolist() == [np.inf]  # 0.88 >= 0.8.
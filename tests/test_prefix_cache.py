@@ -0,0 +1,45 @@
+import numpy as np
+
+from conftest import random_weights
+from Model.numpy_engine import NumpyModel
+from prefix_cache import PrefixStateCache
+from prompts import piece_prompt
+
+PROMPTS = [piece_prompt('afternoon_in_paris', 2), piece_prompt('all_the_things_you_are', 1),
+           piece_prompt('afternoon_in_paris', 2)]
+
+
+def assert_primed_equal(primed, expected):
+    (hidden, cell), next_inputs = primed
+    (expected_hidden, expected_cell), expected_next_inputs = expected
+    assert np.allclose(hidden, expected_hidden, atol=1e-6) and np.allclose(cell, expected_cell, atol=1e-6)
+    assert np.array_equal(next_inputs, expected_next_inputs)
+
+
+def test_cached_states_match_priming(model):
+    cache = PrefixStateCache()
+    expected = model.prime(PROMPTS)
+    assert_primed_equal(cache.prime(model, PROMPTS), expected)  # Misses, except for the repeated prompt.
+    assert (cache.hits, cache.misses) == (1, 2)
+    assert_primed_equal(cache.prime(model, PROMPTS), expected)  # Hits.
+    assert (cache.hits, cache.misses) == (4, 2) and len(cache.entries) == 2
+
+
+def test_repeated_prompts_are_primed_once(model):
+    cache = PrefixStateCache()
+    assert_primed_equal(cache.prime(model, [PROMPTS[0]] * 3), model.prime([PROMPTS[0]] * 3))
+    assert (cache.hits, cache.misses) == (2, 1) and len(cache.entries) == 1
+
+
+def test_states_of_other_weights_are_discarded(tmp_path, model):
+    path = str(tmp_path / 'prefix_cache.npz')
+    cache = PrefixStateCache(path=path)
+    cache.prime(model, PROMPTS)
+    cache.save()
+    assert len(PrefixStateCache(path=path, fingerprint=model.fingerprint).entries) == 2
+
+    other_model = NumpyModel(random_weights(seed=1))
+    assert len(PrefixStateCache(path=path, fingerprint=other_model.fingerprint).entries) == 0
+    cache = PrefixStateCache(path=path)
+    assert_primed_equal(cache.prime(other_model, PROMPTS), other_model.prime(PROMPTS))
+    assert cache.fingerprint == other_model.fingerprint
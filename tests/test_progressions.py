@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from conftest import random_weights
+from corpus import durations_from_indices, indices_from_vectors
+from decoder import decode_sample
+from Model.layout import OUTPUT_OFFSETS
+from Model.numpy_engine import TIED_PITCH_INDEX, NumpyModel
+from progressions import progression_schedule, schedule_boundaries
+from prompts import piece_prompt
+
+SCHEDULE = progression_schedule("1Dm7 1G7 2CM7 1.5Am7 2.5D7", "[8] * 4")  # Durations in minims.
+
+
+def check_melodies(schedule, samples, lengths):
+    # Every timestep keeps to the schedule: its root, bass and chord, and the end of its schedule timestep.
+    boundaries = schedule_boundaries(schedule)
+    for sample, length in zip(samples, lengths):
+        indices = indices_from_vectors(sample[:length])
+        ends = np.cumsum(durations_from_indices(indices))
+        starts = ends - durations_from_indices(indices)
+        assert ends[-1] == boundaries[-1]
+        segments = np.searchsorted(boundaries, starts, side='right')
+        assert np.array_equal(indices[:, 1:4], schedule[segments, 1:4])
+        assert (ends <= boundaries[segments]).all()  # No timestep crosses a chord change or barline.
+
+
+@pytest.mark.parametrize('with_prompts', [False, True])
+def test_melodies_keep_to_the_schedule(model, with_prompts):
+    primed = model.prime([piece_prompt('afternoon_in_paris', 2)] * 16) if with_prompts else None
+    samples, lengths = model.sample_melody(SCHEDULE, 16, seed=0, primed=primed)
+    check_melodies(SCHEDULE, samples, lengths)
+
+
+def test_prompts_condition_the_melodies(model):
+    unprimed = model.sample_melody(SCHEDULE, 4, seed=0)[0]
+    primed = model.sample_melody(SCHEDULE, 4, seed=0, primed=model.prime([piece_prompt('afternoon_in_paris', 2)] * 4))
+    assert not np.array_equal(primed[0][:, :unprimed.shape[1]], unprimed[:, :primed[0].shape[1]])
+
+
+def test_notes_held_over_chord_changes_are_tied():
+    # A model that almost always carries on the note, so the first one is held throughout.
+    weights = random_weights()
+    weights['heads_b_out'][OUTPUT_OFFSETS[0] + TIED_PITCH_INDEX] += 20
+    samples, lengths = NumpyModel(weights).sample_melody(SCHEDULE, 4, seed=0)
+    check_melodies(SCHEDULE, samples, lengths)
+    boundaries = schedule_boundaries(SCHEDULE)
+    for sample, length in zip(samples, lengths):
+        indices = indices_from_vectors(sample[:length])
+        starts = np.cumsum(durations_from_indices(indices)) - durations_from_indices(indices)
+        assert (indices[1:, 0] == TIED_PITCH_INDEX).all()
+        assert set(boundaries[:-1]) <= set(starts)  # A new (tied) timestep at every chord change and barline.
+        melody, chords, bars = decode_sample(sample[:length])
+        assert len(melody) == 1 and melody[0].duration == boundaries[-1]
+        assert len(chords) == 5 and len(bars) == 4
+
+
+def test_chords_must_fill_the_bars():
+    with pytest.raises(ValueError):
+        progression_schedule("2Dm7 2G7 4CM7", "[8] * 2")
+    with pytest.raises(ValueError):
+        progression_schedule("2Dm7 2G7 4CM7 1C7", "[8] * 4")
@@ -0,0 +1,30 @@
+import pytest
+
+import realtime
+from realtime import MemorySink, PerformanceReport, perform
+
+
+def test_performances_play_every_bar(model):
+    sink = MemorySink()
+    report = perform(model, sink, tempo=10000, num_bars=2, seed=0)
+    assert [bar.number for bar in report.bars] == [0, 1]
+    assert sink.events and report.summary().startswith('2 bars')
+
+
+@pytest.mark.parametrize('num_good_bars', [0, 1])
+def test_sampling_errors_are_raised(model, monkeypatch, num_good_bars):
+    stream_bars = realtime.stream_bars
+
+    def failing_bars(*args, **kwargs):
+        bars = stream_bars(*args, **kwargs)
+        for _ in range(num_good_bars):
+            yield next(bars)
+        raise RuntimeError("sampling failed")
+
+    monkeypatch.setattr(realtime, 'stream_bars', failing_bars)
+    with pytest.raises(RuntimeError, match='sampling failed'):
+        perform(model, MemorySink(), tempo=10000, num_bars=2, seed=0)
+
+
+def test_summary_of_no_bars():
+    assert PerformanceReport().summary().startswith('0 bars, 0 underruns')
@@ -0,0 +1,32 @@
+import numpy as np
+import pytest
+
+from corpus import indices_from_vectors
+from prompts import piece_prompt
+from rerank import RerankRequest, failed_checks, generate_and_rerank
+
+# Corpus pieces that fail full_bars or valid_chords as whole pieces.
+PIECES = ['agua_de_beber', 'alfie', 'all_the_way', 'angel_eyes', 'anthropology', 'antigua']
+
+
+@pytest.mark.parametrize('title', PIECES)
+def test_continuations_of_corpus_prompts_pass_the_checks(model, title):
+    prompt = piece_prompt(title, 8)
+    samples, lengths = model.sample_bars(8, 4, seed=0, primed=model.prime([prompt] * 8))
+    for sample, length in zip(samples, lengths):
+        candidate = np.concatenate([prompt, indices_from_vectors(sample[:length])])
+        failed = failed_checks(candidate, len(prompt))
+        assert 'full_bars' not in failed and 'valid_chords' not in failed
+
+
+def test_candidates_continue_the_prompt(model):
+    prompt = piece_prompt('afternoon_in_paris', 2)
+    candidates = dict(generate_and_rerank(model, [RerankRequest(2, prompt)], num_candidates=6, top_k=6, batch_size=4,
+                                          seed=0))[0]
+    rng = np.random.RandomState(0)
+    expected = []
+    for size in [4, 2]:
+        samples, lengths = model.sample_bars(size, 2, seed=rng.randint(2 ** 31), primed=model.prime([prompt] * size))
+        expected += [np.concatenate([prompt, indices_from_vectors(sample[:length])])
+                     for sample, length in zip(samples, lengths)]
+    assert sorted(candidate.indices.tobytes() for candidate in candidates) == sorted(e.tobytes() for e in expected)
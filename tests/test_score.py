@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+from prompts import pad_prompts
+from score import HEADS, load_pieces, numpy_log_likelihoods, score_pieces
+
+
+@pytest.fixture(scope='module')
+def pieces():
+    return list(load_pieces('corpus').values())[:9]
+
+
+def scores_by_position(model, pieces, batch_size):
+    return dict(score_pieces(numpy_log_likelihoods(model), pieces, batch_size))
+
+
+def test_scores_do_not_depend_on_the_batch(model, pieces):
+    alone = scores_by_position(model, pieces, 1)
+    assert sorted(alone) == list(range(len(pieces)))
+    for batch_size in [2, 4, 256]:
+        batched = scores_by_position(model, pieces, batch_size)
+        for i in range(len(pieces)):
+            for head in HEADS + ['total']:
+                assert batched[i][head] == pytest.approx(alone[i][head], rel=1e-5, abs=1e-3)
+    assert all(scores['total'] == pytest.approx(sum(scores[head] for head in HEADS)) for scores in alone.values())
+
+
+def test_padding_is_not_scored(model, pieces):
+    indices, lengths = pad_prompts(pieces[:2])
+    junk = indices.copy()
+    for row, length in enumerate(lengths):
+        junk[row, length:] = pieces[1 - row][:indices.shape[1] - length]
+    log_likelihoods = numpy_log_likelihoods(model)
+    scores, junk_scores = log_likelihoods(indices, lengths), log_likelihoods(junk, lengths)
+    for head in HEADS:
+        assert np.allclose(scores[head], junk_scores[head], rtol=1e-5)
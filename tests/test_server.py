@@ -0,0 +1,36 @@
+import asyncio
+import json
+
+import pytest
+
+from server import BadRequest, GenerationServer, job_from_request
+
+
+@pytest.mark.parametrize('request_json', [
+    {},
+    {'num_bars': True},
+    {'num_steps': False},
+    {'num_bars': 0},
+    {'num_bars': 1.5},
+    {'num_bars': '4'},
+    {'num_bars': 100000},
+    {'num_bars': 4, 'format': 'midi'},
+    {'num_bars': 4, 'sampling': {'temperature': True}},
+    {'num_bars': 4, 'sampling': {'chord': {'top_k': -1}}},
+    {'num_bars': 4, 'prompt': [[0, 0, 0]]},
+])
+def test_bad_requests_get_400_responses(model, request_json):
+    status, response = asyncio.run(GenerationServer(model).handle('POST', '/generate', json.dumps(request_json)))
+    assert status == 400 and response['error']
+
+
+@pytest.mark.parametrize('body', ['[1, 2]', '{"num_bars": ', '"num_bars"'])
+def test_malformed_json_gets_a_400_response(model, body):
+    assert asyncio.run(GenerationServer(model).handle('POST', '/generate', body))[0] == 400
+
+
+def test_valid_requests_make_jobs():
+    job = job_from_request({'num_bars': 4, 'sampling': {'temperature': 0.5}})
+    assert job.num_bars == 4 and job.prompt is None
+    with pytest.raises(BadRequest):
+        job_from_request({'num_bars': True})
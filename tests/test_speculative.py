@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+import speculative
+from conftest import random_weights
+from corpus import FIELD_SIZES, indices_from_vectors
+from Model.layout import HEAD_NAMES
+from Model.numpy_engine import NumpyModel, SamplingSettings
+from prompts import piece_prompt
+from speculative import NgramDraft, SpeculativeSampler, choices_from_indices, indices_from_choices
+
+GREEDY = {head: SamplingSettings(temperature=0) for head in HEAD_NAMES}
+
+
+def total_variation(a, b, size):
+    return 0.5 * np.abs(np.bincount(a, minlength=size) / len(a) - np.bincount(b, minlength=size) / len(b)).sum()
+
+
+def test_choices_round_trip():
+    indices = np.array([[3, 5, 5, 0b100010010001, 7], [37, 12, 12, 0, 23]])
+    assert choices_from_indices(indices)[0, 3:15].tolist() == [1, 0, 0, 0, 1, 0, 0, 1, 0, 0, 0, 1]
+    assert np.array_equal(indices_from_choices(choices_from_indices(indices)), indices)
+
+
+@pytest.mark.parametrize('with_prompts', [False, True])
+def test_greedy_sampling_matches_plain_sampling(model, with_prompts):
+    prompts = [piece_prompt('afternoon_in_paris', 2)] * 3 if with_prompts else None
+    primed = model.prime(prompts) if with_prompts else None
+    samples, lengths = model.sample_bars(3, 4, seed=0, primed=primed, settings=GREEDY)
+    sampler = SpeculativeSampler(model, NgramDraft.from_corpus())
+    speculative_samples, speculative_lengths = sampler.sample_bars(3, 4, seed=1, prompts=prompts, settings=GREEDY)
+    assert np.array_equal(speculative_lengths, lengths)
+    assert np.array_equal(speculative_samples, samples)
+
+
+def test_sampling_distribution_matches_plain_sampling(monkeypatch):
+    # A confident model, and a draft of its own samples, so that drafted choices are both accepted and rejected.
+    monkeypatch.setattr(speculative, 'MIN_ACCEPTED', 0.0)  # Always draft.
+    model = NumpyModel(random_weights(scale=10))
+    samples, lengths = model.sample_bars(256, 1, seed=1)
+    draft = NgramDraft([indices_from_vectors(sample[:length]) for sample, length in zip(samples, lengths)])
+    sampler = SpeculativeSampler(model, draft, num_draft=3)
+
+    num_samples = 4000
+    plain_samples, plain_lengths = model.sample_bars(num_samples, 1, seed=2)
+    speculative_samples, speculative_lengths = sampler.sample_bars(num_samples, 1, seed=3)
+    assert 1.1 < sampler.timesteps / float(sampler.rounds) < 2.0
+
+    assert total_variation(plain_lengths, speculative_lengths, 24) < 0.05
+    plain = np.stack([indices_from_vectors(sample) for sample in plain_samples[:, :3]])
+    drafted = np.stack([indices_from_vectors(sample) for sample in speculative_samples[:, :3]])
+    for field, size in enumerate(FIELD_SIZES[:3] + [1 << FIELD_SIZES[3]] + FIELD_SIZES[4:]):
+        for t in range(3):
+            assert total_variation(plain[:, t, field], drafted[:, t, field], size) < 0.05
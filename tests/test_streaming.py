@@ -0,0 +1,58 @@
+import itertools
+
+from conftest import random_weights
+from decoder import timestep_object_from_vector
+from definitions import BAR_DURATION
+from Model.layout import OUTPUT_OFFSETS
+from Model.numpy_engine import TIED_PITCH_INDEX, NumpyModel
+from streaming import stream_bars
+
+
+def fields(ts):
+    return ts.note_pitch, ts.root, ts.bass, ts.full_chordset, ts.duration, ts.same_note
+
+
+def test_bars_hold_the_generated_timesteps(model):
+    bars = list(stream_bars(model, num_bars=4, seed=0))
+    timesteps = [ts for bar in bars for ts in bar.timesteps]
+    generated = itertools.islice(model.generate(1, seed=0), len(timesteps))
+    assert [fields(ts) for ts in timesteps] == [fields(timestep_object_from_vector(vectors[0]))
+                                                for _, vectors in generated]
+    assert [bar.number for bar in bars] == [0, 1, 2, 3]
+    for bar in bars:
+        assert sum(ts.duration for ts in bar.timesteps) == BAR_DURATION
+        assert all(ts.bar_number == bar.number for ts in bar.timesteps)
+
+
+def test_tied_notes_lengthen_the_previous_bars_note():
+    # A model that usually carries on the note, and a piece whose second bar starts with a tied note.
+    weights = random_weights()
+    weights['heads_b_out'][OUTPUT_OFFSETS[0] + TIED_PITCH_INDEX] += 3
+    model = NumpyModel(weights)
+    for seed in range(100):
+        first_indices, _ = next(model.generate(1, seed=seed))
+        if first_indices[0, 0] == TIED_PITCH_INDEX:
+            continue  # Can't be decoded.
+        bars = list(stream_bars(model, num_bars=2, seed=seed))
+        if bars[1].timesteps[0].same_note:
+            break
+    else:
+        assert False, "No piece with a note tied over the barline"
+
+    streamed = stream_bars(model, num_bars=2, seed=seed)
+    first_bar = next(streamed)
+    held = first_bar.notes[-1]
+    duration_in_first_bar = held.duration
+    second_bar = next(streamed)
+    tied = list(itertools.takewhile(lambda ts: ts.same_note, second_bar.timesteps))
+    assert held.duration == duration_in_first_bar + sum(ts.duration for ts in tied)
+    assert all(note is not held for note in second_bar.notes)
+
+
+def test_pieces_that_end_mid_bar_yield_their_last_bar(model):
+    bars = list(stream_bars(model, num_steps=3, seed=0))
+    timesteps = [ts for bar in bars for ts in bar.timesteps]
+    assert len(timesteps) == 3
+    assert sum(ts.duration for ts in timesteps) % BAR_DURATION != 0
+    assert sum(ts.duration for ts in bars[-1].timesteps) < BAR_DURATION
+    assert sum(len(bar.notes) for bar in bars) == sum(not ts.same_note for ts in timesteps)